@@ -0,0 +1,337 @@
+import os
+import json
+import math
+import heapq
+
+import numpy as np
+
+from local_search import as_search_matrix, top_k
+
+# Memory budget for the (block, nlist) float32 distance matrix when assigning vectors to centroids
+ASSIGN_BLOCK_BYTES = 64 * 1024 * 1024
+# Training points per centroid drawn for k-means
+TRAIN_POINTS_PER_LIST = 256
+
+
+def squared_norms(vectors):
+    return np.einsum('ij,ij->i', vectors, vectors)
+
+
+def assign(vectors, centroids):
+    """Index of the nearest centroid for each vector"""
+    centroid_norms = squared_norms(centroids)
+    labels = np.empty(len(vectors), dtype=np.int32)
+    block_size = max(1, ASSIGN_BLOCK_BYTES // (4 * len(centroids)))
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        # |x|^2 is constant per row, so it doesn't change the argmin
+        labels[start:start + len(block)] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return labels
+
+
+def kmeans(vectors, k, iterations=20, seed=0):
+    """Lloyd's k-means; empty clusters are re-seeded from random points. k is capped at the number of vectors."""
+    rng = np.random.default_rng(seed)
+    vectors = as_search_matrix(vectors)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(vectors, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = counts == 0
+        centroids = sums / np.maximum(counts, 1)[:, None]
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+    return centroids.astype(np.float32)
+
+
+def exact_search(vectors, query, k):
+    """Brute-force L2 top-k, the ground truth for recall measurements"""
+    query = np.asarray(query, dtype=np.float32)
+    distances = np.sqrt(np.maximum(squared_norms(vectors) - 2 * vectors @ query + query @ query, 0))
+    best = top_k(distances, k)
+    return best, distances[best]
+
+
+def recall_at_k(index, vectors, queries, k=10, **search_params):
+    """Mean fraction of the exact top-k that the index returns, over queries"""
+    vectors = as_search_matrix(vectors)
+    hits = 0
+    for query in queries:
+        exact, _ = exact_search(vectors, query, k)
+        approx, _ = index.search(query, k, **search_params)
+        hits += len(np.intersect1d(exact, approx))
+    return hits / (k * len(queries))
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index with uncompressed vectors
+
+    Vectors are grouped by their nearest k-means centroid and stored
+    list-by-list in one contiguous matrix (offsets[i]:offsets[i + 1] is list i).
+    A query scans only the nprobe lists whose centroids are closest. Vectors
+    added after the last compaction are kept in a small unsorted tail and
+    scanned with a label mask.
+
+    Args:
+        centroids: (nlist, dim) coarse quantizer centroids
+    """
+
+    def __init__(self, centroids):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        dimensions = self.centroids.shape[1]
+        self.vectors = np.empty((0, dimensions), dtype=np.float32)
+        self.norms = np.empty(0, dtype=np.float32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        self._tail_vectors = np.empty((0, dimensions), dtype=np.float32)
+        self._tail_ids = np.empty(0, dtype=np.int64)
+        self._tail_labels = np.empty(0, dtype=np.int32)
+
+    @classmethod
+    def train(cls, vectors, nlist=None, iterations=20, seed=0):
+        """
+        Train the coarse quantizer on a sample of vectors
+
+        Args:
+            vectors: (n, dim) training vectors, usually the catalog itself
+            nlist: Number of inverted lists; defaults to 4 * sqrt(n), at most n
+        """
+        nlist = min(nlist or max(1, int(4 * math.sqrt(len(vectors)))), len(vectors))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(vectors), nlist * TRAIN_POINTS_PER_LIST)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+        return cls(kmeans(sample, nlist, iterations, seed))
+
+    def __len__(self):
+        return len(self.ids) + len(self._tail_ids)
+
+    def add(self, vectors, ids=None):
+        """Add vectors; ids default to consecutive positions after the current size"""
+        vectors = as_search_matrix(vectors)
+        if ids is None:
+            ids = np.arange(len(self), len(self) + len(vectors))
+        self._tail_vectors = np.concatenate([self._tail_vectors, vectors])
+        self._tail_ids = np.concatenate([self._tail_ids, np.asarray(ids, dtype=np.int64)])
+        self._tail_labels = np.concatenate([self._tail_labels, assign(vectors, self.centroids)])
+        # Keep the tail small relative to the sorted lists
+        if len(self._tail_ids) > len(self.ids) // 10:
+            self.compact()
+
+    def compact(self):
+        """Merge the unsorted tail into the per-list layout"""
+        if not len(self._tail_ids):
+            return
+        labels = np.concatenate([np.repeat(np.arange(len(self.centroids), dtype=np.int32), np.diff(self.offsets)),
+                                 self._tail_labels])
+        order = np.argsort(labels, kind="stable")
+        self.vectors = np.concatenate([np.asarray(self.vectors), self._tail_vectors])[order]
+        self.ids = np.concatenate([np.asarray(self.ids), self._tail_ids])[order]
+        self.norms = squared_norms(self.vectors)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(self.centroids)))])
+        self._tail_vectors = self._tail_vectors[:0]
+        self._tail_ids = self._tail_ids[:0]
+        self._tail_labels = self._tail_labels[:0]
+
+    def search(self, query, k=10, nprobe=8):
+        """
+        Approximate top-k by L2 distance
+
+        Args:
+            query: Query vector
+            k: Number of neighbors
+            nprobe: Number of inverted lists to scan; higher is slower and more accurate
+
+        Returns:
+            (ids, distances), nearest first
+        """
+        query = np.asarray(query, dtype=np.float32)
+        lists = top_k(squared_norms(self.centroids) - 2 * self.centroids @ query, nprobe)
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+        vectors = self.vectors[rows]
+        norms = self.norms[rows]
+        ids = self.ids[rows]
+        if len(self._tail_ids):
+            tail = np.isin(self._tail_labels, lists)
+            vectors = np.concatenate([vectors, self._tail_vectors[tail]])
+            norms = np.concatenate([norms, squared_norms(self._tail_vectors[tail])])
+            ids = np.concatenate([ids, self._tail_ids[tail]])
+        distances = np.sqrt(np.maximum(norms - 2 * vectors @ query + query @ query, 0))
+        best = top_k(distances, k)
+        return ids[best], distances[best]
+
+    def save(self, path):
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+        for name in ("centroids", "vectors", "norms", "ids", "offsets"):
+            np.save(os.path.join(path, f"{name}.npy"), np.asarray(getattr(self, name)))
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump({"type": "ivf_flat", "nlist": len(self.centroids), "size": len(self)}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a saved index; with mmap the vectors stay on disk and are paged in per probed list"""
+        mmap_mode = "r" if mmap else None
+        index = cls(np.load(os.path.join(path, "centroids.npy")))
+        index.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode=mmap_mode)
+        index.norms = np.load(os.path.join(path, "norms.npy"), mmap_mode=mmap_mode)
+        index.ids = np.load(os.path.join(path, "ids.npy"), mmap_mode=mmap_mode)
+        index.offsets = np.load(os.path.join(path, "offsets.npy"))
+        return index
+
+
+class HNSWIndex:
+    """
+    Hierarchical navigable small world graph (Malkov & Yashunin)
+
+    Node i is vector i. Each layer maps a node to its neighbor list; layer 0
+    holds every node with up to 2 * M neighbors, upper layers hold a
+    geometrically shrinking subset with up to M.
+
+    Args:
+        dimensions: Vector dimensionality
+        M: Neighbors per node on the upper layers
+        ef_construction: Candidate list size while inserting
+        seed: Seed for level assignment
+    """
+
+    def __init__(self, dimensions, M=16, ef_construction=100, seed=0):
+        self.M = M
+        self.ef_construction = ef_construction
+        self.level_mult = 1 / math.log(M)
+        self.rng = np.random.default_rng(seed)
+        self.vectors = np.empty((0, dimensions), dtype=np.float32)
+        self.layers = []
+        self.entry_point = None
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _distances(self, query, nodes):
+        diff = self.vectors[nodes] - query
+        return np.einsum('ij,ij->i', diff, diff)
+
+    def _search_layer(self, query, entry_points, ef, layer):
+        graph = self.layers[layer]
+        visited = set(entry_points)
+        distances = self._distances(query, entry_points)
+        candidates = list(zip(distances.tolist(), entry_points))
+        heapq.heapify(candidates)
+        # Max-heap (negated) of the ef best nodes found so far
+        results = [(-d, node) for d, node in candidates]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if distance > -results[0][0]:
+                break
+            neighbors = [n for n in graph.get(node, ()) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for d, neighbor in zip(self._distances(query, neighbors).tolist(), neighbors):
+                if len(results) < ef or d < -results[0][0]:
+                    heapq.heappush(candidates, (d, neighbor))
+                    heapq.heappush(results, (-d, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-d, node) for d, node in results)
+
+    def _shrink(self, node, neighbors, max_neighbors):
+        if len(neighbors) <= max_neighbors:
+            return neighbors
+        distances = self._distances(self.vectors[node], neighbors)
+        return [neighbors[i] for i in np.argsort(distances)[:max_neighbors]]
+
+    def add(self, vectors):
+        """Insert vectors; they get ids continuing from the current size"""
+        vectors = as_search_matrix(vectors)
+        start = len(self.vectors)
+        self.vectors = np.concatenate([np.asarray(self.vectors), vectors])
+        for node in range(start, len(self.vectors)):
+            self._insert(node)
+
+    def _insert(self, node):
+        query = self.vectors[node]
+        level = int(-math.log(1.0 - self.rng.random()) * self.level_mult)
+        top = len(self.layers) - 1
+        while len(self.layers) <= level:
+            self.layers.append({})
+        if self.entry_point is None:
+            for layer in range(level + 1):
+                self.layers[layer][node] = []
+            self.entry_point = node
+            return
+
+        entry_points = [self.entry_point]
+        # Greedy descent through the layers above the node's level
+        for layer in range(top, level, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, layer)[0][1]]
+        for layer in range(min(level, top), -1, -1):
+            max_neighbors = 2 * self.M if layer == 0 else self.M
+            found = self._search_layer(query, entry_points, self.ef_construction, layer)
+            neighbors = [n for _, n in found[:self.M]]
+            graph = self.layers[layer]
+            graph[node] = neighbors
+            for neighbor in neighbors:
+                graph[neighbor] = self._shrink(neighbor, graph[neighbor] + [node], max_neighbors)
+            entry_points = [n for _, n in found]
+        for layer in range(top + 1, level + 1):
+            self.layers[layer][node] = []
+        if level > top:
+            self.entry_point = node
+
+    def search(self, query, k=10, ef=64):
+        """
+        Approximate top-k by L2 distance
+
+        Args:
+            query: Query vector
+            k: Number of neighbors
+            ef: Candidate list size on layer 0; higher is slower and more accurate
+
+        Returns:
+            (ids, distances), nearest first
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.entry_point is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        entry_points = [self.entry_point]
+        for layer in range(len(self.layers) - 1, 0, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, layer)[0][1]]
+        found = self._search_layer(query, entry_points, max(ef, k), 0)[:k]
+        return (np.array([node for _, node in found], dtype=np.int64),
+                np.sqrt(np.array([d for d, _ in found], dtype=np.float32)))
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), np.asarray(self.vectors))
+        # Each layer as CSR arrays: nodes, offsets into a flat neighbor array
+        for layer, graph in enumerate(self.layers):
+            nodes = np.array(sorted(graph), dtype=np.int64)
+            lengths = [len(graph[node]) for node in nodes]
+            np.savez(os.path.join(path, f"layer-{layer}.npz"), nodes=nodes,
+                     offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+                     neighbors=np.array([n for node in nodes for n in graph[node]], dtype=np.int64))
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump({"type": "hnsw", "M": self.M, "ef_construction": self.ef_construction,
+                       "entry_point": self.entry_point, "layers": len(self.layers), "size": len(self)}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, "index.json")) as f:
+            meta = json.load(f)
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        index = cls(vectors.shape[1], M=meta["M"], ef_construction=meta["ef_construction"])
+        index.vectors = vectors
+        index.entry_point = meta["entry_point"]
+        for layer in range(meta["layers"]):
+            data = np.load(os.path.join(path, f"layer-{layer}.npz"))
+            offsets = data["offsets"]
+            neighbors = data["neighbors"].tolist()
+            index.layers.append({node: neighbors[offsets[i]:offsets[i + 1]]
+                                 for i, node in enumerate(data["nodes"].tolist())})
+        return index
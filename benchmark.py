@@ -0,0 +1,327 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+from ann import HNSWIndex, IVFFlatIndex, recall_at_k
+from clients import clickhouse_client
+from embeddings import normalize
+from filters import ProductFilter
+from generator import EMBEDDING_DIMENSIONS, SHARD_SIZE, child_seed, generate_products_batch
+from ingest import CHUNK_SIZE, create_products_table, stream_insert
+from local_search import LocalSearchBackend
+from product_io import ProductWriter, iter_product_batches, read_embeddings
+from quantize import PREFIX_DIMENSIONS, QUANTIZATIONS, PrefixIndex, QuantizedIndex
+
+# Catalog sizes benchmarked by default
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+NUM_QUERIES = 200
+WARMUP_QUERIES = 10
+K = 10
+# Search is timed without a filter, with a selective filter (pre-filter path) and with a broad one (post-filter path)
+FILTERS = {
+    'none': None,
+    'selective': ProductFilter(category='Electronics', decade=(1980, 1990)),
+    'broad': ProductFilter(condition=(3.0, None)),
+}
+# Approximate search modes; 'exact' is the brute-force scan they are measured against
+MODES = ('exact', 'ivf', 'hnsw') + QUANTIZATIONS + ('prefix',)
+DEFAULT_MODES = ['exact', 'ivf', 'int8', 'binary', 'prefix']
+# Metrics where a higher value is better; for the others (latencies, seconds) lower is better
+HIGHER_IS_BETTER = {'rows_per_second', 'qps', 'recall'}
+REGRESSION_TOLERANCE = 0.2
+
+
+def run_info():
+    """Environment recorded with every result, so runs on different machines aren't compared blindly"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def latency_stats(latencies):
+    """p50/p95/p99 in milliseconds and single-client queries per second"""
+    latencies = np.asarray(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'qps': len(latencies) / latencies.sum()}
+
+
+def timed_queries(search_fn, queries, warmup=WARMUP_QUERIES):
+    """Run search_fn over the queries one at a time; warmup queries (lazy indexes, caches) aren't timed"""
+    for query in queries[:warmup]:
+        search_fn(query)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        search_fn(query)
+        latencies[i] = time.perf_counter() - start
+    return latency_stats(latencies)
+
+
+def make_queries(embeddings, num_queries, noise=0.05, seed=0):
+    """Query vectors near random catalog rows, so every query has a meaningful neighborhood"""
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(embeddings), num_queries, replace=False))
+    queries = np.asarray(embeddings[rows], dtype=np.float32)
+    queries += rng.normal(0, noise / np.sqrt(queries.shape[1]), queries.shape).astype(np.float32)
+    return normalize(queries)
+
+
+def generate_catalog(path, num_products, dimensions, block_size=SHARD_SIZE, seed=42):
+    """
+    Generate a catalog block by block, timing generation and the file write separately
+
+    Blocks are seeded like generator.py's --batch mode, so the file matches its output.
+    """
+    generate_seconds = write_seconds = 0.0
+    with ProductWriter(path, num_products, dimensions) as writer:
+        for start in range(0, num_products, block_size):
+            n = min(block_size, num_products - start)
+            began = time.perf_counter()
+            batch = generate_products_batch(n, seed=child_seed(seed, start // block_size), start_id=start + 1,
+                                            dimensions=dimensions)
+            generated = time.perf_counter()
+            writer.write(batch)
+            generate_seconds += generated - began
+            write_seconds += time.perf_counter() - generated
+        began = time.perf_counter()
+    # Closing flushes the embedding sidecar, which is part of the write
+    write_seconds += time.perf_counter() - began
+    size_bytes = sum(os.path.getsize(p) for p in writer.paths)
+    return [
+        {'benchmark': 'generate', 'seconds': generate_seconds, 'rows_per_second': num_products / generate_seconds},
+        {'benchmark': 'write', 'seconds': write_seconds, 'rows_per_second': num_products / write_seconds,
+         'bytes': size_bytes},
+    ]
+
+
+def read_catalog(path, num_products):
+    """Time a full streaming read, embeddings included"""
+    start = time.perf_counter()
+    for batch in iter_product_batches(path):
+        # Sidecar slices are memory-mapped; copying forces the read
+        np.array(batch['embedding'])
+    seconds = time.perf_counter() - start
+    return {'benchmark': 'read', 'seconds': seconds, 'rows_per_second': num_products / seconds}
+
+
+def build_index(mode, embeddings, args):
+    """(index, search params) for an approximate mode, or (None, {}) for the exact scan"""
+    if mode == 'exact':
+        return None, {}
+    if mode == 'ivf':
+        index = IVFFlatIndex.train(embeddings)
+        index.add(embeddings)
+        return index, {'nprobe': args.nprobe}
+    if mode == 'hnsw':
+        index = HNSWIndex(embeddings.shape[1])
+        index.add(embeddings)
+        return index, {'ef': args.ef}
+    if mode == 'prefix':
+        return PrefixIndex.build(embeddings, args.prefix_dimensions), {'rerank': args.rerank}
+    return QuantizedIndex.build(embeddings, mode), {'rerank': args.rerank}
+
+
+def benchmark_local(path, num_products, queries, args):
+    """Backend load, then per mode: index build, recall@k vs. the exact scan, and search latency per filter"""
+    records = []
+    start = time.perf_counter()
+    backend = LocalSearchBackend.from_file(path, embed_fn=None, metric='cosine')
+    seconds = time.perf_counter() - start
+    records.append({'benchmark': 'ingest', 'seconds': seconds, 'rows_per_second': num_products / seconds})
+
+    for mode in args.modes:
+        start = time.perf_counter()
+        index, params = build_index(mode, backend.embeddings, args)
+        build_seconds = time.perf_counter() - start
+        backend.index, backend.index_params = index, params
+        if index is not None:
+            records.append({'benchmark': 'recall', 'mode': mode, 'k': args.k, 'build_seconds': build_seconds,
+                            'recall': recall_at_k(index, backend.embeddings, queries, args.k, **params), **params})
+        for name in args.filters:
+            stats = timed_queries(lambda query: backend.search_vector(query, args.k, FILTERS[name]), queries)
+            records.append({'benchmark': 'search', 'mode': mode, 'filter': name, 'k': args.k, **params, **stats})
+    return records
+
+
+def benchmark_clickhouse(path, num_products, queries, dimensions, args):
+    """
+    Insert the catalog's own embeddings into scratch tables, then time the production search per mode and filter
+
+    Searches go through search.search_embedding, so the selective filter takes the filter_ids pre-filter path
+    and quantized and prefix modes run their shortlist first pass. Each of those modes gets its own table with
+    the matching code or prefix columns; 'ivf' and 'hnsw' are local only and skipped. For the approximate modes
+    a recall record compares the unfiltered top-k product_ids with the in-process exact cosine scan.
+    """
+    from quantize import code_columns_ddl
+    from search import reset_source_indexes, search_embedding
+
+    # The pre-filter resolves ProductFilters against this catalog, which is exactly what the tables hold
+    reset_source_indexes(path)
+    records = []
+    expected = None
+    if any(mode not in ('exact', 'ivf', 'hnsw') for mode in args.modes):
+        backend = LocalSearchBackend.from_file(path, embed_fn=None, metric='cosine')
+        expected = [backend.search_vector(query, args.k)['product_id'].to_numpy() for query in queries]
+        del backend
+    with clickhouse_client() as client:
+        for mode in args.modes:
+            if mode in ('ivf', 'hnsw'):
+                continue
+            quantization = mode if mode in QUANTIZATIONS else None
+            prefix_dimensions = args.prefix_dimensions if mode == 'prefix' else None
+            table = f'nostalgia_bin_bench_{num_products}' + ('' if mode == 'exact' else f'_{mode}')
+            extra_columns = code_columns_ddl(quantization, client) if quantization else ''
+            if prefix_dimensions:
+                extra_columns += ',\n    embedding_prefix Array(Float32)'
+            client.command(f'DROP TABLE IF EXISTS {table}')
+            create_products_table(client, table, dimensions, extra_columns)
+            stats = stream_insert(client, iter_product_batches(path, batch_size=CHUNK_SIZE), None, table=table,
+                                  total=num_products, quantization=quantization,
+                                  prefix_dimensions=prefix_dimensions)
+            records.append({'benchmark': 'ingest', 'mode': mode, 'seconds': stats['seconds'],
+                            'rows_per_second': stats['rows_per_second']})
+
+            def search(query, filter_conditions=None):
+                return search_embedding(query, args.k, filter_conditions, ['product_id'], args.rerank, table,
+                                        quantization, prefix_dimensions)
+
+            params = {} if mode == 'exact' else {'rerank': args.rerank}
+            if mode != 'exact':
+                hits = sum(len(np.intersect1d(search(query)['product_id'], exact))
+                           for query, exact in zip(queries, expected))
+                records.append({'benchmark': 'recall', 'mode': mode, 'k': args.k, **params,
+                                'recall': hits / (args.k * len(queries))})
+            for name in args.filters:
+                stats = timed_queries(lambda query: search(query, FILTERS[name]), queries)
+                records.append({'benchmark': 'search', 'mode': mode, 'filter': name, 'k': args.k, **params, **stats})
+            if not args.keep_tables:
+                client.command(f'DROP TABLE {table}')
+    return records
+
+
+def result_key(record):
+    # Results are only comparable when the workload and the search parameters match
+    return tuple(record.get(key) for key in ('benchmark', 'backend', 'size', 'dimensions', 'mode', 'filter', 'k',
+                                             'nprobe', 'ef', 'rerank'))
+
+
+def find_regressions(records, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compare results with a baseline run
+
+    Args:
+        records: Results of this run
+        baseline: Results of an earlier run (e.g. read back from its JSON lines file)
+        tolerance: Allowed relative change in the bad direction
+
+    Returns:
+        List of (key, metric, baseline value, new value) that got worse by more than tolerance
+    """
+    previous = {result_key(record): record for record in baseline}
+    regressions = []
+    for record in records:
+        before = previous.get(result_key(record))
+        if before is None:
+            continue
+        for metric in ('rows_per_second', 'qps', 'recall', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if metric not in record or metric not in before or not before[metric]:
+                continue
+            change = (record[metric] - before[metric]) / before[metric]
+            if (-change if metric in HIGHER_IS_BETTER else change) > tolerance:
+                regressions.append((result_key(record), metric, before[metric], record[metric]))
+    return regressions
+
+
+def read_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def format_record(record):
+    fields = [f"{key}={record[key]}" for key in ('size', 'backend', 'mode', 'filter') if key in record]
+    metrics = [f"{key}={record[key]:.4g}" for key in ('rows_per_second', 'recall', 'p50_ms', 'p95_ms', 'p99_ms', 'qps')
+               if key in record]
+    return f"{record['benchmark']:<8} " + ' '.join(fields + metrics)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark generation, file I/O, ingest and vector search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Catalog sizes")
+    parser.add_argument("--backend", choices=["local", "clickhouse"], default="local",
+                        help="In-process LocalSearchBackend, or the ClickHouse server from the CLICKHOUSE_* variables")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=DEFAULT_MODES,
+                        help="Search modes ('hnsw' builds slowly beyond ~100k products; "
+                             "'ivf' and 'hnsw' are local only)")
+    parser.add_argument("--filters", nargs="+", choices=sorted(FILTERS), default=list(FILTERS))
+    parser.add_argument("--queries", type=int, default=NUM_QUERIES)
+    parser.add_argument("--k", type=int, default=K)
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS)
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    parser.add_argument("--nprobe", type=int, default=8, help="IVF lists probed per query")
+    parser.add_argument("--ef", type=int, default=64, help="HNSW search breadth")
+    parser.add_argument("--rerank", type=int, help="Shortlist re-ranked by quantized and prefix modes")
+    parser.add_argument("--prefix-dimensions", type=int, default=PREFIX_DIMENSIONS)
+    parser.add_argument("--output-dir", help="Keep generated catalogs here and reuse them on later runs "
+                                             "(default: a temporary directory)")
+    parser.add_argument("--keep-tables", action="store_true", help="Don't drop the ClickHouse benchmark tables")
+    parser.add_argument("--results", default="benchmark_results.jsonl", help="JSON lines file results are appended to")
+    parser.add_argument("--baseline", help="Results file of an earlier run; exit non-zero on regressions")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="nostalgia_bench_")
+    os.makedirs(output_dir, exist_ok=True)
+    info = run_info()
+    records = []
+    try:
+        for size in args.sizes:
+            path = os.path.join(output_dir, f"products_{size}_{args.dimensions}.{args.format}")
+            size_records = []
+            if not os.path.exists(path):
+                size_records += generate_catalog(path, size, args.dimensions)
+            size_records.append(read_catalog(path, size))
+            queries = make_queries(read_embeddings(path), min(args.queries, size))
+            if args.backend == "local":
+                size_records += benchmark_local(path, size, queries, args)
+            else:
+                size_records += benchmark_clickhouse(path, size, queries, args.dimensions, args)
+
+            with open(args.results, "a") as f:
+                for record in size_records:
+                    record = {'size': size, 'dimensions': args.dimensions, 'backend': args.backend, **record, **info}
+                    f.write(json.dumps(record) + "\n")
+                    records.append(record)
+                    print(format_record(record))
+    finally:
+        if not args.output_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    if args.baseline:
+        regressions = find_regressions(records, read_results(args.baseline), args.tolerance)
+        for key, metric, before, after in regressions:
+            print(f"REGRESSION {' '.join(str(part) for part in key if part is not None)}: "
+                  f"{metric} {before:.4g} -> {after:.4g}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
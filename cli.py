@@ -0,0 +1,108 @@
+import sys
+import json
+import argparse
+import threading
+
+# Subcommand modules are imported inside their handlers, so each command only pays for what it uses
+# and `search` starts without loading the ingest stack, pandas or the OpenAI SDK
+
+
+def run_generate(args):
+    from generator import main
+
+    main(args.generator_args)
+
+
+def run_load(args):
+    import loader
+
+    loader.load(args.products or loader.PRODUCTS_PATH, resume_after=args.resume_after)
+    if args.examples:
+        loader.run_examples()
+
+
+def product_filter(args):
+    """ProductFilter from the search filter options, None without any"""
+    from filters import ProductFilter
+
+    product_filter = ProductFilter(
+        category=args.category, subcategory=args.subcategory, era=args.era,
+        decade=tuple(args.decade) if args.decade else None, price=tuple(args.price) if args.price else None,
+        condition=tuple(args.condition) if args.condition else None, materials=args.material, colors=args.color
+    )
+    return product_filter or None
+
+
+def run_search(args):
+    import search
+
+    filter_conditions = args.where or product_filter(args)
+    search_fn = search.hybrid_search if args.hybrid else search.vector_search
+    columns = args.columns or search.SEARCH_COLUMNS
+    if args.query:
+        queries = [args.query]
+    else:
+        # Worker mode: one query per stdin line over warm connections; the first query's setup
+        # (connections, pandas, local indexes) happens in the background while waiting for input
+        threading.Thread(target=search.warm_up, daemon=True).start()
+        queries = (line.strip() for line in sys.stdin)
+
+    for query in queries:
+        if not query:
+            continue
+        try:
+            results = search_fn(query, top_n=args.top_n, filter_conditions=filter_conditions, columns=columns)
+        except Exception as e:
+            if args.query:
+                raise
+            print(f"Search failed for {query!r}: {e}", file=sys.stderr)
+            continue
+        if args.json:
+            print(json.dumps({'query': query, 'results': json.loads(results.to_json(orient='records'))}),
+                  flush=True)
+        else:
+            print(f"\nQuery: {query}\n{results.to_string(index=False)}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate, load and search vintage products")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser("generate", add_help=False,
+                                          help="Generate synthetic products (takes generator.py's options)")
+    generate_parser.set_defaults(handler=run_generate)
+
+    load_parser = commands.add_parser("load", help="Sync a product file into ClickHouse")
+    load_parser.add_argument("--products", help="Product file or sharded dataset (default: PRODUCTS_PATH)")
+    load_parser.add_argument("--resume-after", type=int, help="Continue a failed load after this product_id")
+    load_parser.add_argument("--examples", action="store_true", help="Run the example searches afterwards")
+    load_parser.set_defaults(handler=run_load)
+
+    search_parser = commands.add_parser("search", help="Search products; without a query, read one per stdin line")
+    search_parser.add_argument("query", nargs="?")
+    search_parser.add_argument("--top-n", type=int, default=5)
+    search_parser.add_argument("--hybrid", action="store_true", help="Fuse keyword (BM25) and vector rankings")
+    search_parser.add_argument("--columns", nargs="+", help="Columns to return")
+    search_parser.add_argument("--json", action="store_true", help="Print one JSON object per query")
+    search_parser.add_argument("--where", help="Raw SQL filter (without the WHERE), instead of the options below")
+    search_parser.add_argument("--category", nargs="+")
+    search_parser.add_argument("--subcategory", nargs="+")
+    search_parser.add_argument("--era", nargs="+")
+    search_parser.add_argument("--decade", type=int, nargs=2, metavar=("LOW", "HIGH"))
+    search_parser.add_argument("--price", type=float, nargs=2, metavar=("LOW", "HIGH"))
+    search_parser.add_argument("--condition", type=float, nargs=2, metavar=("LOW", "HIGH"))
+    search_parser.add_argument("--material", nargs="+")
+    search_parser.add_argument("--color", nargs="+")
+    search_parser.set_defaults(handler=run_search)
+
+    # generate passes everything it doesn't recognize on to generator.py
+    args, unknown = parser.parse_known_args(argv)
+    if args.command == "generate":
+        args.generator_args = unknown
+    elif unknown:
+        parser.error(f"unrecognized arguments: {' '.join(unknown)}")
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
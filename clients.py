@@ -0,0 +1,155 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+# Clients checked out at once; further callers wait for one to be returned
+MAX_CLICKHOUSE_CLIENTS = 8
+CHECKOUT_TIMEOUT = 30
+
+_lock = threading.Lock()
+_openai_client = None
+_clickhouse_pool = None
+
+
+def openai_client():
+    """
+    Shared OpenAI client, created on first use
+
+    The client keeps its own pool of HTTP connections, so reusing one instance
+    keeps connections to the API warm across requests. Reads OPENAI_API_KEY and,
+    when set, OPENAI_BASE_URL (e.g. a local fake endpoint).
+    """
+    global _openai_client
+    with _lock:
+        if _openai_client is None:
+            # Imported here so processes that never embed don't pay for the import
+            from openai import OpenAI
+
+            _openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        return _openai_client
+
+
+class ClickHousePool:
+    """
+    Lazily created clickhouse_connect clients sharing one HTTP connection pool
+
+    A clickhouse_connect client must not run two queries at once, so each
+    caller checks one out for the duration of its query. All clients share a
+    single urllib3 pool manager, so TCP connections stay open across queries
+    instead of being re-established per request. Clients are only created when
+    no idle one is available, up to max_clients.
+
+    Args:
+        max_clients: Maximum number of clients (and concurrent queries)
+        timeout: Seconds to wait for a free client before raising queue.Empty
+        client_args: Passed to clickhouse_connect.get_client
+    """
+
+    def __init__(self, max_clients=MAX_CLICKHOUSE_CLIENTS, timeout=CHECKOUT_TIMEOUT, **client_args):
+        self.max_clients = max_clients
+        self.timeout = timeout
+        self.client_args = client_args
+        # LIFO hands out the most recently used client, whose connection is most likely still open
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._pool_manager = None
+
+    def _create(self):
+        import clickhouse_connect
+        from clickhouse_connect.driver import httputil
+
+        if self._pool_manager is None:
+            self._pool_manager = httputil.get_pool_manager(maxsize=self.max_clients)
+        # Session ids would serialize queries per client and aren't needed for stateless reads
+        return clickhouse_connect.get_client(pool_mgr=self._pool_manager, autogenerate_session_id=False,
+                                             **self.client_args)
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.max_clients
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get(timeout=self.timeout)
+        try:
+            return self._create()
+        except BaseException:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def client(self):
+        """Check out a client for one query (or a few sequential ones)"""
+        client = self._checkout()
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._created -= 1
+
+
+def clickhouse_pool():
+    """Shared ClickHousePool, configured from the CLICKHOUSE_* environment variables"""
+    global _clickhouse_pool
+    with _lock:
+        if _clickhouse_pool is None:
+            _clickhouse_pool = ClickHousePool(
+                host=os.getenv('CLICKHOUSE_HOST'),
+                port=int(os.getenv('CLICKHOUSE_PORT', 8443)),
+                username=os.getenv('CLICKHOUSE_USERNAME'),
+                password=os.getenv('CLICKHOUSE_PASSWORD', ''),
+                secure=os.getenv('CLICKHOUSE_SECURE', '').lower() in ('1', 'true')
+            )
+        return _clickhouse_pool
+
+
+def clickhouse_client():
+    """Check out a client from the shared pool: `with clickhouse_client() as client: ...`"""
+    return clickhouse_pool().client()
+
+
+def async_openai_client():
+    """
+    New AsyncOpenAI client, for use on one event loop
+
+    Async clients hold connections bound to the loop they were first used on,
+    so unlike openai_client() they aren't shared process-wide.
+    """
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+
+
+async def async_clickhouse_client(max_connections=MAX_CLICKHOUSE_CLIENTS):
+    """
+    New async clickhouse_connect client (requires aiohttp), configured like clickhouse_pool()
+
+    Its connector keeps up to max_connections pooled connections open, and
+    unlike the sync clients one async client runs concurrent queries.
+    """
+    import clickhouse_connect
+
+    return await clickhouse_connect.get_async_client(
+        host=os.getenv('CLICKHOUSE_HOST'),
+        port=int(os.getenv('CLICKHOUSE_PORT', 8443)),
+        username=os.getenv('CLICKHOUSE_USERNAME'),
+        password=os.getenv('CLICKHOUSE_PASSWORD', ''),
+        secure=os.getenv('CLICKHOUSE_SECURE', '').lower() in ('1', 'true'),
+        connector_limit=max_connections,
+        autogenerate_session_id=False
+    )
@@ -0,0 +1,156 @@
+import os
+import hashlib
+
+import numpy as np
+
+from metrics import metrics
+
+# Keys are 16-byte BLAKE2b digests of (model, dimensions, text)
+KEY_SIZE = 16
+KEY_DTYPE = f"S{KEY_SIZE}"
+
+# Rewrite the cache once more than this fraction of its rows is no longer referenced
+MAX_STALE_FRACTION = 0.25
+
+
+def cache_key(model, dimensions, text):
+    digest = hashlib.blake2b(digest_size=KEY_SIZE)
+    digest.update(f"{model}\0{dimensions}\0".encode("utf-8"))
+    digest.update(text.encode("utf-8"))
+    return digest.digest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed, on-disk embedding cache
+
+    Vectors live in a raw float32 matrix (vectors.f32) that is memory-mapped on
+    open, with a parallel file of fixed-size keys (keys.bin). Lookups go through a
+    sorted copy of the keys, so the index stays a pair of NumPy arrays no matter
+    how large the cache grows.
+    """
+
+    def __init__(self, path, model, dimensions):
+        self.model = model
+        self.dimensions = dimensions
+        self.path = os.path.join(path, f"{model}-{dimensions}")
+        self.keys_path = os.path.join(self.path, "keys.bin")
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        os.makedirs(self.path, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+        self._open()
+
+    def _open(self):
+        if os.path.exists(self.keys_path):
+            self.keys = np.fromfile(self.keys_path, dtype=KEY_DTYPE)
+        else:
+            self.keys = np.empty(0, dtype=KEY_DTYPE)
+        # Drop vector rows written without a matching key (e.g. an interrupted append)
+        row_bytes = self.dimensions * 4
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) > len(self.keys) * row_bytes:
+            os.truncate(self.vectors_path, len(self.keys) * row_bytes)
+        if len(self.keys):
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                     shape=(len(self.keys), self.dimensions))
+        else:
+            self.vectors = np.empty((0, self.dimensions), dtype=np.float32)
+        self._order = np.argsort(self.keys, kind="stable")
+        self._sorted_keys = self.keys[self._order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def key(self, text):
+        return cache_key(self.model, self.dimensions, text)
+
+    def lookup(self, keys):
+        """Return the cache row for each key, or -1 where the key is missing"""
+        keys = np.asarray(keys, dtype=KEY_DTYPE)
+        if not len(self.keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_keys, keys)
+        pos = np.minimum(pos, len(self._sorted_keys) - 1)
+        found = self._sorted_keys[pos] == keys
+        return np.where(found, self._order[pos], -1)
+
+    def add(self, keys, vectors):
+        keys = np.asarray(keys, dtype=KEY_DTYPE)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        # Vectors first, keys second: a crash in between only leaves rows that _open() trims
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.keys_path, "ab") as f:
+            f.write(keys.tobytes())
+
+        # Merge the new keys into the sorted index instead of re-reading and re-sorting the whole file
+        rows = np.arange(len(self.keys), len(self.keys) + len(keys))
+        new_order = np.argsort(keys, kind="stable")
+        positions = np.searchsorted(self._sorted_keys, keys[new_order], side="right")
+        self._sorted_keys = np.insert(self._sorted_keys, positions, keys[new_order])
+        self._order = np.insert(self._order, positions, rows[new_order])
+        self.keys = np.concatenate([self.keys, keys])
+        # Re-mapping the grown file reads nothing
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                 shape=(len(self.keys), self.dimensions))
+
+    def get_or_embed(self, texts, embed_fn):
+        """
+        Return embeddings for texts, embedding only those not already cached
+
+        Args:
+            texts: List of texts
+            embed_fn: Called with a list of unique uncached texts, returns their embeddings
+
+        Returns:
+            float32 array of shape (len(texts), dimensions) in the order of texts
+        """
+        keys = [self.key(text) for text in texts]
+        # Identical texts (common with templated descriptions) are embedded once per run
+        unique = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, text)
+        self.duplicates += len(keys) - len(unique)
+
+        unique_keys = list(unique)
+        rows = self.lookup(unique_keys)
+        missing = [key for key, row in zip(unique_keys, rows) if row < 0]
+        self.hits += len(unique_keys) - len(missing)
+        self.misses += len(missing)
+        metrics.increment('embedding_cache_hits', len(unique_keys) - len(missing))
+        metrics.increment('embedding_cache_misses', len(missing))
+        if missing:
+            self.add(missing, embed_fn([unique[key] for key in missing]))
+        return np.asarray(self.vectors[self.lookup(keys)])
+
+    def compact(self, live_keys, max_stale_fraction=MAX_STALE_FRACTION):
+        """
+        Evict rows whose keys are not in live_keys
+
+        The files are only rewritten once the stale fraction exceeds
+        max_stale_fraction, so most runs don't pay for a full copy.
+
+        Returns:
+            Number of rows evicted
+        """
+        live = np.isin(self.keys, np.asarray(list(live_keys), dtype=KEY_DTYPE))
+        stale = int((~live).sum())
+        if not stale or stale <= max_stale_fraction * len(self.keys):
+            return 0
+        keys = self.keys[live]
+        vectors = np.asarray(self.vectors[live])
+        # Write to temporary files and swap them in so a crash never leaves a torn cache
+        vectors.tofile(self.vectors_path + ".tmp")
+        keys.tofile(self.keys_path + ".tmp")
+        self.vectors = None
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.keys_path + ".tmp", self.keys_path)
+        self._open()
+        return stale
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (f"Embedding cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), "
+                f"{self.duplicates} duplicate texts skipped, {len(self)} vectors stored")
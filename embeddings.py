@@ -0,0 +1,138 @@
+import time
+import random
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tqdm.auto import tqdm
+
+from metrics import metrics
+
+# Defaults for the OpenAI embedding model used throughout the project
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536
+BATCH_SIZE = 256
+MAX_CONCURRENT_BATCHES = 4
+MAX_RETRIES = 6
+
+
+@functools.lru_cache(maxsize=None)
+def retryable_errors():
+    """Errors worth retrying: rate limits, timeouts and transient server failures"""
+    # Imported on first use; the openai package alone takes over half a second to import
+    import openai
+
+    return (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    )
+
+
+def _dimensions_arg(dimensions):
+    # text-embedding-3 models return shortened vectors on request; omitted means the model's full size
+    return {} if dimensions is None else {'dimensions': dimensions}
+
+
+def get_embedding(client, text, model=EMBEDDING_MODEL, dimensions=None):
+    """Embed a single text (used for interactive queries)"""
+    with metrics.stage('embedding_request'):
+        response = client.embeddings.create(model=model, input=text, **_dimensions_arg(dimensions))
+    _count_usage(response, 1)
+    return response.data[0].embedding
+
+
+def normalize(vectors):
+    """Scale vectors (a single vector or rows of a matrix) to unit length as float32"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+
+
+def truncate(vectors, dimensions):
+    """
+    Keep the first dimensions components and re-normalize
+
+    text-embedding-3 vectors are trained so that a prefix is itself a usable,
+    lower-resolution embedding (this is what the API's dimensions option does).
+    """
+    return normalize(np.asarray(vectors)[..., :dimensions])
+
+
+def _count_usage(response, texts):
+    metrics.increment('embedding_requests')
+    metrics.increment('embeddings_requested', texts)
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        metrics.increment('embedding_tokens', usage.total_tokens)
+
+
+def _create_with_backoff(client, batch, model, max_retries, dimensions=None):
+    # Exponential backoff with jitter, capped at 30s between attempts
+    for attempt in range(max_retries + 1):
+        try:
+            with metrics.stage('embedding_request'):
+                return client.embeddings.create(model=model, input=batch, **_dimensions_arg(dimensions))
+        except retryable_errors():
+            if attempt == max_retries:
+                raise
+            metrics.increment('embedding_retries')
+            time.sleep(min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random()))
+
+
+def _embed_batch(client, batch, model, max_retries, dimensions=None):
+    response = _create_with_backoff(client, batch, model, max_retries, dimensions)
+    _count_usage(response, len(batch))
+    # The API tags each vector with its input position, don't rely on response order
+    vectors = [None] * len(batch)
+    for item in response.data:
+        vectors[item.index] = item.embedding
+    return vectors
+
+
+async def embed_texts_async(client, texts, model=EMBEDDING_MODEL, dimensions=None):
+    """
+    Embed texts in one request with an async OpenAI client (AsyncOpenAI retries rate limits itself)
+
+    Returns:
+        List of embeddings in the same order as texts
+    """
+    with metrics.stage('embedding_request'):
+        response = await client.embeddings.create(model=model, input=texts, **_dimensions_arg(dimensions))
+    _count_usage(response, len(texts))
+    vectors = [None] * len(texts)
+    for item in response.data:
+        vectors[item.index] = item.embedding
+    return vectors
+
+
+def embed_texts(client, texts, model=EMBEDDING_MODEL, batch_size=BATCH_SIZE,
+                max_concurrent=MAX_CONCURRENT_BATCHES, max_retries=MAX_RETRIES,
+                show_progress=True, dimensions=None):
+    """
+    Embed many texts with batched, concurrent requests
+
+    Args:
+        client: OpenAI client (or anything exposing embeddings.create)
+        texts: List of texts to embed
+        model: Embedding model name
+        batch_size: Number of texts packed into each request
+        max_concurrent: Maximum number of batches in flight at once
+        max_retries: Retries per batch on rate limits and transient errors
+        dimensions: Request shortened embeddings (text-embedding-3 models); None for the full size
+
+    Returns:
+        List of embeddings in the same order as texts
+    """
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    embeddings = []
+    with ThreadPoolExecutor(max_workers=max_concurrent) as pool:
+        # map() yields results in submission order, so ordering is preserved
+        results = pool.map(lambda batch: _embed_batch(client, batch, model, max_retries, dimensions),
+                           batches)
+        with tqdm(total=len(texts), disable=not show_progress) as progress:
+            for vectors in results:
+                embeddings.extend(vectors)
+                progress.update(len(vectors))
+    return embeddings
@@ -0,0 +1,204 @@
+import numpy as np
+
+# Columns with one value per product, and with a list of values per product
+SCALAR_FILTER_COLUMNS = ['category', 'subcategory', 'era', 'decade', 'condition_rating', 'price_dollars']
+ARRAY_FILTER_COLUMNS = ['materials', 'colors']
+# Columns that also support (low, high) range conditions
+RANGE_FILTER_COLUMNS = ['decade', 'condition_rating', 'price_dollars']
+
+# Below this estimated fraction of matching rows, candidates are collected before any
+# distance math (pre-filter); above it, scoring everything and masking is cheaper (post-filter)
+PREFILTER_SELECTIVITY = 0.25
+
+
+def _sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class ProductFilter:
+    """
+    Typed product filter, usable both locally and in ClickHouse
+
+    Every argument is optional; given ones are combined with AND.
+
+    Args:
+        category, subcategory, era: A value or a list of accepted values
+        decade, price, condition: (low, high) range, low <= value < high; either bound may be None
+        materials, colors: A value or a list; matches products having any of them
+    """
+
+    def __init__(self, category=None, subcategory=None, era=None, decade=None, price=None, condition=None,
+                 materials=None, colors=None):
+        conditions = {
+            'category': category, 'subcategory': subcategory, 'era': era, 'decade': decade,
+            'price_dollars': price, 'condition_rating': condition, 'materials': materials, 'colors': colors
+        }
+        for column in ('decade', 'price_dollars', 'condition_rating'):
+            if conditions[column] is not None and not isinstance(conditions[column], tuple):
+                raise ValueError(f"{column} takes a (low, high) range")
+        # The same dict format LocalSearchBackend.filter_mask takes
+        self.conditions = {column: condition for column, condition in conditions.items() if condition is not None}
+
+    def __bool__(self):
+        return bool(self.conditions)
+
+    def __repr__(self):
+        return f"ProductFilter({self.conditions!r})"
+
+    def to_sql(self):
+        """WHERE clause (without the 'WHERE') with escaped literals"""
+        clauses = []
+        for column, condition in self.conditions.items():
+            if isinstance(condition, tuple):
+                low, high = condition
+                if low is not None:
+                    clauses.append(f"{column} >= {_sql_literal(low)}")
+                if high is not None:
+                    clauses.append(f"{column} < {_sql_literal(high)}")
+                continue
+            values = condition if isinstance(condition, (list, set, frozenset)) else [condition]
+            literals = ', '.join(_sql_literal(value) for value in values)
+            if column in ARRAY_FILTER_COLUMNS:
+                clauses.append(f"hasAny({column}, [{literals}])")
+            else:
+                clauses.append(f"{column} IN ({literals})")
+        return ' AND '.join(clauses)
+
+
+class FilterIndex:
+    """
+    Per-value sorted row lists over the structured product columns
+
+    Each column's rows are grouped by value (offsets[i]:offsets[i + 1] of rows
+    holds the ascending rows whose value is values[i]; array columns list a row
+    under each of its values). Range conditions binary-search a value-sorted
+    row order. Counts come straight from the offsets, so a filter's selectivity
+    is estimated without touching any rows, and the most selective condition's
+    rows are collected first and checked against the others.
+
+    Args:
+        columns: Dict of column name -> per-row values (arrays, or lists of lists for array columns)
+    """
+
+    def __init__(self, columns):
+        self.size = len(next(iter(columns.values())))
+        self.columns = {}
+        self.values = {}
+        self.offsets = {}
+        self.rows = {}
+        self.sorted_values = {}
+        self.sorted_rows = {}
+        for column in SCALAR_FILTER_COLUMNS + ARRAY_FILTER_COLUMNS:
+            if column not in columns:
+                continue
+            if column in ARRAY_FILTER_COLUMNS:
+                lists = columns[column]
+                lengths = np.fromiter((len(values) for values in lists), dtype=np.int64, count=len(lists))
+                flat = np.array([value for values in lists for value in values])
+                rows = np.repeat(np.arange(len(lists)), lengths)
+            else:
+                flat = np.asarray(columns[column])
+                rows = np.arange(len(flat))
+                self.columns[column] = flat
+            values, codes = np.unique(flat, return_inverse=True)
+            if column in self.columns and column not in RANGE_FILTER_COLUMNS:
+                # Checked as integer codes; comparing strings row by row is far slower
+                self.columns[column] = codes.astype(np.int32)
+            order = np.argsort(codes, kind='stable')
+            self.values[column] = values
+            self.offsets[column] = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(values)))])
+            # Array columns can repeat a value within a row; rows stay ascending per value either way
+            self.rows[column] = rows[order]
+            if column in RANGE_FILTER_COLUMNS:
+                order = np.argsort(flat, kind='stable')
+                self.sorted_values[column] = flat[order]
+                self.sorted_rows[column] = order
+
+    def _value_codes(self, column, condition):
+        """Positions in values[column] of the condition's values that occur in the column"""
+        values = condition if isinstance(condition, (list, set, frozenset)) else [condition]
+        codes = []
+        for value in values:
+            i = np.searchsorted(self.values[column], value)
+            if i < len(self.values[column]) and self.values[column][i] == value:
+                codes.append(i)
+        return codes
+
+    def _value_spans(self, column, condition):
+        return [(self.offsets[column][i], self.offsets[column][i + 1]) for i in self._value_codes(column, condition)]
+
+    def _range_span(self, column, condition):
+        low, high = condition
+        sorted_values = self.sorted_values[column]
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        stop = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side='left')
+        return start, max(start, stop)
+
+    def count(self, column, condition):
+        """Rows matching one condition (an upper bound for array columns with several values)"""
+        if isinstance(condition, tuple):
+            start, stop = self._range_span(column, condition)
+            return stop - start
+        return sum(stop - start for start, stop in self._value_spans(column, condition))
+
+    def selectivity(self, conditions):
+        """Estimated fraction of rows matching all conditions, assuming independent columns"""
+        fraction = 1.0
+        for column, condition in conditions.items():
+            fraction *= min(1.0, self.count(column, condition) / max(self.size, 1))
+        return fraction
+
+    def rows_for(self, column, condition, sort=True):
+        """Rows matching one condition, ascending unless sort is False (range conditions skip a sort)"""
+        if isinstance(condition, tuple):
+            start, stop = self._range_span(column, condition)
+            rows = self.sorted_rows[column][start:stop]
+            return self._sorted_unique(rows) if sort else rows
+        spans = self._value_spans(column, condition)
+        if len(spans) == 1 and column not in ARRAY_FILTER_COLUMNS:
+            return self.rows[column][spans[0][0]:spans[0][1]]
+        rows = np.concatenate([self.rows[column][start:stop] for start, stop in spans] or [np.empty(0, dtype=np.int64)])
+        return self._sorted_unique(rows) if sort or column in ARRAY_FILTER_COLUMNS else rows
+
+    def _sorted_unique(self, rows):
+        if len(rows) > self.size // 32:
+            # A scatter into a row mask is linear and beats sorting large candidate sets
+            mask = np.zeros(self.size, dtype=bool)
+            mask[rows] = True
+            return np.flatnonzero(mask)
+        return np.unique(rows)
+
+    def _check(self, rows, column, condition):
+        """Subset of rows that also match condition"""
+        if column not in self.columns:
+            return np.intersect1d(rows, self.rows_for(column, condition), assume_unique=True)
+        values = self.columns[column][rows]
+        if isinstance(condition, tuple):
+            low, high = condition
+            keep = np.ones(len(rows), dtype=bool)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values < high
+            return rows[keep]
+        if column in RANGE_FILTER_COLUMNS:
+            accepted = list(condition) if isinstance(condition, (list, set, frozenset)) else [condition]
+        else:
+            # Categorical columns are stored as integer codes
+            accepted = self._value_codes(column, condition)
+        return rows[np.isin(values, accepted)]
+
+    def select(self, conditions):
+        """Sorted rows matching all conditions, starting from the most selective one"""
+        if not conditions:
+            return np.arange(self.size)
+        ordered = sorted(conditions.items(), key=lambda item: self.count(*item))
+        rows = self.rows_for(*ordered[0], sort=False)
+        for column, condition in ordered[1:]:
+            if not len(rows):
+                break
+            rows = self._check(rows, column, condition)
+        # Ascending rows keep the embedding gather sequential
+        return self._sorted_unique(rows)
@@ -1,10 +1,16 @@
 import random
 import json
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
 import datetime
 from faker import Faker
 import numpy as np
 from tqdm import tqdm
 
+from metrics import metrics
+from product_io import ProductWriter, batch_to_products, file_sha256, products_to_batch
+
 fake = Faker()
 
 # Seed for reproducibility
@@ -15,6 +21,8 @@ fake.seed_instance(42)
 # Constants
 NUM_PRODUCTS = 10000
 CURRENT_YEAR = 2025
+# Mock embedding size (common for many embedding models); override with --dimensions
+EMBEDDING_DIMENSIONS = 384
 
 # Product categories and subcategories
 CATEGORIES = {
@@ -90,6 +98,32 @@ CULTURAL_REFS = {
     2000: ["Y2K", "9/11", "Early Internet", "iPod", "Harry Potter", "Nokia"]
 }
 
+# Condition ratings, weighted towards better condition
+CONDITIONS = [1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]
+CONDITION_WEIGHTS = [0.01, 0.02, 0.05, 0.07, 0.15, 0.2, 0.3, 0.1, 0.1]
+
+CONDITION_DESCRIPTIONS = {
+    1.0: "Poor condition with significant damage, but still possesses historical value. A restoration project.",
+    1.5: "Fair condition with notable wear and tear. Requires restoration.",
+    2.0: "Acceptable condition with visible age-related wear. Functional but has imperfections.",
+    2.5: "Moderate condition with some signs of age. Mostly functional with minor issues.",
+    3.0: "Good condition for its age. Shows expected patina and minor wear.",
+    3.5: "Very good condition with light signs of use. All original components intact.",
+    4.0: "Excellent condition with minimal wear. Maintains original finish and functionality.",
+    4.5: "Near mint condition. Minimal signs of age or use. Highly collectible state.",
+    5.0: "Mint condition. Appears almost new despite its age. Museum quality piece."
+}
+
+# Base price ranges by category
+BASE_PRICE_RANGES = {
+    "Furniture": (50, 2000),
+    "Electronics": (30, 1000),
+    "Media": (5, 200),
+    "Fashion": (20, 500),
+    "Home Decor": (15, 400),
+    "Collectibles": (10, 1000)
+}
+
 # Helper functions
 def get_random_era():
     era = random.choice(list(ERAS.keys()))
@@ -108,23 +142,11 @@ def get_colors(count=None):
 
 def get_condition():
     # Weighted towards better condition
-    conditions = [1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]
-    weights = [0.01, 0.02, 0.05, 0.07, 0.15, 0.2, 0.3, 0.1, 0.1]
-    return random.choices(conditions, weights=weights)[0]
+    return random.choices(CONDITIONS, weights=CONDITION_WEIGHTS)[0]
 
 def get_price(category, condition, decade):
-    # Base ranges by category
-    base_ranges = {
-        "Furniture": (50, 2000),
-        "Electronics": (30, 1000),
-        "Media": (5, 200),
-        "Fashion": (20, 500),
-        "Home Decor": (15, 400),
-        "Collectibles": (10, 1000)
-    }
-    
     # Calculate base price
-    base_min, base_max = base_ranges[category]
+    base_min, base_max = BASE_PRICE_RANGES[category]
     base_price = random.uniform(base_min, base_max)
     
     # Adjust by condition (better condition = higher price)
@@ -153,57 +175,57 @@ def get_price(category, condition, decade):
     
     return price
 
-def generate_name(category, subcategory, era, decade, materials):
+def generate_name(category, subcategory, era, decade, materials, rng=random, names=fake):
     # Different naming patterns
     patterns = [
-        f"{random.choice(DESIGN_STYLES[decade])} {subcategory.rstrip('s')}",
+        f"{rng.choice(DESIGN_STYLES[decade])} {subcategory.rstrip('s')}",
         f"{era} {subcategory.rstrip('s')}",
-        f"{random.choice(materials)} {subcategory.rstrip('s')}",
-        f"{random.choice(CULTURAL_REFS[decade])} Era {subcategory.rstrip('s')}",
+        f"{rng.choice(materials)} {subcategory.rstrip('s')}",
+        f"{rng.choice(CULTURAL_REFS[decade])} Era {subcategory.rstrip('s')}",
         f"{decade}s {subcategory.rstrip('s')}",
         f"Vintage {subcategory.rstrip('s')}"
     ]
     
     # Choose a pattern and add some randomization
-    base_name = random.choice(patterns)
+    base_name = rng.choice(patterns)
     
     # Add brand or designer sometimes
-    if random.random() < 0.4:
+    if rng.random() < 0.4:
         designers = [
-            fake.last_name(), 
-            f"{fake.last_name()} & {fake.last_name()}",
-            f"{fake.first_name()} {fake.last_name()}"
+            names.last_name(), 
+            f"{names.last_name()} & {names.last_name()}",
+            f"{names.first_name()} {names.last_name()}"
         ]
-        designer = random.choice(designers)
+        designer = rng.choice(designers)
         return f"{designer} {base_name}"
     
     # Add origin country sometimes
-    if random.random() < 0.3:
+    if rng.random() < 0.3:
         countries = ["Danish", "Swedish", "Italian", "French", "American", "Japanese", "German", "British"]
-        country = random.choice(countries)
+        country = rng.choice(countries)
         return f"{country} {base_name}"
     
     # Add specific model or style sometimes
-    if random.random() < 0.3:
+    if rng.random() < 0.3:
         models = ["Deluxe", "Standard", "Custom", "Limited Edition", "Special", "Signature", "Premium"]
-        model = random.choice(models)
+        model = rng.choice(models)
         return f"{base_name} - {model} Model"
     
     return base_name
 
-def generate_description(category, subcategory, era, decade, materials, colors, condition):
+def generate_description(category, subcategory, era, decade, materials, colors, condition, rng=random):
     # Start with aesthetic/stylistic description
-    style_desc = random.choice([
+    style_desc = rng.choice([
         f"A beautiful example of {era} design.",
         f"Classic {decade}s {subcategory.lower()}.",
-        f"Showcases quintessential {random.choice(DESIGN_STYLES[decade])} aesthetics.",
-        f"Embodies the {era} period with its {random.choice(['clean lines', 'ornate details', 'minimalist approach', 'bold geometry'])}.",
-        f"A {random.choice(['rare', 'stunning', 'pristine', 'remarkable'])} piece from the {decade}s."
+        f"Showcases quintessential {rng.choice(DESIGN_STYLES[decade])} aesthetics.",
+        f"Embodies the {era} period with its {rng.choice(['clean lines', 'ornate details', 'minimalist approach', 'bold geometry'])}.",
+        f"A {rng.choice(['rare', 'stunning', 'pristine', 'remarkable'])} piece from the {decade}s."
     ])
     
     # Add material description
     material_list = ", ".join(materials[:-1]) + " and " + materials[-1] if len(materials) > 1 else materials[0]
-    material_desc = random.choice([
+    material_desc = rng.choice([
         f"Crafted from {material_list}.",
         f"Made with high-quality {material_list}.",
         f"Features {material_list} construction.",
@@ -212,98 +234,86 @@ def generate_description(category, subcategory, era, decade, materials, colors,
     
     # Add color description
     color_list = ", ".join(colors[:-1]) + " and " + colors[-1] if len(colors) > 1 else colors[0]
-    color_desc = random.choice([
-        f"Comes in {random.choice(['vibrant', 'rich', 'deep', 'soft', 'muted'])} {color_list}.",
-        f"The {color_list} {random.choice(['tones', 'hues', 'colors', 'palette'])} {random.choice(['evoke', 'reflect', 'capture'])} the {decade}s aesthetic.",
-        f"Features a {random.choice(['striking', 'classic', 'subtle', 'bold'])} {color_list} {random.choice(['finish', 'color scheme', 'palette'])}."
+    color_desc = rng.choice([
+        f"Comes in {rng.choice(['vibrant', 'rich', 'deep', 'soft', 'muted'])} {color_list}.",
+        f"The {color_list} {rng.choice(['tones', 'hues', 'colors', 'palette'])} {rng.choice(['evoke', 'reflect', 'capture'])} the {decade}s aesthetic.",
+        f"Features a {rng.choice(['striking', 'classic', 'subtle', 'bold'])} {color_list} {rng.choice(['finish', 'color scheme', 'palette'])}."
     ])
     
     # Add condition description
-    condition_descriptions = {
-        1.0: "Poor condition with significant damage, but still possesses historical value. A restoration project.",
-        1.5: "Fair condition with notable wear and tear. Requires restoration.",
-        2.0: "Acceptable condition with visible age-related wear. Functional but has imperfections.",
-        2.5: "Moderate condition with some signs of age. Mostly functional with minor issues.",
-        3.0: "Good condition for its age. Shows expected patina and minor wear.",
-        3.5: "Very good condition with light signs of use. All original components intact.",
-        4.0: "Excellent condition with minimal wear. Maintains original finish and functionality.",
-        4.5: "Near mint condition. Minimal signs of age or use. Highly collectible state.",
-        5.0: "Mint condition. Appears almost new despite its age. Museum quality piece."
-    }
-    condition_desc = condition_descriptions[condition]
+    condition_desc = CONDITION_DESCRIPTIONS[condition]
     
     # Add cultural context
-    cultural_context = random.choice([
-        f"Popular during the era of {random.choice(CULTURAL_REFS[decade])}.",
-        f"This piece captures the zeitgeist of {random.choice(CULTURAL_REFS[decade])}.",
-        f"A nostalgic reminder of {random.choice(CULTURAL_REFS[decade])}.",
-        f"Would have been found in {random.choice(['stylish homes', 'upscale apartments', 'trendy spaces', 'fashionable interiors'])} during the {decade}s."
+    cultural_context = rng.choice([
+        f"Popular during the era of {rng.choice(CULTURAL_REFS[decade])}.",
+        f"This piece captures the zeitgeist of {rng.choice(CULTURAL_REFS[decade])}.",
+        f"A nostalgic reminder of {rng.choice(CULTURAL_REFS[decade])}.",
+        f"Would have been found in {rng.choice(['stylish homes', 'upscale apartments', 'trendy spaces', 'fashionable interiors'])} during the {decade}s."
     ])
     
     # Add emotional appeal
-    emotional_appeal = random.choice([
-        f"Evokes a sense of {random.choice(['nostalgia', 'history', 'timeless elegance', 'retro charm', 'vintage cool'])}.",
-        f"A conversation piece that brings {random.choice(['warmth', 'character', 'history', 'charm'])} to any space.",
-        f"Collectors prize these for their {random.choice(['distinctive character', 'historical significance', 'iconic design', 'nostalgic appeal'])}.",
-        f"Represents a bygone era of {random.choice(['craftsmanship', 'design innovation', 'style', 'cultural expression'])}."
+    emotional_appeal = rng.choice([
+        f"Evokes a sense of {rng.choice(['nostalgia', 'history', 'timeless elegance', 'retro charm', 'vintage cool'])}.",
+        f"A conversation piece that brings {rng.choice(['warmth', 'character', 'history', 'charm'])} to any space.",
+        f"Collectors prize these for their {rng.choice(['distinctive character', 'historical significance', 'iconic design', 'nostalgic appeal'])}.",
+        f"Represents a bygone era of {rng.choice(['craftsmanship', 'design innovation', 'style', 'cultural expression'])}."
     ])
     
     # Combine elements with some randomization
     description_elements = [style_desc, material_desc, color_desc, condition_desc, cultural_context, emotional_appeal]
-    random.shuffle(description_elements)
+    rng.shuffle(description_elements)
     
     # Add some category-specific details
     if category == "Furniture":
-        furniture_details = random.choice([
-            f"Features {random.choice(['tapered legs', 'curved lines', 'geometric patterns', 'organic forms', 'minimal ornamentation', 'sculptural elements'])}.",
-            f"The {random.choice(['proportions', 'silhouette', 'form', 'structure'])} exemplifies {era} design philosophy.",
-            f"Offers both {random.choice(['form and function', 'style and comfort', 'beauty and utility', 'aesthetics and practicality'])}."
+        furniture_details = rng.choice([
+            f"Features {rng.choice(['tapered legs', 'curved lines', 'geometric patterns', 'organic forms', 'minimal ornamentation', 'sculptural elements'])}.",
+            f"The {rng.choice(['proportions', 'silhouette', 'form', 'structure'])} exemplifies {era} design philosophy.",
+            f"Offers both {rng.choice(['form and function', 'style and comfort', 'beauty and utility', 'aesthetics and practicality'])}."
         ])
         description_elements.append(furniture_details)
     
     elif category == "Electronics":
-        electronics_details = random.choice([
-            f"Still {random.choice(['functions perfectly', 'works as intended', 'operates well', 'performs admirably'])} after all these years.",
-            f"Features {random.choice(['analog controls', 'vacuum tubes', 'mechanical components', 'early digital technology', 'tactile interfaces'])}.",
-            f"Represents {random.choice(['early innovation', 'technological breakthroughs', 'engineering excellence', 'design evolution'])} of its time."
+        electronics_details = rng.choice([
+            f"Still {rng.choice(['functions perfectly', 'works as intended', 'operates well', 'performs admirably'])} after all these years.",
+            f"Features {rng.choice(['analog controls', 'vacuum tubes', 'mechanical components', 'early digital technology', 'tactile interfaces'])}.",
+            f"Represents {rng.choice(['early innovation', 'technological breakthroughs', 'engineering excellence', 'design evolution'])} of its time."
         ])
         description_elements.append(electronics_details)
     
     elif category == "Media":
-        media_details = random.choice([
-            f"Contains {random.choice(['rare recordings', 'sought-after content', 'nostalgic programming', 'classic performances', 'period-specific material'])}.",
-            f"A {random.choice(['time capsule', 'cultural artifact', 'preserved memory', 'historical document'])} from the {decade}s.",
-            f"Coveted by {random.choice(['collectors', 'enthusiasts', 'archivists', 'nostalgists'])} for its {random.choice(['rarity', 'content', 'condition', 'cultural significance'])}."
+        media_details = rng.choice([
+            f"Contains {rng.choice(['rare recordings', 'sought-after content', 'nostalgic programming', 'classic performances', 'period-specific material'])}.",
+            f"A {rng.choice(['time capsule', 'cultural artifact', 'preserved memory', 'historical document'])} from the {decade}s.",
+            f"Coveted by {rng.choice(['collectors', 'enthusiasts', 'archivists', 'nostalgists'])} for its {rng.choice(['rarity', 'content', 'condition', 'cultural significance'])}."
         ])
         description_elements.append(media_details)
     
     # Add origin information sometimes
-    if random.random() < 0.4:
+    if rng.random() < 0.4:
         origins = ["American", "Scandinavian", "Italian", "French", "German", "Japanese", "British", "Dutch"]
-        origin = random.choice(origins)
-        origin_desc = random.choice([
+        origin = rng.choice(origins)
+        origin_desc = rng.choice([
             f"Of {origin} origin.",
             f"Designed and crafted in {origin.replace('American', 'America').replace('British', 'Britain').replace('Dutch', 'the Netherlands')}.",
-            f"Shows classic {origin} {random.choice(['craftsmanship', 'design sensibilities', 'aesthetics', 'influences'])}.",
-            f"Part of the {origin} {random.choice(['design movement', 'artistic tradition', 'manufacturing excellence', 'creative heritage'])} of the period."
+            f"Shows classic {origin} {rng.choice(['craftsmanship', 'design sensibilities', 'aesthetics', 'influences'])}.",
+            f"Part of the {origin} {rng.choice(['design movement', 'artistic tradition', 'manufacturing excellence', 'creative heritage'])} of the period."
         ])
         description_elements.append(origin_desc)
     
     # Assemble final description with random length
-    final_desc_length = random.randint(3, len(description_elements))
+    final_desc_length = rng.randint(3, len(description_elements))
     final_description = " ".join(description_elements[:final_desc_length])
     
     return final_description
 
-def generate_embedding():
+def generate_embedding(dimensions=EMBEDDING_DIMENSIONS):
     """Generate a mock embedding that simulates a real embedding vector"""
-    # Using a dimensionality of 384 (common for many embedding models)
-    vector = np.random.normal(0, 0.1, 384)
+    vector = np.random.normal(0, 0.1, dimensions)
     # Normalize to unit vector (common practice for embeddings)
     vector = vector / np.linalg.norm(vector)
     return vector.tolist()
 
-def generate_product():
+def generate_product(dimensions=EMBEDDING_DIMENSIONS):
     # Select category and subcategory
     category = random.choice(list(CATEGORIES.keys()))
     subcategory = random.choice(CATEGORIES[category])
@@ -324,7 +334,7 @@ def generate_product():
     description = generate_description(category, subcategory, era, decade, materials, colors, condition)
     
     # Generate mock embedding vector
-    embedding = generate_embedding()
+    embedding = generate_embedding(dimensions)
     
     # Generate random date added (within last 3 years)
     days_ago = random.randint(0, 3 * 365)
@@ -347,22 +357,310 @@ def generate_product():
         "date_added": date_str
     }
 
-# Generate products
-products = []
-for i in tqdm(range(NUM_PRODUCTS), desc="Generating products"):
-    product = generate_product()
-    product["product_id"] = i + 1
-    products.append(product)
-
-# Save to JSON file
-with open('nostalgia_bin_products.json', 'w') as f:
-    json.dump(products, f, indent=2)
-
-print(f"Generated {NUM_PRODUCTS} vintage products and saved to nostalgia_bin_products.json")
-
-# Display a sample product
-sample = random.choice(products)
-print("\nSample Product:")
-for key, value in sample.items():
-    if key != "embedding":  # Skip embedding for readability
-        print(f"{key}: {value}")
\ No newline at end of file
+# Batch (columnar) generation
+# Lookup tables flattened into arrays so whole columns can be sampled at once
+CATEGORY_NAMES = np.array(list(CATEGORIES.keys()))
+SUBCATEGORY_NAMES = np.array([sub for subs in CATEGORIES.values() for sub in subs])
+SUBCATEGORY_OFFSETS = np.cumsum([0] + [len(subs) for subs in CATEGORIES.values()])[:-1]
+SUBCATEGORY_COUNTS = np.array([len(subs) for subs in CATEGORIES.values()])
+ERA_NAMES = np.array(list(ERAS.keys()))
+ERA_DECADES = np.array([decade for decades in ERAS.values() for decade in decades])
+ERA_OFFSETS = np.cumsum([0] + [len(decades) for decades in ERAS.values()])[:-1]
+ERA_COUNTS = np.array([len(decades) for decades in ERAS.values()])
+MATERIAL_COUNTS = np.array([len(MATERIALS[category]) for category in CATEGORIES])
+MATERIAL_TABLE = np.array([MATERIALS[category] + [""] * (MATERIAL_COUNTS.max() - len(MATERIALS[category]))
+                           for category in CATEGORIES])
+COLOR_NAMES = np.array(COLORS)
+PRICE_MIN = np.array([BASE_PRICE_RANGES[category][0] for category in CATEGORIES], dtype=np.float64)
+PRICE_MAX = np.array([BASE_PRICE_RANGES[category][1] for category in CATEGORIES], dtype=np.float64)
+
+# Dates in batch mode are relative to a fixed point so output only depends on the seed
+REFERENCE_DATE = np.datetime64(f"{CURRENT_YEAR}-01-01T00:00:00", "s")
+NAME_POOL_SIZE = 1000
+
+class NamePool:
+    """Stands in for Faker in batch mode: draws names from a pre-generated, seeded pool"""
+
+    def __init__(self, seed, rng, size=NAME_POOL_SIZE):
+        faker = Faker()
+        faker.seed_instance(seed)
+        self.first_names = [faker.first_name() for _ in range(size)]
+        self.last_names = [faker.last_name() for _ in range(size)]
+        self.rng = rng
+
+    def first_name(self):
+        return self.rng.choice(self.first_names)
+
+    def last_name(self):
+        return self.rng.choice(self.last_names)
+
+def _sample_without_replacement(rng, n, pool_sizes, counts, max_count=3):
+    # Random sort keys per row; entries past the row's pool size sort last
+    keys = rng.random((n, pool_sizes.max()), dtype=np.float32)
+    keys[np.arange(pool_sizes.max()) >= pool_sizes[:, None]] = 2.0
+    picks = np.argpartition(keys, max_count - 1, axis=1)[:, :max_count]
+    return picks, np.minimum(counts, pool_sizes)
+
+def _sample_prices(rng, category_idx, condition, decade):
+    n = len(category_idx)
+    base_price = rng.uniform(PRICE_MIN[category_idx], PRICE_MAX[category_idx])
+    condition_multiplier = 0.5 + (condition / 5.0)
+    # Same age brackets as get_price
+    age = CURRENT_YEAR - decade
+    age_low = np.select([age > 100, age > 70, age > 40], [1.5, 1.2, 0.9], 0.7)
+    age_high = np.select([age > 100, age > 70, age > 40], [3.0, 2.0, 1.5], 1.2)
+    age_multiplier = rng.uniform(age_low, age_high)
+    unique_factor = rng.uniform(0.8, 1.5, n)
+    price = base_price * condition_multiplier * age_multiplier * unique_factor
+    return np.where(price > 100, np.round(price, -1), np.round(price, 1))
+
+def generate_embeddings(rng, n, dimensions=EMBEDDING_DIMENSIONS):
+    """Generate a block of mock unit-length embeddings with a single draw"""
+    vectors = rng.standard_normal((n, dimensions), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def child_seed(seed, index):
+    """
+    Seed of the index-th child of seed, equal to SeedSequence(seed).spawn(index + 1)[index]
+
+    Built directly rather than through spawn() so it never depends on how many
+    children were spawned before.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (index,))
+
+def _int_seed(seed):
+    return int(seed.generate_state(1)[0])
+
+def generate_products_batch(n, seed=42, start_id=1, dimensions=EMBEDDING_DIMENSIONS):
+    """
+    Generate a block of products as columns
+
+    Scalar columns are sampled as whole arrays; only the name and description
+    templates are filled in row by row.
+
+    Args:
+        n: Number of products
+        seed: Seed (int or SeedSequence) for this block; the same seed always produces the same block
+        start_id: product_id of the first product
+        dimensions: Embedding dimensionality
+
+    Returns:
+        Dict of column name to NumPy array (or list, for string and array columns)
+    """
+    # Independent streams for the array columns and the row-wise text templates
+    rng = np.random.default_rng(child_seed(seed, 0))
+    text_rng = random.Random(_int_seed(child_seed(seed, 1)))
+    names = NamePool(_int_seed(child_seed(seed, 2)), text_rng)
+
+    category_idx = rng.integers(0, len(CATEGORY_NAMES), n)
+    subcategory_idx = SUBCATEGORY_OFFSETS[category_idx] + rng.integers(0, SUBCATEGORY_COUNTS[category_idx])
+    era_idx = rng.integers(0, len(ERA_NAMES), n)
+    decade = ERA_DECADES[ERA_OFFSETS[era_idx] + rng.integers(0, ERA_COUNTS[era_idx])]
+
+    material_picks, material_counts = _sample_without_replacement(
+        rng, n, MATERIAL_COUNTS[category_idx], rng.integers(1, 4, n))
+    material_names = MATERIAL_TABLE[category_idx[:, None], material_picks]
+    color_picks, color_counts = _sample_without_replacement(
+        rng, n, np.full(n, len(COLORS)), rng.integers(1, 4, n))
+    color_names = COLOR_NAMES[color_picks]
+
+    condition = rng.choice(np.array(CONDITIONS), size=n, p=CONDITION_WEIGHTS)
+    price = _sample_prices(rng, category_idx, condition, decade)
+    embedding = generate_embeddings(rng, n, dimensions)
+    # Any second of the last three years, so times of day vary like the row path's
+    seconds_ago = rng.integers(0, (3 * 365 + 1) * 86400, n)
+    date_added = REFERENCE_DATE - seconds_ago.astype("timedelta64[s]")
+
+    category = CATEGORY_NAMES[category_idx]
+    subcategory = SUBCATEGORY_NAMES[subcategory_idx]
+    era = ERA_NAMES[era_idx]
+    materials = [row[:count] for row, count in zip(material_names.tolist(), material_counts.tolist())]
+    colors = [row[:count] for row, count in zip(color_names.tolist(), color_counts.tolist())]
+
+    # Text fields reuse the row-wise templates, fed from the block's own RNG
+    name = []
+    description = []
+    for row in zip(category.tolist(), subcategory.tolist(), era.tolist(), decade.tolist(),
+                   materials, colors, condition.tolist()):
+        name.append(generate_name(*row[:5], rng=text_rng, names=names))
+        description.append(generate_description(*row, rng=text_rng))
+
+    return {
+        "product_id": np.arange(start_id, start_id + n, dtype=np.uint32),
+        "name": name,
+        "category": category,
+        "subcategory": subcategory,
+        "era": era,
+        "decade": decade.astype(np.uint16),
+        "materials": materials,
+        "colors": colors,
+        "condition_rating": condition.astype(np.float32),
+        "price_dollars": price.astype(np.float32),
+        "description": description,
+        "embedding": embedding,
+        "date_added": date_added
+    }
+
+# Sharded generation
+SHARD_SIZE = 100_000
+MANIFEST_NAME = "manifest.json"
+
+SHARD_EXTENSIONS = {"json": ".json", "ndjson": ".ndjson", "parquet": ".parquet"}
+
+def _generate_shard(task):
+    index, seed, shard_size, num_products, output_dir, dimensions, file_format = task
+    start = index * shard_size
+    n = min(shard_size, num_products - start)
+    batch = generate_products_batch(n, seed=child_seed(seed, index), start_id=start + 1, dimensions=dimensions)
+    filename = f"shard-{index:05d}{SHARD_EXTENSIONS[file_format]}"
+    with ProductWriter(os.path.join(output_dir, filename), n, dimensions) as writer:
+        writer.write(batch)
+    return {
+        "path": filename,
+        "first_product_id": start + 1,
+        "num_products": n,
+        "sha256": file_sha256(*writer.paths)
+    }
+
+def generate_sharded(num_products, output_dir, shard_size=SHARD_SIZE, workers=None, seed=42,
+                     dimensions=EMBEDDING_DIMENSIONS, file_format="ndjson"):
+    """
+    Generate products in fixed-size shards on a process pool
+
+    Shard boundaries and seeds depend only on shard_size and seed, never on the
+    number of workers, so the combined dataset is identical for any worker count.
+    Shard i covers product_ids [i * shard_size + 1, (i + 1) * shard_size] and is
+    seeded with the i-th child of SeedSequence(seed).
+
+    Args:
+        num_products: Total number of products
+        output_dir: Directory for shard files and the manifest
+        shard_size: Products per shard
+        workers: Number of worker processes (defaults to the CPU count)
+        seed: Seed for the whole dataset
+        dimensions: Embedding dimensionality
+        file_format: Shard format, one of "json", "ndjson" or "parquet"
+
+    Returns:
+        The manifest dict, also written to output_dir/manifest.json
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    num_shards = -(-num_products // shard_size)
+    tasks = [(index, seed, shard_size, num_products, output_dir, dimensions, file_format)
+             for index in range(num_shards)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        shards = list(tqdm(pool.map(_generate_shard, tasks), total=num_shards, desc="Generating shards"))
+
+    manifest = {
+        "seed": seed,
+        "num_products": num_products,
+        "shard_size": shard_size,
+        "embedding_dimensions": dimensions,
+        "format": file_format,
+        "shards": shards
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic vintage products")
+    parser.add_argument("--num-products", type=int, default=NUM_PRODUCTS)
+    parser.add_argument("--output", default="nostalgia_bin_products.json",
+                        help="Output file; .json, .ndjson/.jsonl or .parquet (the last two add an "
+                             ".embeddings.npy sidecar)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Generate products as columnar blocks (fast, for load testing)")
+    parser.add_argument("--block-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output-dir",
+                        help="Write sharded output plus a manifest to this directory (implies --batch)")
+    parser.add_argument("--format", choices=sorted(SHARD_EXTENSIONS), default="ndjson",
+                        help="File format for sharded output")
+    parser.add_argument("--workers", type=int, help="Worker processes for sharded output")
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS,
+                        help="Mock embedding dimensionality")
+    parser.add_argument("--metrics", help="Write stage timings, counters and memory use to this JSON file")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="cProfile the generation loop and write the stats to DIR")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Record exact per-stage Python allocation peaks (tracemalloc, slower)")
+    parser.add_argument("--trace-rss", action="store_true",
+                        help="Record resident memory growth of top-level stages")
+    args = parser.parse_args(argv)
+    if args.profile:
+        metrics.enable_profiling(args.profile)
+    if args.trace_memory:
+        metrics.trace_memory()
+    if args.trace_rss:
+        metrics.trace_rss()
+    try:
+        _generate(args)
+    finally:
+        if args.metrics:
+            metrics.write_summary(args.metrics)
+
+def _generate(args):
+    if args.output_dir:
+        # Shards are timed as a whole; the worker processes have registries of their own
+        with metrics.stage("generate_sharded"), metrics.profile("generate_sharded"):
+            manifest = generate_sharded(args.num_products, args.output_dir, shard_size=args.block_size,
+                                        workers=args.workers, seed=args.seed, dimensions=args.dimensions,
+                                        file_format=args.format)
+        metrics.increment("products_generated", args.num_products)
+        print(f"Generated {args.num_products} vintage products in {len(manifest['shards'])} shards "
+              f"under {args.output_dir}")
+        return
+
+    if args.batch:
+        # Blocks are streamed straight to disk, so memory stays bounded by the block size
+        sample = None
+        with ProductWriter(args.output, args.num_products, args.dimensions) as writer, \
+                metrics.profile("generate_products_batch"):
+            for start in tqdm(range(0, args.num_products, args.block_size), desc="Generating blocks"):
+                n = min(args.block_size, args.num_products - start)
+                # Blocks are seeded like shards, so this matches sharded output with the same block size
+                with metrics.stage("generate_block"):
+                    batch = generate_products_batch(n, seed=child_seed(args.seed, start // args.block_size),
+                                                    start_id=start + 1, dimensions=args.dimensions)
+                with metrics.stage("write_block"):
+                    writer.write(batch)
+                metrics.increment("products_generated", n)
+                if sample is None:
+                    sample = next(batch_to_products(batch, include_embedding=False))
+    else:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+        fake.seed_instance(args.seed)
+        products = []
+        # One stage around the whole loop; timing each generate_product call would cost more than it tells
+        with metrics.stage("generate_products"), metrics.profile("generate_product"):
+            for i in tqdm(range(args.num_products), desc="Generating products"):
+                product = generate_product(args.dimensions)
+                product["product_id"] = i + 1
+                products.append(product)
+        metrics.increment("products_generated", len(products))
+
+        with metrics.stage("write"):
+            if args.output.endswith(".json"):
+                # Save to JSON file
+                with open(args.output, 'w') as f:
+                    json.dump(products, f, indent=2)
+            else:
+                with ProductWriter(args.output, len(products), args.dimensions) as writer:
+                    writer.write(products_to_batch(products))
+        sample = random.choice(products)
+
+    print(f"Generated {args.num_products} vintage products and saved to {args.output}")
+
+    # Display a sample product
+    print("\nSample Product:")
+    for key, value in sample.items():
+        if key != "embedding":  # Skip embedding for readability
+            print(f"{key}: {value}")
+
+if __name__ == "__main__":
+    main()
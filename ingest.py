@@ -0,0 +1,223 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+from tqdm.auto import tqdm
+
+from embeddings import EMBEDDING_DIMENSIONS, normalize, truncate
+from metrics import metrics
+from product_io import take_rows
+from quantize import code_column_values
+
+CHUNK_SIZE = 5000
+MAX_INSERT_RETRIES = 3
+
+INSERT_COLUMNS = [
+    'product_id', 'name', 'category', 'subcategory', 'era', 'decade', 'materials', 'colors',
+    'condition_rating', 'price_dollars', 'description', 'embedding', 'date_added'
+]
+# Inserted when a batch carries them (see sync.diff_batches)
+SYNC_COLUMNS = ['content_hash', 'version']
+
+
+class ChunkInsertError(Exception):
+    """Raised when a chunk still fails after all retries; the load can resume from first_product_id"""
+
+    def __init__(self, first_product_id, last_product_id):
+        super().__init__(f"Failed to insert products {first_product_id}-{last_product_id}; "
+                         f"resume with resume_after={first_product_id - 1}")
+        self.first_product_id = first_product_id
+        self.last_product_id = last_product_id
+
+
+def embedding_array(embeddings, dtype=np.float32):
+    """Wrap a (n, dim) matrix as an Arrow list column without copying the values"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=dtype)
+    n, dimensions = embeddings.shape
+    offsets = np.arange(0, (n + 1) * dimensions, dimensions, dtype=np.int32)
+    return pa.ListArray.from_arrays(pa.array(offsets), pa.array(embeddings.reshape(-1)))
+
+
+def to_arrow(batch, quantization=None, prefix_dimensions=None):
+    """
+    Convert a columnar product block (with embeddings) into an Arrow table for insertion
+
+    With a quantization (see quantize.py) the matching code columns are added after the embedding,
+    with prefix_dimensions an embedding_prefix column holding the re-normalized leading components.
+    """
+    columns = {key: batch[key] for key in INSERT_COLUMNS if key != 'embedding'}
+    columns['embedding'] = embedding_array(batch['embedding'])
+    columns = {key: columns[key] for key in INSERT_COLUMNS}
+    columns.update((key, batch[key]) for key in SYNC_COLUMNS if key in batch)
+    if quantization:
+        for key, values in code_column_values(batch['embedding'], quantization).items():
+            columns[key] = embedding_array(values, values.dtype) if values.ndim == 2 else values
+    if prefix_dimensions:
+        columns['embedding_prefix'] = embedding_array(truncate(batch['embedding'], prefix_dimensions))
+    return pa.table(columns)
+
+
+def _products_table_ddl(table, dimensions, extra_columns):
+    return f'''
+    CREATE TABLE IF NOT EXISTS {table} (
+        product_id UInt32,
+        name String,
+        category String,
+        subcategory String,
+        era String,
+        decade UInt16,
+        materials Array(String),
+        colors Array(String),
+        condition_rating Float32,
+        price_dollars Float32,
+        description String,
+        embedding Array(Float32),
+        date_added DateTime,
+        content_hash UInt64,
+        version UInt64{extra_columns},
+        CONSTRAINT embedding_dimensions CHECK length(embedding) = {int(dimensions)}
+    ) ENGINE = ReplacingMergeTree(version)
+    ORDER BY product_id
+    '''
+
+
+def table_columns(client, table):
+    """Names of a table's columns (empty if it doesn't exist)"""
+    return [row[0] for row in client.query(f'''
+    SELECT name FROM system.columns
+    WHERE database = currentDatabase() AND table = '{table}'
+    ORDER BY position
+    ''').result_rows]
+
+
+def create_products_table(client, table='nostalgia_bin', dimensions=EMBEDDING_DIMENSIONS, extra_columns=''):
+    """
+    Create the products table with vector search capability, if it doesn't exist
+
+    Re-synced products are inserted with a higher version and ReplacingMergeTree
+    keeps only the latest row per product_id once parts are merged (see
+    deduplicate_products_table).
+
+    A table created before incremental sync (a plain MergeTree without the
+    content_hash and version columns) is migrated: its rows are copied into a
+    new table with version 0 and an empty hash, which swaps places with the
+    old one. The next sync then sees every product as changed and re-inserts
+    it (embeddings come from the cache). The vector index is not copied.
+
+    Args:
+        client: clickhouse_connect client
+        table: Table name
+        dimensions: Embedding length, enforced by a CHECK constraint
+        extra_columns: Additional column definitions, each starting with ',' (see quantize.code_columns_ddl)
+    """
+    client.command(_products_table_ddl(table, dimensions, extra_columns))
+    columns = table_columns(client, table)
+    if all(column in columns for column in SYNC_COLUMNS):
+        return
+    migrated = f'{table}_migrated'
+    client.command(f'DROP TABLE IF EXISTS {migrated}')
+    client.command(_products_table_ddl(migrated, dimensions, extra_columns))
+    # Columns the old table lacks get their defaults: an empty content hash and version 0
+    shared = ', '.join(column for column in table_columns(client, migrated) if column in columns)
+    client.command(f'INSERT INTO {migrated} ({shared}) SELECT {shared} FROM {table}')
+    client.command(f'EXCHANGE TABLES {table} AND {migrated}')
+    client.command(f'DROP TABLE {migrated}')
+    print(f"Migrated {table} to a ReplacingMergeTree with {' and '.join(SYNC_COLUMNS)} columns")
+
+
+def deduplicate_products_table(client, table='nostalgia_bin'):
+    """
+    Merge the table's parts so each product_id has a single row
+
+    Searches read the table without FINAL, so until the merge (or ClickHouse's
+    own background merges) a re-synced product can be returned twice. Run it
+    after a sync that replaced rows.
+    """
+    client.command(f'OPTIMIZE TABLE {table} FINAL')
+
+
+def _skip_loaded(batches, resume_after):
+    for batch in batches:
+        if resume_after is not None:
+            keep = np.asarray(batch['product_id']) > resume_after
+            if not keep.any():
+                continue
+            if not keep.all():
+                batch = take_rows(batch, keep)
+        yield batch
+
+
+def _insert_with_retry(client, table, arrow_table, max_retries):
+    first_id = arrow_table.column('product_id')[0].as_py()
+    last_id = arrow_table.column('product_id')[-1].as_py()
+    # A stable token lets ClickHouse drop a retried block that did land the first time;
+    # the sync version keeps a later sync of the same id range from being dropped as a duplicate
+    token = f"{table}-{first_id}-{last_id}"
+    if 'version' in arrow_table.column_names:
+        token += f"-{arrow_table.column('version')[0].as_py()}"
+    settings = {'insert_deduplication_token': token}
+    for attempt in range(max_retries + 1):
+        try:
+            with metrics.stage('insert'):
+                client.insert_arrow(table, arrow_table, settings=settings)
+            metrics.increment('rows_inserted', arrow_table.num_rows)
+            return
+        except Exception as e:
+            if attempt == max_retries:
+                metrics.increment('insert_failures')
+                raise ChunkInsertError(first_id, last_id) from e
+            metrics.increment('insert_retries')
+            time.sleep(2 ** attempt)
+
+
+def stream_insert(client, batches, embed_fn, table='nostalgia_bin', resume_after=None,
+                  max_retries=MAX_INSERT_RETRIES, total=None, quantization=None,
+                  prefix_dimensions=None):
+    """
+    Embed and insert product chunks, overlapping the embedding of chunk N+1 with the insert of chunk N
+
+    Args:
+        client: clickhouse_connect client
+        batches: Iterable of columnar product blocks (see product_io.iter_product_batches)
+        embed_fn: Called with a list of descriptions, returns a (n, dim) matrix; rows are normalized before insert.
+            None inserts the embeddings the batches already carry (e.g. a generated file's mock embeddings)
+        table: Destination table
+        resume_after: Skip products with product_id <= resume_after (after a ChunkInsertError)
+        max_retries: Retries per chunk before giving up
+        total: Expected number of rows, for the progress bar
+        quantization: Also insert 'float16', 'int8' or 'binary' code columns (see quantize.CODE_COLUMNS)
+        prefix_dimensions: Also insert an embedding_prefix column for two-stage search
+
+    Returns:
+        Dict with rows inserted, elapsed seconds and rows per second
+    """
+    def embed(batch):
+        # Stored unit-length so search can rank by dot product / cosine distance
+        with metrics.stage('embed'):
+            vectors = batch['embedding'] if embed_fn is None else embed_fn(list(batch['description']))
+            batch['embedding'] = normalize(vectors)
+        with metrics.stage('build_rows'):
+            return to_arrow(batch, quantization, prefix_dimensions)
+
+    rows = 0
+    start = time.perf_counter()
+    # Memory is bounded by two chunks: the one being embedded and the one being inserted
+    with ThreadPoolExecutor(max_workers=1) as embedder, tqdm(total=total, unit='rows') as progress:
+        pending = None
+        for batch in _skip_loaded(batches, resume_after):
+            next_chunk = embedder.submit(embed, batch)
+            if pending is not None:
+                arrow_table = pending.result()
+                _insert_with_retry(client, table, arrow_table, max_retries)
+                rows += arrow_table.num_rows
+                progress.update(arrow_table.num_rows)
+            pending = next_chunk
+        if pending is not None:
+            arrow_table = pending.result()
+            _insert_with_retry(client, table, arrow_table, max_retries)
+            rows += arrow_table.num_rows
+            progress.update(arrow_table.num_rows)
+
+    elapsed = time.perf_counter() - start
+    return {'rows': rows, 'seconds': elapsed, 'rows_per_second': rows / elapsed if elapsed else 0.0}
@@ -0,0 +1,161 @@
+import os
+import re
+import json
+from collections import Counter
+
+import numpy as np
+
+# BM25 parameters: term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+# Reciprocal rank fusion constant; larger values flatten the weight of top ranks
+RRF_K = 60
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def product_text(name, description):
+    """Text indexed for keyword search"""
+    return f"{name} {description}"
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K, weights=None):
+    """
+    Fuse ranked id lists by summing weight / (k + rank)
+
+    Args:
+        rankings: Id arrays, each best first
+        k: RRF constant
+        weights: Optional weight per ranking
+
+    Returns:
+        (ids, scores), best first
+    """
+    weights = weights or [1.0] * len(rankings)
+    ids = np.concatenate([np.asarray(ranking) for ranking in rankings])
+    contributions = np.concatenate([weight / (k + 1 + np.arange(len(ranking)))
+                                    for weight, ranking in zip(weights, rankings)])
+    unique, inverse = np.unique(ids, return_inverse=True)
+    scores = np.bincount(inverse, contributions, minlength=len(unique))
+    order = np.argsort(-scores, kind="stable")
+    return unique[order], scores[order]
+
+
+class BM25Index:
+    """
+    Inverted index with precomputed BM25 impact scores
+
+    Postings are stored term by term in two flat arrays (offsets[t]:offsets[t + 1]
+    is term t): the document row and its BM25 contribution for that term, so a
+    query is a sum over the query terms' postings.
+
+    Args:
+        vocabulary: List of terms; position is the term id
+        offsets: (terms + 1,) posting offsets
+        postings: Document rows
+        weights: BM25 contribution of the term to each posting's document
+        ids: Id returned for each document row (e.g. product_id); defaults to the row
+    """
+
+    def __init__(self, vocabulary, offsets, postings, weights, ids):
+        self.vocabulary = vocabulary
+        self.term_ids = {term: i for i, term in enumerate(vocabulary)}
+        self.offsets = offsets
+        self.postings = postings
+        self.weights = weights
+        self.ids = ids
+
+    @classmethod
+    def build(cls, texts, ids=None, k1=K1, b=B):
+        """
+        Index texts (see product_text)
+
+        Args:
+            texts: One text per document
+            ids: Id per document, returned by search; defaults to the row number
+        """
+        vocabulary = {}
+        term_ids, doc_rows, freqs = [], [], []
+        lengths = np.empty(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[row] = len(tokens)
+            for term, count in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_rows.append(row)
+                freqs.append(count)
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        postings = np.array(doc_rows, dtype=np.int32)[order]
+        freqs = np.array(freqs, dtype=np.float32)[order]
+        doc_freqs = np.bincount(term_ids, minlength=len(vocabulary))
+        offsets = np.concatenate([[0], np.cumsum(doc_freqs)])
+
+        idf = np.log1p((len(texts) - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+        weights = np.repeat(idf, doc_freqs) * freqs * (k1 + 1) / (freqs + norm[postings])
+        ids = np.arange(len(texts)) if ids is None else np.asarray(ids)
+        return cls(list(vocabulary), offsets, postings, weights.astype(np.float32), ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _postings(self, query):
+        terms = [self.term_ids[term] for term in set(tokenize(query)) if term in self.term_ids]
+        spans = [slice(self.offsets[t], self.offsets[t + 1]) for t in terms]
+        return [(self.postings[span], self.weights[span]) for span in spans]
+
+    def matches(self, query, require_all=False):
+        """Sorted rows containing any (or all) of the query's terms"""
+        postings = [rows for rows, _ in self._postings(query)]
+        if not postings:
+            return np.empty(0, dtype=np.int32)
+        if require_all:
+            if len(postings) < len(set(tokenize(query))):
+                return np.empty(0, dtype=np.int32)
+            rows = postings[0]
+            for other in postings[1:]:
+                rows = np.intersect1d(rows, other, assume_unique=True)
+            return rows
+        return np.unique(np.concatenate(postings))
+
+    def search_rows(self, query, k=10, allowed=None):
+        """(rows, scores) of the k best BM25 matches, best first; allowed is an optional boolean row mask"""
+        postings = self._postings(query)
+        if not postings:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        rows = np.concatenate([rows for rows, _ in postings])
+        scores = np.bincount(rows, np.concatenate([weights for _, weights in postings]), minlength=len(self))
+        candidates = np.unique(rows)
+        if allowed is not None:
+            candidates = candidates[allowed[candidates]]
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        best = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return best, scores[best].astype(np.float32)
+
+    def search(self, query, k=10):
+        """(ids, scores) of the k best BM25 matches, best first"""
+        rows, scores = self.search_rows(query, k)
+        return self.ids[rows], scores
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in ("offsets", "postings", "weights", "ids"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "vocabulary.json"), "w") as f:
+            json.dump(self.vocabulary, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(path, "vocabulary.json")) as f:
+            vocabulary = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ("offsets", "postings", "weights", "ids")}
+        return cls(vocabulary, **arrays)
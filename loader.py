@@ -1,192 +1,170 @@
-import json
-import numpy as np
-import pandas as pd
-import clickhouse_connect
-from openai import OpenAI
-from tqdm.auto import tqdm
-import datetime
 import os
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))  # Make sure OPENAI_API_KEY is set in your environment
+from clients import clickhouse_client
+from embedding_cache import EmbeddingCache
+from product_io import iter_product_batches
+from ingest import CHUNK_SIZE, create_products_table, deduplicate_products_table, stream_insert
+from metrics import metrics
+from filters import ProductFilter
+from sync import LoadedProducts, diff_batches, vector_index_exists
+from quantize import code_columns_ddl
+from search import (DIMENSIONS, MODEL, PREFIX_DIMENSIONS, PRODUCTS_PATH, QUANTIZATION, embed_many, hybrid_search,
+                    query_embeddings, reset_source_indexes, vector_search)
 
-# Function to get embeddings from OpenAI
-def get_embedding(text):
-    response = client.embeddings.create(
-        model="text-embedding-3-small",  # 1536 dimensions
-        input=text
-    )
-    return response.data[0].embedding
-
-# Load the generated product data
-with open('nostalgia_bin_products.json', 'r') as f:
-    products = json.load(f)
-
-# After loading the products but before insertion, convert date strings to datetime objects
-print("Converting dates to datetime objects...")
-for product in products:
-    # Convert the date string to a datetime object
-    product['date_added'] = datetime.datetime.strptime(product['date_added'], '%Y-%m-%d %H:%M:%S')
-
-# Create embeddings for product descriptions
-print("Generating OpenAI embeddings for product descriptions...")
-for product in tqdm(products):
-    # Generate embedding from product description
-    embedding = get_embedding(product['description'])
-    product['embedding'] = embedding
-
-# Connect to Clickhouse
-client = clickhouse_connect.get_client(
-    host=os.getenv('CLICKHOUSE_HOST'),
-    port=8443,
-    username=os.getenv('CLICKHOUSE_USERNAME'),
-    password=os.getenv('CLICKHOUSE_PASSWORD'),
-    secure=False
-)
-
-# Create table with vector search capability
-client.command('''
-CREATE TABLE IF NOT EXISTS nostalgia_bin (
-    product_id UInt32,
-    name String,
-    category String,
-    subcategory String,
-    era String,
-    decade UInt16,
-    materials Array(String),
-    colors Array(String),
-    condition_rating Float32,
-    price_dollars Float32,
-    description String,
-    embedding Array(Float32),
-    date_added DateTime
-) ENGINE = MergeTree()
-ORDER BY product_id;
-''')
-
-# Insert data
-print("Inserting data into Clickhouse...")
-# Convert the products to a format suitable for Clickhouse insertion
-rows = []
-for product in products:
-    row = [
-        product['product_id'],
-        product['name'],
-        product['category'],
-        product['subcategory'],
-        product['era'],
-        product['decade'],
-        product['materials'],
-        product['colors'],
-        product['condition_rating'],
-        product['price_dollars'],
-        product['description'],
-        product['embedding'],
-        product['date_added']
-    ]
-    rows.append(row)
-
-# Use bulk insertion for efficiency
-client.insert('nostalgia_bin', rows, 
-              column_names=[
-                  'product_id', 'name', 'category', 'subcategory', 'era', 
-                  'decade', 'materials', 'colors', 'condition_rating', 
-                  'price_dollars', 'description', 'embedding', 'date_added'
-              ])
-
-print(f"Successfully inserted {len(products)} products")
-
-# Create a vector index for faster similarity search
-client.command('''
-ALTER TABLE nostalgia_bin
-ADD VECTOR INDEX embedding_index embedding TYPE MSTG
-GRANULARITY 1000;
-''')
-
-print("Vector index created successfully")
-
-# Example vector search function
-def vector_search(query_text, top_n=5, filter_conditions=None):
+# Make sure OPENAI_API_KEY (and optionally OPENAI_BASE_URL, e.g. a local fake endpoint) or EMBEDDING_BACKEND=local,
+# and the CLICKHOUSE_* variables are set in your environment; clients are created on first use (see clients.py)
+
+
+def load(products_path=PRODUCTS_PATH, resume_after=None):
     """
-    Search for products by semantic similarity with optional filtering
-    
+    Sync a product file into ClickHouse and create the vector index
+
+    The product data (.json, .ndjson, .parquet or a sharded dataset's manifest)
+    is streamed in chunks. Only products that are new or whose content hash
+    differs from the loaded row are embedded and inserted, so re-running the
+    load is idempotent and a catalog update costs time proportional to the
+    change. The generator's mock embeddings are skipped; each chunk's
+    descriptions are embedded while the previous chunk is being inserted as
+    Arrow columns.
+
     Args:
-        query_text: Text to search for
-        top_n: Number of results to return
-        filter_conditions: SQL WHERE clause for filtering (without the 'WHERE')
-    
+        products_path: Product file, manifest, or directory with a manifest
+        resume_after: Skip products with product_id <= resume_after (after a ChunkInsertError)
+
     Returns:
-        DataFrame with search results
+        Dict with rows inserted, elapsed seconds and rows per second, plus the sync counts
     """
-    # Get OpenAI embedding for the query text
-    query_embedding = get_embedding(query_text)
-    
-    # Construct the SQL query
-    base_query = f'''
-    SELECT 
-        product_id, 
-        name, 
-        category,
-        subcategory, 
-        era, 
-        decade,
-        materials, 
-        colors,
-        condition_rating,
-        price_dollars,
-        description,
-        L2Distance(embedding, {query_embedding}) AS distance
-    FROM nostalgia_bin
-    '''
-    
-    # Add filter conditions if provided
-    if filter_conditions:
-        base_query += f' WHERE {filter_conditions}'
-    
-    # Add ordering and limit
-    base_query += f'''
-    ORDER BY distance ASC
-    LIMIT {top_n}
-    '''
-    
-    # Execute the query
-    result = client.query(base_query)
-    
-    # Convert to pandas DataFrame
-    return result.to_pandas()
-
-# Example usage
-print("\nExample vector search results:")
-
-# Search for mid-century furniture
-query = "Mid-century modern furniture with clean lines and minimal design"
-results = vector_search(
-    query,
-    top_n=3,
-    filter_conditions="category = 'Furniture'"
-)
-print(f"\nQuery: {query}")
-for _, row in results.iterrows():
-    print(f"\nProduct: {row['name']}")
-    print(f"Category: {row['category']} - {row['subcategory']}")
-    print(f"Era: {row['era']} ({row['decade']}s)")
-    print(f"Price: ${row['price_dollars']}")
-    print(f"Distance: {row['distance']}")
-    print(f"Description: {row['description'][:100]}...")
-
-# Search for colorful vintage electronics
-query = "Colorful retro electronics from the 80s with futuristic design"
-results = vector_search(
-    query,
-    top_n=3,
-    filter_conditions="category = 'Electronics' AND 1980 <= decade AND decade < 1990"
-)
-print(f"\nQuery: {query}")
-for _, row in results.iterrows():
-    print(f"\nProduct: {row['name']}")
-    print(f"Category: {row['category']} - {row['subcategory']}")
-    print(f"Era: {row['era']} ({row['decade']}s)")
-    print(f"Price: ${row['price_dollars']}")
-    print(f"Distance: {row['distance']}")
-    print(f"Colors: {', '.join(row['colors'])}")
-    print(f"Description: {row['description'][:100]}...")
\ No newline at end of file
+    # Only descriptions missing from the on-disk cache are embedded, in batched requests (or local batches)
+    cache = EmbeddingCache(os.getenv('EMBEDDING_CACHE_DIR', '.embedding_cache'), MODEL, DIMENSIONS)
+    live_keys = set()
+
+    def embed_descriptions(descriptions):
+        return cache.get_or_embed(descriptions, embed_many)
+
+    def track_live_keys(batches):
+        # Every description in the source stays cached, including unchanged products that aren't re-embedded
+        for batch in batches:
+            live_keys.update(cache.key(text) for text in batch['description'])
+            yield batch
+
+    with clickhouse_client() as client:
+        # Create table with vector search capability
+        extra_columns = code_columns_ddl(QUANTIZATION, client) if QUANTIZATION else ''
+        if PREFIX_DIMENSIONS:
+            extra_columns += ',\n    embedding_prefix Array(Float32)'
+        create_products_table(client, dimensions=DIMENSIONS, extra_columns=extra_columns)
+
+        print("Syncing products into Clickhouse...")
+        loaded = LoadedProducts.from_table(client)
+        chunks = iter_product_batches(products_path, batch_size=CHUNK_SIZE, embeddings=False)
+        sync_stats = {}
+        with metrics.stage('sync'), metrics.profile('embedding_loop'):
+            stats = stream_insert(client, diff_batches(track_live_keys(chunks), loaded, stats=sync_stats),
+                                  embed_descriptions, resume_after=resume_after, quantization=QUANTIZATION,
+                                  prefix_dimensions=PREFIX_DIMENSIONS)
+
+        print(f"Successfully inserted {stats['rows']} products ({stats['rows_per_second']:.0f} rows/s): "
+              f"{sync_stats['new']} new, {sync_stats['changed']} changed, {sync_stats['unchanged']} unchanged")
+        if sync_stats['changed']:
+            # Searches skip FINAL, so merge the replaced rows away now instead of paying for it per query
+            with metrics.stage('deduplicate'):
+                deduplicate_products_table(client)
+        missing = loaded.missing()
+        if len(missing):
+            print(f"{len(missing)} loaded products are no longer in the source file (left in place)")
+
+        # Evict vectors for descriptions that are no longer in the catalog
+        evicted = cache.compact(live_keys)
+        print(cache.report() + (f", {evicted} stale vectors evicted" if evicted else ""))
+
+        # Create a vector index for faster similarity search, once
+        if vector_index_exists(client):
+            print("Vector index already exists")
+        else:
+            with metrics.stage('index_build'):
+                client.command('''
+                ALTER TABLE nostalgia_bin
+                ADD VECTOR INDEX embedding_index embedding TYPE MSTG
+                GRANULARITY 1000;
+                ''')
+            print("Vector index created successfully")
+
+    # The local filter and keyword indexes are rebuilt from the new source on the next search
+    reset_source_indexes(products_path)
+    return {**stats, **sync_stats}
+
+
+def run_examples():
+    """Example searches against the loaded table"""
+    print("\nExample vector search results:")
+
+    # Search for mid-century furniture
+    query = "Mid-century modern furniture with clean lines and minimal design"
+    results = vector_search(
+        query,
+        top_n=3,
+        filter_conditions="category = 'Furniture'"
+    )
+    print(f"\nQuery: {query}")
+    for _, row in results.iterrows():
+        print(f"\nProduct: {row['name']}")
+        print(f"Category: {row['category']} - {row['subcategory']}")
+        print(f"Era: {row['era']} ({row['decade']}s)")
+        print(f"Price: ${row['price_dollars']}")
+        print(f"Distance: {row['distance']}")
+        print(f"Description: {row['description'][:100]}...")
+
+    # Search for colorful vintage electronics
+    query = "Colorful retro electronics from the 80s with futuristic design"
+    results = vector_search(
+        query,
+        top_n=3,
+        filter_conditions=ProductFilter(category='Electronics', decade=(1980, 1990))
+    )
+    print(f"\nQuery: {query}")
+    for _, row in results.iterrows():
+        print(f"\nProduct: {row['name']}")
+        print(f"Category: {row['category']} - {row['subcategory']}")
+        print(f"Era: {row['era']} ({row['decade']}s)")
+        print(f"Price: ${row['price_dollars']}")
+        print(f"Distance: {row['distance']}")
+        print(f"Colors: {', '.join(row['colors'])}")
+        print(f"Description: {row['description'][:100]}...")
+
+    # Exact-term query: keyword and vector rankings fused
+    query = "Bakelite radio"
+    results = hybrid_search(query, top_n=3, columns=['product_id', 'name', 'materials'])
+    print(f"\nHybrid query: {query}")
+    for _, row in results.iterrows():
+        print(f"\nProduct: {row['name']}")
+        print(f"Materials: {', '.join(row['materials'])}")
+        print(f"Score: {row['score']:.4f} (distance {row['distance']:.4f})")
+
+    print(f"\nQuery embedding cache: {query_embeddings().stats()}")
+
+
+def main():
+    # Instrumentation: METRICS_PORT serves Prometheus text at /metrics (JSON at /metrics.json) while the
+    # loader runs and METRICS_PATH receives a JSON summary at the end. PROFILE_DIR cProfiles the
+    # embedding/insert loop, TRACE_MEMORY=1 records exact per-stage allocation peaks (slower) and
+    # TRACE_RSS=1 the resident memory growth of top-level stages
+    if os.getenv('METRICS_PORT'):
+        metrics.serve(int(os.getenv('METRICS_PORT')))
+    if os.getenv('PROFILE_DIR'):
+        metrics.enable_profiling(os.getenv('PROFILE_DIR'))
+    if os.getenv('TRACE_MEMORY'):
+        metrics.trace_memory()
+    if os.getenv('TRACE_RSS'):
+        metrics.trace_rss()
+
+    resume_after = os.getenv('RESUME_AFTER_PRODUCT_ID')  # Set from a ChunkInsertError to continue a failed load
+    load(resume_after=int(resume_after) if resume_after else None)
+    run_examples()
+
+    # Where the time went, per stage
+    if os.getenv('METRICS_PATH'):
+        metrics.write_summary(os.getenv('METRICS_PATH'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embeddings import normalize
+from metrics import metrics
+
+# Small, fast sentence-transformers model; runs comfortably on CPU
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+LOCAL_EMBEDDING_DIMENSIONS = 384
+LOCAL_BATCH_SIZE = 64
+LOCAL_WORKERS = min(4, os.cpu_count() or 1)
+
+
+class LocalEmbedder:
+    """
+    Offline embeddings from a sentence-transformers model on local CPUs
+
+    Texts are sorted by length and cut into batches, so each batch pads its
+    texts to a similar length instead of to the longest text overall, and the
+    batches are encoded on worker threads (PyTorch releases the GIL during
+    inference). The cores are split between the workers so they don't
+    oversubscribe the CPU. With processes=True, batches go to a pool of worker
+    processes instead, which scales better on many-core machines at the cost
+    of loading the model once per process. Outputs are unit length float32.
+
+    The model is loaded on first use; sentence_transformers (and PyTorch) are
+    only imported then.
+
+    Args:
+        model: sentence-transformers model name or path
+        dimensions: Expected embedding size; a mismatch with the model raises ValueError
+        batch_size: Texts per inference batch
+        workers: Worker threads (or processes)
+        processes: Use worker processes instead of threads
+        device: PyTorch device
+    """
+
+    def __init__(self, model=LOCAL_EMBEDDING_MODEL, dimensions=None, batch_size=LOCAL_BATCH_SIZE,
+                 workers=LOCAL_WORKERS, processes=False, device='cpu'):
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.processes = processes
+        self.device = device
+        self._model = None
+        self._executor = None
+        self._process_pool = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is not None:
+                return self._model
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(self.model, device=self.device)
+            dimensions = model.get_sentence_embedding_dimension()
+            if self.dimensions is not None and self.dimensions != dimensions:
+                raise ValueError(f"{self.model} returns {dimensions}-dimensional embeddings, not {self.dimensions}; "
+                                 f"set EMBEDDING_DIMENSIONS={dimensions}")
+            self.dimensions = dimensions
+            model.eval()
+            if self.processes:
+                self._process_pool = model.start_multi_process_pool([self.device] * self.workers)
+            else:
+                torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.workers))
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._model = model
+            return model
+
+    def _encode_batch(self, texts):
+        with metrics.stage('local_embedding_batch'):
+            return self._model.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                                      show_progress_bar=False)
+
+    def embed_many(self, texts):
+        """
+        Embed texts in length-sorted batches spread over the workers
+
+        Returns:
+            (len(texts), dimensions) float32 matrix of unit-length embeddings, in the order of texts
+        """
+        model = self._load()
+        if not len(texts):
+            return np.empty((0, self.dimensions), dtype=np.float32)
+        # Character length is a cheap stand-in for token length; longest first so the slowest batches start first
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        ordered = [texts[i] for i in order]
+        if self._process_pool is not None:
+            with metrics.stage('local_embedding_batch'):
+                vectors = model.encode_multi_process(ordered, self._process_pool, batch_size=self.batch_size,
+                                                     chunk_size=self.batch_size)
+        else:
+            batches = [ordered[i:i + self.batch_size] for i in range(0, len(ordered), self.batch_size)]
+            vectors = np.concatenate(list(self._executor.map(self._encode_batch, batches)))
+        metrics.increment('local_embeddings', len(texts))
+        embeddings = np.empty_like(vectors, dtype=np.float32)
+        embeddings[order] = vectors
+        return normalize(embeddings)
+
+    def embed(self, text):
+        """Embed a single text (used for interactive queries)"""
+        return self.embed_many([text])[0]
+
+    def close(self):
+        with self._lock:
+            if self._process_pool is not None:
+                self._model.stop_multi_process_pool(self._process_pool)
+                self._process_pool = None
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            self._model = None
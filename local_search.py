@@ -0,0 +1,394 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from embeddings import normalize
+from filters import ARRAY_FILTER_COLUMNS, PREFILTER_SELECTIVITY, FilterIndex, ProductFilter
+from keyword_search import BM25Index, product_text, reciprocal_rank_fusion
+from metrics import metrics
+from product_io import iter_product_batches, read_embeddings
+
+RESULT_COLUMNS = [
+    'product_id', 'name', 'category', 'subcategory', 'era', 'decade', 'materials', 'colors',
+    'condition_rating', 'price_dollars', 'description'
+]
+
+
+def as_search_matrix(embeddings):
+    """Return embeddings as a C-contiguous float32 matrix, keeping memory maps when they already are one"""
+    if isinstance(embeddings, np.ndarray) and embeddings.dtype == np.float32 and embeddings.flags.c_contiguous:
+        # A plain ndarray view of a memmap keeps the mapping but skips the subclass overhead per operation
+        return embeddings.view(np.ndarray)
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+# Rows scored per block in batch search, bounds the (block, queries) score matrix
+SCORE_BLOCK_SIZE = 65536
+# Candidates taken from each of the keyword and vector rankings before fusion
+HYBRID_DEPTH = 50
+
+
+def top_k(distances, k):
+    """Indices of the k smallest distances, nearest first"""
+    k = min(k, len(distances))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(distances, k - 1)[:k]
+    return candidates[np.argsort(distances[candidates], kind="stable")]
+
+
+def merge_top_k(best_ids, best_distances, candidate_ids, candidate_distances, k):
+    """
+    Merge per-row candidates into running per-row top-k lists (unsorted)
+
+    All arguments are (rows, columns) arrays; candidate_ids may be a broadcast view.
+    """
+    ids = np.hstack([best_ids, np.broadcast_to(candidate_ids, candidate_distances.shape)])
+    distances = np.hstack([best_distances, candidate_distances])
+    keep = min(k, distances.shape[1])
+    part = np.argpartition(distances, keep - 1, axis=1)[:, :keep]
+    return np.take_along_axis(ids, part, axis=1), np.take_along_axis(distances, part, axis=1)
+
+
+def sort_top_k(ids, distances):
+    """Sort per-row top-k lists nearest first"""
+    order = np.argsort(distances, axis=1, kind="stable")
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+
+def _conditions(filter_conditions):
+    # ProductFilter -> the dict format used internally
+    return filter_conditions.conditions if isinstance(filter_conditions, ProductFilter) else filter_conditions
+
+
+class LocalSearchBackend:
+    """
+    In-process replacement for the ClickHouse vector_search
+
+    The embedding matrix is loaded once (memory-mapped when it comes from an
+    .npy sidecar) and each query is a single matrix-vector product followed by
+    an argpartition top-k. Filters are evaluated against column arrays, with
+    equality masks cached per (column, value).
+
+    Args:
+        products: DataFrame of product columns (see RESULT_COLUMNS)
+        embeddings: (n, dim) matrix aligned with products
+        embed_fn: Called with the query text, returns its embedding
+        index: Optional approximate index (see ann.py) over the same rows, used for unfiltered queries
+        index_params: Search parameters for the index, e.g. {'nprobe': 16} or {'ef': 128}
+        metric: "l2" (L2Distance, like the original SQL) or "cosine" (1 - dot product on
+            unit-length embeddings, like the ClickHouse vector_search)
+        embed_many_fn: Optional batch version of embed_fn, used by vector_search_batch
+        keyword_index: Optional BM25Index over the same rows for hybrid_search
+            (see build_keyword_index)
+    """
+
+    def __init__(self, products, embeddings, embed_fn, index=None, index_params=None, metric="l2",
+                 embed_many_fn=None, keyword_index=None):
+        if metric not in ("l2", "cosine"):
+            raise ValueError(f"Unknown metric: {metric}")
+        self.products = products.reset_index(drop=True)
+        self.embeddings = as_search_matrix(embeddings)
+        self.embed_fn = embed_fn
+        self.embed_many_fn = embed_many_fn
+        self.index = index
+        self.index_params = index_params or {}
+        self.metric = metric
+        self.keyword_index = keyword_index
+        # Squared norms for L2Distance: |x - q|^2 = |x|^2 - 2 x.q + |q|^2
+        self.norms = np.einsum('ij,ij->i', self.embeddings, self.embeddings)
+        if metric == "cosine" and not np.allclose(self.norms, 1, atol=1e-3):
+            # Normalize once up front so every query is a plain dot product
+            self.embeddings = normalize(self.embeddings)
+            self.norms = np.ones(len(self.embeddings), dtype=np.float32)
+        self._columns = {column: self.products[column].to_numpy() for column in self.products.columns}
+        self._masks = {}
+        self._filter_index = None
+
+    @classmethod
+    def from_file(cls, path, embed_fn, embeddings=None, **kwargs):
+        """
+        Build a backend from a product file or sharded dataset
+
+        Args:
+            path: Product file, manifest, or directory with a manifest
+            embed_fn: Query embedding function
+            embeddings: Matrix aligned with the file's products; defaults to the file's own embeddings
+        """
+        batches = iter_product_batches(path, embeddings=False)
+        if embeddings is None:
+            embeddings = read_embeddings(path)
+        products = pd.concat([pd.DataFrame({column: batch[column] for column in RESULT_COLUMNS})
+                              for batch in batches], ignore_index=True)
+        return cls(products, embeddings, embed_fn, **kwargs)
+
+    def build_keyword_index(self):
+        """Index names and descriptions for hybrid_search"""
+        self.keyword_index = BM25Index.build([product_text(name, description) for name, description
+                                              in zip(self._columns['name'], self._columns['description'])])
+        return self.keyword_index
+
+    @property
+    def filter_index(self):
+        """Per-value row lists over the structured columns, built on first use"""
+        if self._filter_index is None:
+            self._filter_index = FilterIndex(self._columns)
+        return self._filter_index
+
+    def _equals_mask(self, column, value):
+        key = (column, value)
+        if key not in self._masks:
+            if column in ARRAY_FILTER_COLUMNS:
+                self._masks[key] = np.zeros(len(self.products), dtype=bool)
+                self._masks[key][self.filter_index.rows_for(column, value)] = True
+            else:
+                self._masks[key] = self._columns[column] == value
+        return self._masks[key]
+
+    def filter_mask(self, filter_conditions):
+        """
+        Boolean mask of rows matching filter_conditions
+
+        filter_conditions is a ProductFilter or a dict mapping column names to:
+            a scalar: column == value (for materials/colors: the product has it)
+            a list or set: column is one of the values (for materials/colors: has any of them)
+            a (low, high) tuple: low <= column < high, either bound may be None
+        """
+        mask = np.ones(len(self.products), dtype=bool)
+        for column, condition in _conditions(filter_conditions).items():
+            if isinstance(condition, tuple):
+                low, high = condition
+                values = self._columns[column]
+                if low is not None:
+                    mask &= values >= low
+                if high is not None:
+                    mask &= values < high
+            elif isinstance(condition, (list, set, frozenset)):
+                mask &= np.logical_or.reduce([self._equals_mask(column, value) for value in condition])
+            else:
+                mask &= self._equals_mask(column, condition)
+        return mask
+
+    def filter_rows(self, filter_conditions):
+        """Sorted rows matching filter_conditions, collected from the filter index without a full-column pass"""
+        conditions = _conditions(filter_conditions)
+        if set(conditions) <= set(self.filter_index.values):
+            return self.filter_index.select(conditions)
+        return np.flatnonzero(self.filter_mask(conditions))
+
+    def prefilter(self, filter_conditions):
+        """Whether the filter is selective enough to collect candidates before scoring"""
+        conditions = _conditions(filter_conditions)
+        if not set(conditions) <= set(self.filter_index.values):
+            return True
+        return self.filter_index.selectivity(conditions) <= PREFILTER_SELECTIVITY
+
+    def _distances(self, query, scores, norms):
+        if self.metric == "cosine":
+            return 1 - scores
+        return np.sqrt(np.maximum(norms - 2 * scores + query @ query, 0))
+
+    def _batch_top_k(self, queries, k, rows=None, mask=None):
+        """
+        Exact top-k rows for each query, scoring the matrix in row blocks
+
+        Each block is one matrix-matrix product; a running (queries, k) best
+        list is merged with every block so memory stays bounded. Rows outside
+        an optional boolean mask get an infinite distance (post-filtering).
+        """
+        total = len(self.embeddings) if rows is None else len(rows)
+        query_norms = np.einsum('ij,ij->i', queries, queries)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_distances = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, total, SCORE_BLOCK_SIZE):
+            block_rows = (np.arange(start, min(start + SCORE_BLOCK_SIZE, total)) if rows is None
+                          else rows[start:start + SCORE_BLOCK_SIZE])
+            block = self.embeddings[start:start + len(block_rows)] if rows is None else self.embeddings[block_rows]
+            scores = queries @ block.T
+            if self.metric == "cosine":
+                distances = 1 - scores
+            else:
+                distances = np.sqrt(np.maximum(self.norms[block_rows] - 2 * scores + query_norms[:, None], 0))
+            if mask is not None:
+                distances[:, ~mask[block_rows]] = np.inf
+            best_rows, best_distances = merge_top_k(best_rows, best_distances, block_rows, distances, k)
+        return sort_top_k(best_rows, best_distances)
+
+    def search_vectors(self, query_embeddings, top_n=5, filter_conditions=None, columns=RESULT_COLUMNS):
+        """
+        Batch version of search_vector
+
+        Args:
+            query_embeddings: (queries, dim) matrix or list of vectors
+            top_n: Number of results per query
+            filter_conditions: One filter (dict or ProductFilter) shared by all queries, or a list
+                with one per query
+            columns: Columns to return
+
+        Returns:
+            List of DataFrames, one per query
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        if self.metric == "cosine":
+            queries = normalize(queries)
+        per_query = isinstance(filter_conditions, list)
+        if self.index is not None and not any(filter_conditions if per_query else [filter_conditions]):
+            return [self.search_vector(query, top_n, None, columns) for query in queries]
+
+        # Queries sharing a filter are scored together
+        groups = {}
+        for i in range(len(queries)):
+            conditions = filter_conditions[i] if per_query else filter_conditions
+            groups.setdefault(repr(sorted(_conditions(conditions or {}).items())), (conditions, []))[1].append(i)
+        results = [None] * len(queries)
+        for conditions, members in groups.values():
+            rows = mask = None
+            if conditions and self.prefilter(conditions):
+                rows = self.filter_rows(conditions)
+            elif conditions:
+                mask = self.filter_mask(conditions)
+            best_rows, best_distances = self._batch_top_k(queries[members], top_n, rows, mask)
+            for i, found, distances in zip(members, best_rows, best_distances):
+                # Fewer than top_n rows may match the filter
+                matched = np.isfinite(distances)
+                results[i] = self._result(found[matched], distances[matched], columns)
+        return results
+
+    def _index_search(self, query, k):
+        rows, distances = self.index.search(query, k, **self.index_params)
+        if self.metric == "cosine":
+            # Between unit vectors, cosine distance = L2^2 / 2
+            distances = distances ** 2 / 2
+        return rows, distances
+
+    def search_vector(self, query_embedding, top_n=5, filter_conditions=None, columns=RESULT_COLUMNS):
+        """
+        Like vector_search, but for an already embedded query
+
+        Selective filters (see prefilter) collect the matching rows from the
+        filter index and only score those. Broad filters score every row (or
+        ask the index for extra candidates) and mask out non-matching ones.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        if self.metric == "cosine":
+            query = normalize(query)
+        if not filter_conditions:
+            if self.index is not None:
+                return self._result(*self._index_search(query, top_n), columns)
+            distances = self._distances(query, self.embeddings @ query, self.norms)
+            best = top_k(distances, top_n)
+            return self._result(best, distances[best], columns)
+
+        if self.prefilter(filter_conditions):
+            rows = self.filter_rows(filter_conditions)
+            distances = self._distances(query, self.embeddings[rows] @ query, self.norms[rows])
+            best = top_k(distances, top_n)
+            return self._result(rows[best], distances[best], columns)
+
+        mask = self.filter_mask(filter_conditions)
+        if self.index is not None:
+            # Over-fetch by the inverse match rate so enough candidates survive the mask
+            fetch = int(np.ceil(2 * top_n * len(mask) / max(mask.sum(), 1)))
+            rows, distances = self._index_search(query, fetch)
+            matched = mask[rows]
+            if matched.sum() >= top_n:
+                return self._result(rows[matched][:top_n], distances[matched][:top_n], columns)
+        distances = self._distances(query, self.embeddings @ query, self.norms)
+        distances[~mask] = np.inf
+        best = top_k(distances, min(top_n, int(mask.sum())))
+        return self._result(best, distances[best], columns)
+
+    def _result(self, rows, distances, columns=RESULT_COLUMNS):
+        # Built from the column arrays in one go; cheaper than iloc plus a column insert
+        result = {column: self._columns[column][rows] for column in columns}
+        result['distance'] = distances
+        return pd.DataFrame(result)
+
+    def vector_search(self, query_text, top_n=5, filter_conditions=None, columns=RESULT_COLUMNS):
+        """
+        Search for products by semantic similarity with optional filtering
+
+        Args:
+            query_text: Text to search for
+            top_n: Number of results to return
+            filter_conditions: ProductFilter or dict of column filters (see filter_mask)
+            columns: Columns to return, a subset of RESULT_COLUMNS
+
+        Returns:
+            DataFrame with search results, in the same shape as the ClickHouse vector_search
+        """
+        with metrics.stage('query_embed'):
+            query_embedding = self.embed_fn(query_text)
+        with metrics.stage('query_search'):
+            return self.search_vector(query_embedding, top_n, filter_conditions, columns)
+
+    def vector_search_batch(self, queries, top_n=5, filter_conditions=None, columns=RESULT_COLUMNS):
+        """
+        Search for many queries at once, e.g. all the shelves of a recommendation page
+
+        Args:
+            queries: Query texts and/or embedding vectors
+            top_n: Number of results per query
+            filter_conditions: One filter (dict or ProductFilter) shared by all queries, or a list
+                with one per query
+            columns: Columns to return
+
+        Returns:
+            List of DataFrames, one per query, in order
+        """
+        texts = [query for query in queries if isinstance(query, str)]
+        embedded = iter(self.embed_many_fn(texts) if self.embed_many_fn and texts
+                        else [self.embed_fn(text) for text in texts])
+        vectors = [next(embedded) if isinstance(query, str) else query for query in queries]
+        return self.search_vectors(vectors, top_n, filter_conditions, columns)
+
+    def hybrid_search(self, query_text, top_n=5, filter_conditions=None, columns=RESULT_COLUMNS,
+                      keyword_filter=None, depth=HYBRID_DEPTH):
+        """
+        Keyword (BM25) and vector retrieval fused with reciprocal rank fusion
+
+        The query is embedded on a worker thread while the keyword side runs, so
+        exact-term queries (a material, a subcategory, a designer's surname) find
+        their matches even when the embedding ranks them low.
+
+        Args:
+            query_text: Text to search for
+            top_n: Number of results to return
+            filter_conditions: ProductFilter or dict of column filters (see filter_mask), applied to both sides
+            columns: Columns to return
+            keyword_filter: None to fuse the two rankings; "any" or "all" to only vector-score
+                products containing any / all of the query's terms
+            depth: Candidates taken from each ranking before fusion
+
+        Returns:
+            DataFrame with search results, best first, with the fused score and the vector distance
+        """
+        if self.keyword_index is None:
+            self.build_keyword_index()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            embedding = pool.submit(self.embed_fn, query_text)
+            allowed = self.filter_mask(filter_conditions) if filter_conditions else None
+            if keyword_filter:
+                # Pre-filter: the vector side only scores products containing the query's terms
+                matched = np.zeros(len(self.products), dtype=bool)
+                matched[self.keyword_index.matches(query_text, require_all=keyword_filter == "all")] = True
+                allowed = matched if allowed is None else allowed & matched
+            keyword_rows, _ = self.keyword_index.search_rows(query_text, depth, allowed)
+            query = np.asarray(embedding.result(), dtype=np.float32)
+
+        if self.metric == "cosine":
+            query = normalize(query)
+        rows = None if allowed is None else np.flatnonzero(allowed)
+        if rows is None:
+            distances = self._distances(query, self.embeddings @ query, self.norms)
+            vector_rows = top_k(distances, depth)
+        else:
+            distances = np.full(len(self.embeddings), np.inf, dtype=np.float32)
+            distances[rows] = self._distances(query, self.embeddings[rows] @ query, self.norms[rows])
+            vector_rows = rows[top_k(distances[rows], depth)]
+
+        fused, scores = reciprocal_rank_fusion([keyword_rows, vector_rows])
+        result = self._result(fused[:top_n], distances[fused[:top_n]], columns)
+        result.insert(len(columns), 'score', scores[:top_n])
+        return result
@@ -0,0 +1,269 @@
+import os
+import json
+import functools
+import time
+import pstats
+import cProfile
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds (seconds) of the stage timing histogram buckets, Prometheus style
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+           float('inf'))
+METRIC_PREFIX = 'nostalgia'
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is the process high-water mark, in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _rss_bytes():
+    """Current resident set size; the high-water mark where /proc isn't available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return _peak_rss_bytes()
+
+
+class Histogram:
+    """Cumulative bucket counts plus sum, count and max of observed durations"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate from the buckets, interpolating linearly within the bucket holding the quantile"""
+        if not self.count:
+            return 0.0
+        rank, seen, lower = q * self.count, 0, 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * max(rank - seen, 0) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum_seconds': self.sum,
+            'mean_seconds': self.sum / self.count if self.count else 0.0,
+            'p50_seconds': self.quantile(0.5),
+            'p95_seconds': self.quantile(0.95),
+            'p99_seconds': self.quantile(0.99),
+            'max_seconds': self.max,
+        }
+
+
+class Metrics:
+    """
+    Thread-safe registry of per-stage timing histograms, counters and memory use
+
+    Stages are timed with `with metrics.stage('insert'):` and counters bumped
+    with metrics.increment('rows_inserted', n). Recording costs a lock and a
+    few additions, so instrument per chunk or per query, not per row.
+
+    Memory per stage is opt-in. With trace_memory it is the stage's own
+    Python allocation peak from tracemalloc, which is exact but slows
+    allocation-heavy code down noticeably. With trace_rss it is the largest
+    growth of the process's resident memory over a run of the stage (end
+    minus start, so memory the stage allocates and frees again isn't seen,
+    and other threads' allocations are). That costs two reads of /proc per
+    stage, so only the top-level stages are sampled. The process-wide
+    high-water mark is always reported as peak_rss_bytes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.histograms = {}
+        self.counters = {}
+        self.peak_memory = {}
+        self.profile_dir = None
+        self.sample_rss = False
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.peak_memory.clear()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds, peak_bytes=None):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+            if peak_bytes is not None:
+                self.peak_memory[stage] = max(self.peak_memory.get(stage, 0), peak_bytes)
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block (exceptions included) and record its memory use if enabled"""
+        tracing = tracemalloc.is_tracing()
+        # Nested stages share tracemalloc's single peak; each level keeps the running max of its children
+        stack = self._local.__dict__.setdefault('peaks', [])
+        rss_before = None
+        if tracing:
+            if stack:
+                stack[-1] = max(stack[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            stack.append(0)
+        elif self.sample_rss and not self._local.__dict__.get('depth'):
+            rss_before = _rss_bytes()
+        self._local.depth = self._local.__dict__.get('depth', 0) + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._local.depth -= 1
+            peak = None
+            if tracing:
+                peak = max(stack.pop(), tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1] = max(stack[-1], peak)
+                tracemalloc.reset_peak()
+            elif rss_before is not None:
+                peak = max(_rss_bytes() - rss_before, 0)
+            self.observe(name, elapsed, peak)
+
+    def timed(self, name):
+        """Decorator form of stage"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def trace_memory(self, frames=1):
+        """Opt in to exact per-stage Python allocation peaks (tracemalloc)"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def trace_rss(self):
+        """Opt in to per-stage resident memory growth, sampled for top-level stages only"""
+        self.sample_rss = True
+
+    def enable_profiling(self, path):
+        """Opt in to cProfile dumps of the profile() blocks, written as path/<name>.prof"""
+        os.makedirs(path, exist_ok=True)
+        self.profile_dir = path
+
+    @contextmanager
+    def profile(self, name, top=20):
+        """
+        cProfile a hot loop when profiling is enabled; a no-op otherwise
+
+        The stats are dumped to <profile_dir>/<name>.prof (for snakeviz or
+        pstats) and the top entries by cumulative time are printed.
+        """
+        if self.profile_dir is None:
+            yield
+            return
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            path = os.path.join(self.profile_dir, f"{name}.prof")
+            profiler.dump_stats(path)
+            print(f"Profile of {name} written to {path}")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(top)
+
+    def summary(self):
+        """JSON-serializable snapshot of every stage, counter and peak"""
+        with self._lock:
+            return {
+                'stages': {stage: {**histogram.summary(), 'peak_memory_bytes': self.peak_memory.get(stage)}
+                           for stage, histogram in self.histograms.items()},
+                'counters': dict(self.counters),
+                'peak_rss_bytes': _peak_rss_bytes(),
+            }
+
+    def write_summary(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def log_summary(self):
+        """One JSON line, for structured logs"""
+        print(json.dumps({'metrics': self.summary()}))
+
+    def to_prometheus(self, prefix=METRIC_PREFIX):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines.append(f'# TYPE {prefix}_stage_seconds histogram')
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum!r}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append(f'# TYPE {prefix}_stage_peak_memory_bytes gauge')
+            for stage, peak in sorted(self.peak_memory.items()):
+                lines.append(f'{prefix}_stage_peak_memory_bytes{{stage="{stage}"}} {peak}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE {prefix}_{name}_total counter')
+                lines.append(f'{prefix}_{name}_total {value}')
+        lines.append(f'# TYPE {prefix}_peak_rss_bytes gauge')
+        lines.append(f'{prefix}_peak_rss_bytes {_peak_rss_bytes()}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='0.0.0.0'):
+        """Serve to_prometheus() at /metrics and summary() at /metrics.json from a daemon thread"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus().encode(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.summary()).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Process-wide registry used by the instrumented modules
+metrics = Metrics()
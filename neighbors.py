@@ -0,0 +1,285 @@
+import os
+import json
+import argparse
+import datetime
+import tempfile
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+from tqdm.auto import tqdm
+
+from clients import clickhouse_client
+from embeddings import normalize
+from local_search import merge_top_k, sort_top_k
+
+NEIGHBORS = 20
+# Rows per tile; a (tile, tile) float32 score matrix is 64 MB at 4096
+TILE_SIZE = 4096
+NEIGHBORS_TABLE = 'nostalgia_bin_neighbors'
+
+
+def _tile_neighbors(task):
+    """Top-k neighbors of query rows [start, stop) against data rows [data_start, n), self excluded"""
+    path, start, stop, data_start, k, tile_size = task
+    embeddings = np.load(path, mmap_mode='r')
+    queries = np.asarray(embeddings[start:stop])
+    query_rows = np.arange(start, stop)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_distances = np.empty((len(queries), 0), dtype=np.float32)
+    for tile_start in range(data_start, len(embeddings), tile_size):
+        tile_rows = np.arange(tile_start, min(tile_start + tile_size, len(embeddings)))
+        distances = 1 - queries @ np.asarray(embeddings[tile_rows[0]:tile_rows[-1] + 1]).T
+        distances[query_rows[:, None] == tile_rows[None, :]] = np.inf
+        best_rows, best_distances = merge_top_k(best_rows, best_distances, tile_rows, distances, k)
+    return start, best_rows, best_distances
+
+
+def _blocked_neighbors(path, query_start, query_stop, data_start, k, tile_size, workers):
+    """Run _tile_neighbors over query tiles on a process pool; returns row indices and distances"""
+    tasks = [(path, start, min(start + tile_size, query_stop), data_start, k, tile_size)
+             for start in range(query_start, query_stop, tile_size)]
+    rows = np.empty((query_stop - query_start, k), dtype=np.int64)
+    distances = np.empty((query_stop - query_start, k), dtype=np.float32)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start, tile_rows, tile_distances in tqdm(pool.map(_tile_neighbors, tasks), total=len(tasks),
+                                                     desc="Computing neighbors"):
+            width = tile_rows.shape[1]
+            tile_rows, tile_distances = sort_top_k(tile_rows, tile_distances)
+            rows[start - query_start:start - query_start + len(tile_rows)] = -1
+            distances[start - query_start:start - query_start + len(tile_rows)] = np.inf
+            rows[start - query_start:start - query_start + len(tile_rows), :width] = tile_rows
+            distances[start - query_start:start - query_start + len(tile_rows), :width] = tile_distances
+    return rows, distances
+
+
+class NeighborTable:
+    """
+    Top-k nearest neighbors (cosine distance) for every product
+
+    Stored as a directory of .npy arrays aligned by row: product_ids (n,),
+    neighbor_ids (n, k) of product_ids, distances (n, k) and the normalized
+    embeddings (n, dim) kept for incremental refreshes. Rows without enough
+    neighbors are padded with id 0 and distance inf.
+    """
+
+    def __init__(self, product_ids, neighbor_ids, distances, embeddings, path=None):
+        self.product_ids = product_ids
+        self.neighbor_ids = neighbor_ids
+        self.distances = distances
+        self.embeddings = embeddings
+        self.path = path
+        self._order = np.argsort(product_ids, kind='stable')
+
+    @property
+    def k(self):
+        return self.neighbor_ids.shape[1]
+
+    @classmethod
+    def build(cls, product_ids, embeddings, path, k=NEIGHBORS, tile_size=TILE_SIZE, workers=None):
+        """
+        Compute the table with blocked matrix multiplies on a process pool
+
+        Args:
+            product_ids: (n,) product ids aligned with embeddings
+            embeddings: (n, dim) embeddings; normalized and written to path/embeddings.npy
+            path: Output directory
+            k: Neighbors per product
+            tile_size: Rows per query/data tile
+            workers: Worker processes (defaults to the CPU count)
+        """
+        os.makedirs(path, exist_ok=True)
+        embeddings_path = os.path.join(path, 'embeddings.npy')
+        _write_normalized(embeddings_path, embeddings)
+        rows, distances = _blocked_neighbors(embeddings_path, 0, len(product_ids), 0, k, tile_size, workers)
+        product_ids = np.asarray(product_ids, dtype=np.uint32)
+        table = cls(product_ids, _rows_to_ids(product_ids, rows), distances,
+                    np.load(embeddings_path, mmap_mode='r'), path)
+        table.save()
+        return table
+
+    def refresh(self, new_product_ids, new_embeddings, tile_size=TILE_SIZE, workers=None):
+        """
+        Add new products without recomputing the whole table
+
+        New products get full neighbor lists; existing products only have
+        their lists merged with candidates from the new products.
+
+        Returns:
+            product_ids whose neighbor lists changed (including the new ones)
+        """
+        old_count = len(self.product_ids)
+        embeddings_path = os.path.join(self.path, 'embeddings.npy')
+        # Copied block by block into a new file, so the existing embeddings stay memory-mapped
+        refresh_path = os.path.join(self.path, 'embeddings.refresh.npy')
+        _write_normalized(refresh_path, new_embeddings, existing=self.embeddings)
+        self.embeddings = None
+        os.replace(refresh_path, embeddings_path)
+        product_ids = np.concatenate([self.product_ids, np.asarray(new_product_ids, dtype=np.uint32)])
+
+        # New rows against everything
+        new_rows, new_distances = _blocked_neighbors(embeddings_path, old_count, len(product_ids), 0,
+                                                     self.k, tile_size, workers)
+        # Existing rows against the new rows only
+        old_rows, old_distances = _blocked_neighbors(embeddings_path, 0, old_count, old_count,
+                                                     self.k, tile_size, workers)
+        merged_ids, merged_distances = sort_top_k(*merge_top_k(
+            self.neighbor_ids.astype(np.int64), np.asarray(self.distances),
+            _rows_to_ids(product_ids, old_rows).astype(np.int64), old_distances, self.k))
+        changed = np.flatnonzero((merged_ids != self.neighbor_ids).any(axis=1))
+
+        self.product_ids = product_ids
+        self.neighbor_ids = np.concatenate([merged_ids.astype(np.uint32), _rows_to_ids(product_ids, new_rows)])
+        self.distances = np.concatenate([merged_distances, new_distances])
+        self.embeddings = np.load(embeddings_path, mmap_mode='r')
+        self._order = np.argsort(product_ids, kind='stable')
+        self.save()
+        return np.concatenate([self.product_ids[changed], self.product_ids[old_count:]])
+
+    def save(self):
+        for name in ('product_ids', 'neighbor_ids', 'distances'):
+            np.save(os.path.join(self.path, f'{name}.npy'), np.asarray(getattr(self, name)))
+        with open(os.path.join(self.path, 'neighbors.json'), 'w') as f:
+            json.dump({'k': self.k, 'size': len(self.product_ids), 'metric': 'cosine'}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+                  for name in ('product_ids', 'neighbor_ids', 'distances', 'embeddings')}
+        return cls(**arrays, path=path)
+
+    def neighbors(self, product_id):
+        """(neighbor product_ids, distances) for one product, nearest first"""
+        pos = np.searchsorted(self.product_ids, product_id, sorter=self._order)
+        if pos == len(self._order) or self.product_ids[self._order[pos]] != product_id:
+            raise KeyError(product_id)
+        row = self._order[pos]
+        valid = np.isfinite(self.distances[row])
+        return self.neighbor_ids[row][valid], self.distances[row][valid]
+
+
+def _write_normalized(path, embeddings, existing=None, block_size=TILE_SIZE * 16):
+    """Write embeddings normalized to a .npy file, after the already normalized rows of existing"""
+    offset = 0 if existing is None else len(existing)
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                    shape=(offset + len(embeddings), np.shape(embeddings)[1]))
+    for start in range(0, offset, block_size):
+        stop = min(start + block_size, offset)
+        out[start:stop] = existing[start:stop]
+    for start in range(0, len(embeddings), block_size):
+        out[offset + start:offset + start + block_size] = normalize(embeddings[start:start + block_size])
+    out.flush()
+
+
+def _rows_to_ids(product_ids, rows):
+    # Missing neighbors (-1) map to product_id 0
+    return np.where(rows >= 0, product_ids[np.maximum(rows, 0)], 0).astype(np.uint32)
+
+
+def create_neighbors_table(client, table=NEIGHBORS_TABLE):
+    # ReplacingMergeTree keeps the latest row per product_id, so refreshes can simply re-insert
+    client.command(f'''
+    CREATE TABLE IF NOT EXISTS {table} (
+        product_id UInt32,
+        neighbor_ids Array(UInt32),
+        distances Array(Float32),
+        updated_at DateTime
+    ) ENGINE = ReplacingMergeTree(updated_at)
+    ORDER BY product_id;
+    ''')
+
+
+def write_neighbors_table(client, neighbor_table, product_ids=None, table=NEIGHBORS_TABLE, chunk_size=50_000):
+    """Insert (or, for product_ids, upsert) neighbor lists into ClickHouse"""
+    rows = (np.arange(len(neighbor_table.product_ids)) if product_ids is None
+            else neighbor_table._order[np.searchsorted(neighbor_table.product_ids, product_ids,
+                                                       sorter=neighbor_table._order)])
+    updated_at = np.datetime64(datetime.datetime.now().replace(microsecond=0), 's')
+    k = neighbor_table.k
+    for start in range(0, len(rows), chunk_size):
+        chunk = np.sort(rows[start:start + chunk_size])
+        offsets = pa.array(np.arange(0, (len(chunk) + 1) * k, k, dtype=np.int32))
+        neighbor_ids = np.asarray(neighbor_table.neighbor_ids[chunk]).reshape(-1)
+        distances = np.asarray(neighbor_table.distances[chunk]).reshape(-1)
+        client.insert_arrow(table, pa.table({
+            'product_id': np.asarray(neighbor_table.product_ids[chunk]),
+            'neighbor_ids': pa.ListArray.from_arrays(offsets, pa.array(neighbor_ids)),
+            'distances': pa.ListArray.from_arrays(offsets, pa.array(distances)),
+            'updated_at': np.full(len(chunk), updated_at)
+        }))
+
+
+def export_embeddings(client, path, table='nostalgia_bin', min_product_id=None):
+    """
+    Stream product_ids and embeddings out of ClickHouse into an .npy file
+
+    Returns:
+        (product_ids, memory-mapped embeddings)
+    """
+    where = f' WHERE product_id > {int(min_product_id)}' if min_product_id is not None else ''
+    count = client.command(f'SELECT count() FROM {table} FINAL{where}')
+    dimensions = client.command(f'SELECT length(embedding) FROM {table}{where} LIMIT 1') if count else 0
+    embeddings = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(count, dimensions))
+    product_ids = np.empty(count, dtype=np.uint32)
+    offset = 0
+    query = f'SELECT product_id, embedding FROM {table} FINAL{where} ORDER BY product_id'
+    with client.query_arrow_stream(query) as stream:
+        for batch in stream:
+            n = batch.num_rows
+            product_ids[offset:offset + n] = batch.column('product_id').to_numpy()
+            embeddings[offset:offset + n] = batch.column('embedding').flatten().to_numpy().reshape(n, dimensions)
+            offset += n
+    embeddings.flush()
+    return product_ids, embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute item-to-item nearest neighbors")
+    parser.add_argument('--output', default='neighbors', help="Directory for the local neighbor arrays")
+    parser.add_argument('--products', help="Read embeddings from a product file instead of ClickHouse")
+    parser.add_argument('--k', type=int, default=NEIGHBORS)
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--refresh', action='store_true',
+                        help="Only add products newer than the existing table's largest product_id")
+    parser.add_argument('--no-clickhouse', action='store_true', help="Don't write the ClickHouse table")
+    args = parser.parse_args()
+
+    existing = NeighborTable.load(args.output) if args.refresh else None
+    min_product_id = int(np.max(existing.product_ids)) if existing is not None else None
+
+    # The shared client from clients.py, configured from the CLICKHOUSE_* variables
+    use_clickhouse = not (args.products and args.no_clickhouse)
+    with clickhouse_client() if use_clickhouse else nullcontext() as client:
+        with tempfile.TemporaryDirectory() as scratch:
+            if args.products:
+                from product_io import iter_product_batches, read_embeddings
+                product_ids = np.concatenate([batch['product_id'] for batch
+                                              in iter_product_batches(args.products, embeddings=False)])
+                embeddings = read_embeddings(args.products)
+                if min_product_id is not None:
+                    new = product_ids > min_product_id
+                    product_ids, embeddings = product_ids[new], np.asarray(embeddings)[new]
+            else:
+                product_ids, embeddings = export_embeddings(client, os.path.join(scratch, 'embeddings.npy'),
+                                                            min_product_id=min_product_id)
+
+            if existing is not None:
+                changed = existing.refresh(product_ids, embeddings, args.tile_size, args.workers)
+                table = existing
+                print(f"Added {len(product_ids)} products, {len(changed)} neighbor lists changed")
+            else:
+                table = NeighborTable.build(product_ids, embeddings, args.output, args.k, args.tile_size, args.workers)
+                changed = None
+                print(f"Computed {table.k} neighbors for {len(product_ids)} products")
+
+        if client is not None and not args.no_clickhouse:
+            create_neighbors_table(client)
+            write_neighbors_table(client, table, changed)
+            print(f"Wrote neighbor lists to {NEIGHBORS_TABLE}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+import os
+import json
+import hashlib
+from itertools import islice
+
+import numpy as np
+
+from metrics import metrics
+
+# File formats by extension. "json" is the original single indented array;
+# "ndjson" and "parquet" stream, with embeddings in a float32 .npy sidecar.
+FORMATS = {
+    ".json": "json",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".parquet": "parquet"
+}
+MANIFEST_NAME = "manifest.json"
+READ_BATCH_SIZE = 10_000
+
+SCALAR_COLUMNS = [
+    'product_id', 'name', 'category', 'subcategory', 'era', 'decade', 'materials', 'colors',
+    'condition_rating', 'price_dollars', 'description', 'date_added'
+]
+
+# NumPy dtypes for the numeric columns of a columnar block
+COLUMN_DTYPES = {
+    'product_id': np.uint32,
+    'decade': np.uint16,
+    'condition_rating': np.float32,
+    'price_dollars': np.float32,
+    'date_added': 'datetime64[s]'
+}
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unknown product file format: {path}")
+    return FORMATS[extension]
+
+
+def sidecar_path(path):
+    """Path of the .npy embedding sidecar for a product file"""
+    return os.path.splitext(path)[0] + ".embeddings.npy"
+
+
+def file_sha256(*paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def batch_to_products(batch, include_embedding=True):
+    """Convert a columnar block into product dicts in the JSON file layout"""
+    columns = {key: value.tolist() if isinstance(value, np.ndarray) else value
+               for key, value in batch.items() if key not in ("embedding", "date_added")}
+    # Float32 columns round-trip through float64; re-round to the generated precision
+    columns["price_dollars"] = [round(price, 1) for price in columns["price_dollars"]]
+    columns["condition_rating"] = [round(condition, 1) for condition in columns["condition_rating"]]
+    dates = np.datetime_as_string(np.asarray(batch["date_added"], dtype="datetime64[s]")).tolist()
+    for i in range(len(dates)):
+        product = {key: values[i] for key, values in columns.items()}
+        if include_embedding:
+            product["embedding"] = batch["embedding"][i].tolist()
+        product["date_added"] = dates[i].replace("T", " ")
+        yield product
+
+
+def products_to_batch(products):
+    """Convert product dicts (as read from JSON) into a columnar block"""
+    batch = {key: [product[key] for product in products] for key in SCALAR_COLUMNS}
+    for key, dtype in COLUMN_DTYPES.items():
+        if key == "date_added":
+            with metrics.stage("convert_dates"):
+                batch[key] = np.array(batch[key], dtype=dtype)
+        else:
+            batch[key] = np.array(batch[key], dtype=dtype)
+    if products and "embedding" in products[0]:
+        batch["embedding"] = np.array([product["embedding"] for product in products], dtype=np.float32)
+    return batch
+
+
+def take_rows(batch, keep):
+    """Subset of a columnar block; keep is a boolean mask or an index array"""
+    if np.asarray(keep).dtype == bool:
+        keep = np.flatnonzero(keep)
+    return {key: [value[i] for i in keep] if isinstance(value, list) else value[keep]
+            for key, value in batch.items()}
+
+
+class ProductWriter:
+    """
+    Streams columnar product blocks to a JSON, NDJSON or Parquet file
+
+    For NDJSON and Parquet the embeddings are written row by row into a
+    pre-sized float32 .npy sidecar, so memory stays bounded by the block size.
+
+    Args:
+        path: Output file; the format is taken from its extension
+        num_products: Total number of products that will be written
+        dimensions: Embedding dimensionality
+    """
+
+    def __init__(self, path, num_products, dimensions):
+        self.path = path
+        self.format = detect_format(path)
+        self.rows_written = 0
+        self._parquet = None
+        if self.format == "json":
+            self._file = open(path, "w")
+            self._file.write("[")
+            self._embeddings = None
+        else:
+            self._file = open(path, "w") if self.format == "ndjson" else None
+            self._embeddings = np.lib.format.open_memmap(
+                sidecar_path(path), mode="w+", dtype=np.float32, shape=(num_products, dimensions))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def paths(self):
+        return [self.path] if self._embeddings is None else [self.path, sidecar_path(self.path)]
+
+    def write(self, batch):
+        n = len(batch["product_id"])
+        if self.format == "json":
+            for product in batch_to_products(batch):
+                self._file.write(("\n" if not self.rows_written else ",\n") + json.dumps(product))
+                self.rows_written += 1
+            return
+        if self.format == "ndjson":
+            self._file.writelines(json.dumps(product) + "\n"
+                                  for product in batch_to_products(batch, include_embedding=False))
+        else:
+            self._write_parquet(batch)
+        self._embeddings[self.rows_written:self.rows_written + n] = batch["embedding"]
+        self.rows_written += n
+
+    def _write_parquet(self, batch):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # One row group per block
+        table = pa.table({key: batch[key] for key in SCALAR_COLUMNS})
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self.path, table.schema)
+        self._parquet.write_table(table)
+
+    def close(self):
+        if self._file is not None:
+            if self.format == "json":
+                self._file.write("\n]\n")
+            self._file.close()
+            self._file = None
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+        if self._embeddings is not None:
+            self._embeddings.flush()
+
+
+def read_manifest(path):
+    """Return the shard paths listed by a manifest (or a directory holding one)"""
+    if os.path.isdir(path):
+        path = os.path.join(path, MANIFEST_NAME)
+    with open(path) as f:
+        manifest = json.load(f)
+    base = os.path.dirname(path)
+    return [os.path.join(base, shard["path"]) for shard in manifest["shards"]]
+
+
+def _is_manifest(path):
+    return os.path.isdir(path) or os.path.basename(path) == MANIFEST_NAME
+
+
+def read_embeddings(path):
+    """
+    Memory-map the embedding sidecar of a product file
+
+    Embeddings stored inline in a .json file, and the shards of a sharded
+    dataset, are read into one in-memory array instead.
+    """
+    if _is_manifest(path):
+        return np.concatenate([read_embeddings(shard) for shard in read_manifest(path)])
+    if detect_format(path) == "json":
+        return np.concatenate([batch["embedding"] for batch in iter_product_batches(path)])
+    return np.load(sidecar_path(path), mmap_mode="r")
+
+
+def iter_product_batches(path, batch_size=READ_BATCH_SIZE, embeddings=True):
+    """
+    Stream a product file (or sharded dataset) as columnar blocks
+
+    Args:
+        path: Product file, manifest, or directory containing a manifest
+        batch_size: Maximum products per block
+        embeddings: Attach the embedding matrix to each block when available
+
+    Yields:
+        Dicts of column name to array/list, in the layout produced by
+        generator.generate_products_batch
+    """
+    if _is_manifest(path):
+        for shard in read_manifest(path):
+            yield from iter_product_batches(shard, batch_size, embeddings)
+        return
+
+    file_format = detect_format(path)
+    if file_format == "json":
+        # The original layout is a single array, so it can't be streamed
+        with metrics.stage("parse_json"), open(path) as f:
+            products = json.load(f)
+        for start in range(0, len(products), batch_size):
+            with metrics.stage("build_columns"):
+                batch = products_to_batch(products[start:start + batch_size])
+            if not embeddings:
+                batch.pop("embedding", None)
+            yield batch
+        return
+
+    sidecar = np.load(sidecar_path(path), mmap_mode="r") if embeddings else None
+    offset = 0
+    for batch in (_iter_ndjson(path, batch_size) if file_format == "ndjson" else _iter_parquet(path, batch_size)):
+        n = len(batch["product_id"])
+        if sidecar is not None:
+            batch["embedding"] = sidecar[offset:offset + n]
+        offset += n
+        yield batch
+
+
+def _iter_ndjson(path, batch_size):
+    with open(path) as f:
+        while True:
+            # Stages are closed before yielding so they don't include the consumer's time
+            with metrics.stage("parse_json"):
+                products = [json.loads(line) for line in islice(f, batch_size)]
+            if not products:
+                return
+            with metrics.stage("build_columns"):
+                batch = products_to_batch(products)
+            yield batch
+
+
+def _iter_parquet(path, batch_size):
+    import pyarrow.parquet as pq
+
+    batches = pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=SCALAR_COLUMNS)
+    while True:
+        with metrics.stage("read_parquet"):
+            record_batch = next(batches, None)
+            if record_batch is None:
+                return
+            batch = {}
+            for key in SCALAR_COLUMNS:
+                column = record_batch.column(key)
+                batch[key] = column.to_numpy() if key in COLUMN_DTYPES else column.to_pylist()
+        with metrics.stage("convert_dates"):
+            batch["date_added"] = batch["date_added"].astype("datetime64[s]")
+        yield batch
+
+
+def iter_products(path, batch_size=READ_BATCH_SIZE, embeddings=True):
+    """Stream a product file (or sharded dataset) as product dicts in the JSON layout"""
+    for batch in iter_product_batches(path, batch_size, embeddings):
+        yield from batch_to_products(batch, include_embedding="embedding" in batch)
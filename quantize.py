@@ -0,0 +1,373 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from embeddings import normalize, truncate
+from local_search import SCORE_BLOCK_SIZE, as_search_matrix, top_k
+from ann import exact_search, recall_at_k, squared_norms
+
+QUANTIZATIONS = ('float16', 'int8', 'binary')
+# Shortlist size as a multiple of k when re-ranking with full-precision vectors
+RERANK_FACTOR = 4
+# Leading dimensions scored in the first pass of two-stage (prefix) search
+PREFIX_DIMENSIONS = 256
+
+
+def pack_bits(vectors):
+    """1-bit sign codes packed into uint64 words, (n, ceil(dim / 64))"""
+    vectors = np.atleast_2d(vectors)
+    bits = np.packbits(vectors > 0, axis=1)
+    padding = -bits.shape[1] % 8
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+def quantize(vectors, kind):
+    """
+    Compress float32 vectors
+
+    Returns:
+        Dict of code arrays: float16 -> {'codes'}, int8 -> {'codes', 'scales'}
+        (vector ~= scale * codes), binary -> {'codes'} of packed sign bits
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if kind == 'float16':
+        return {'codes': vectors.astype(np.float16)}
+    if kind == 'int8':
+        scales = np.abs(vectors).max(axis=-1, keepdims=True) / 127
+        scales[scales == 0] = 1
+        codes = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+        return {'codes': codes, 'scales': scales[..., 0].astype(np.float32)}
+    if kind == 'binary':
+        return {'codes': pack_bits(vectors)}
+    raise ValueError(f"Unknown quantization: {kind}")
+
+
+def bytes_per_vector(kind, dimensions):
+    """Storage per vector, including the int8 scale"""
+    if kind == 'float16':
+        return 2 * dimensions
+    if kind == 'int8':
+        return dimensions + 4
+    if kind == 'binary':
+        return 8 * -(-dimensions // 64)
+    return 4 * dimensions
+
+
+class QuantizedIndex:
+    """
+    Brute-force scan over compressed codes with exact re-ranking
+
+    The scan reads only the codes (and, for float16/int8, a float32 norm per
+    code); the best rerank candidates are then re-scored with the
+    full-precision vectors, which can stay memory-mapped on disk since only
+    the shortlist rows are touched.
+
+    NumPy has no fast float16 or int8 matrix product, so float16 and int8
+    codes are converted block by block per query, which is slower than an
+    exact float32 scan. With decode=True they are decoded to float32 once, on
+    the first search, and the decoded matrix is scanned instead: latency then
+    matches the exact scan, but the index holds as much memory as the float32
+    vectors themselves. resident_bytes reports what the scan actually holds.
+
+    Args:
+        kind: 'float16', 'int8' or 'binary'
+        codes: Code matrix from quantize
+        vectors: Full-precision (n, dim) matrix for re-ranking
+        scales: Per-vector int8 scales
+        decode: Keep a decoded float32 copy of float16/int8 codes for scanning
+    """
+
+    def __init__(self, kind, codes, vectors, scales=None, decode=False):
+        if kind not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {kind}")
+        self.kind = kind
+        self.codes = codes
+        self.scales = scales
+        self.vectors = as_search_matrix(vectors)
+        self.decode = decode and kind != 'binary'
+        self._decoded = None
+        # Squared norms of the decoded codes for the L2 scan; the full vectors are only read to re-rank
+        self.code_norms = None if kind == 'binary' else np.concatenate(
+            [squared_norms(self._decode_block(start, start + SCORE_BLOCK_SIZE))
+             for start in range(0, len(codes), SCORE_BLOCK_SIZE)] or [np.empty(0, dtype=np.float32)])
+
+    @classmethod
+    def build(cls, vectors, kind, decode=False):
+        return cls(kind, vectors=vectors, decode=decode, **quantize(vectors, kind))
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def code_bytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @property
+    def resident_bytes(self):
+        """Memory the scan holds: codes, scales, code norms and the decoded copy once built"""
+        return sum(array.nbytes for array in (self.codes, self.scales, self.code_norms, self._decoded)
+                   if array is not None)
+
+    def _decode_block(self, start, stop):
+        """float32 approximation of the vectors in rows start:stop (int8 scales applied)"""
+        block = np.asarray(self.codes[start:stop]).astype(np.float32)
+        if self.kind == 'int8':
+            block *= self.scales[start:stop, None]
+        return block
+
+    def decoded(self):
+        """Decoded float32 copy of the float16/int8 codes, built on first use"""
+        if self._decoded is None:
+            decoded = np.empty(self.codes.shape, dtype=np.float32)
+            for start in range(0, len(self.codes), SCORE_BLOCK_SIZE):
+                stop = min(start + SCORE_BLOCK_SIZE, len(self.codes))
+                decoded[start:stop] = self._decode_block(start, stop)
+            self._decoded = decoded
+        return self._decoded
+
+    def _code_distances(self, query):
+        """Approximate distances over the codes; only their order matters"""
+        if self.decode:
+            return self.code_norms - 2 * (self.decoded() @ query)
+        distances = np.empty(len(self.codes), dtype=np.float32)
+        if self.kind == 'binary':
+            query_bits = pack_bits(query)[0]
+        for start in range(0, len(self.codes), SCORE_BLOCK_SIZE):
+            stop = min(start + SCORE_BLOCK_SIZE, len(self.codes))
+            if self.kind == 'binary':
+                block = np.asarray(self.codes[start:stop])
+                distances[start:stop] = np.bitwise_count(block ^ query_bits).sum(axis=1)
+            else:
+                distances[start:stop] = self.code_norms[start:stop] - 2 * (self._decode_block(start, stop) @ query)
+        return distances
+
+    def search(self, query, k=10, rerank=None):
+        """
+        Approximate top-k by L2 distance
+
+        Args:
+            query: Query vector
+            k: Number of neighbors
+            rerank: Shortlist size re-scored with full-precision vectors; defaults to
+                RERANK_FACTOR * k, 0 returns the code ranking as is
+
+        Returns:
+            (ids, distances), nearest first; distances are exact for re-ranked results
+        """
+        query = np.asarray(query, dtype=np.float32)
+        rerank = RERANK_FACTOR * k if rerank is None else rerank
+        shortlist = top_k(self._code_distances(query), max(k, rerank))
+        if not rerank:
+            shortlist = shortlist[:k]
+        # Sorted rows keep the reads from a memory-mapped matrix sequential
+        shortlist = np.sort(shortlist)
+        vectors = self.vectors[shortlist]
+        distances = np.sqrt(np.maximum(squared_norms(vectors) - 2 * vectors @ query + query @ query, 0))
+        best = top_k(distances, k)
+        return shortlist[best], distances[best]
+
+    def save(self, path):
+        """Save the codes; the full-precision vectors are passed again on load"""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "codes.npy"), np.asarray(self.codes))
+        if self.scales is not None:
+            np.save(os.path.join(path, "scales.npy"), np.asarray(self.scales))
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump({"type": "quantized", "kind": self.kind, "size": len(self)}, f)
+
+    @classmethod
+    def load(cls, path, vectors, mmap=True, decode=False):
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(path, "index.json")) as f:
+            kind = json.load(f)["kind"]
+        codes = np.load(os.path.join(path, "codes.npy"), mmap_mode=mmap_mode)
+        if kind == 'prefix':
+            return PrefixIndex(codes, vectors)
+        scales_path = os.path.join(path, "scales.npy")
+        return cls(kind, codes, vectors, np.load(scales_path) if os.path.exists(scales_path) else None, decode)
+
+
+class PrefixIndex(QuantizedIndex):
+    """
+    Two-stage search: a cosine scan over a truncated prefix of each vector,
+    then exact re-ranking of the shortlist at full dimension
+
+    Only meaningful for embeddings whose leading components carry most of the
+    signal, like text-embedding-3 (see embeddings.truncate).
+
+    Args:
+        codes: (n, prefix_dim) unit-length prefixes
+        vectors: Full-precision (n, dim) matrix for re-ranking
+    """
+
+    def __init__(self, codes, vectors):
+        self.kind = 'prefix'
+        self.codes = codes
+        self.scales = None
+        self.decode = False
+        self._decoded = None
+        self.code_norms = None
+        self.vectors = as_search_matrix(vectors)
+
+    @classmethod
+    def build(cls, vectors, dimensions=PREFIX_DIMENSIONS):
+        return cls(truncate(vectors, dimensions), vectors)
+
+    @property
+    def dimensions(self):
+        return self.codes.shape[1]
+
+    def _code_distances(self, query):
+        query = normalize(query[:self.dimensions])
+        distances = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_BLOCK_SIZE):
+            block = np.asarray(self.codes[start:start + SCORE_BLOCK_SIZE])
+            distances[start:start + len(block)] = 1 - block @ query
+        return distances
+
+
+# ClickHouse columns holding each code kind, stored alongside the full embedding.
+# ClickHouse has no IEEE half-precision type, so float16 is stored as BFloat16 (also 2 bytes, but with
+# a 7-bit mantissa, so its recall is somewhat below the local float16 index's). BFloat16 only exists in
+# recent servers, behind allow_experimental_bfloat16_type; code_columns_ddl falls back to Float32 without it.
+CODE_COLUMNS = {
+    'float16': {'embedding_f16': 'Array(BFloat16)'},
+    'int8': {'embedding_i8': 'Array(Int8)', 'embedding_scale': 'Float32'},
+    'binary': {'embedding_bits': 'Array(UInt64)'},
+}
+
+
+def code_distance_sql(kind, query='(SELECT embedding FROM query_vector)'):
+    """
+    SQL expression ranking rows by their codes
+
+    query is the float32 query vector expression; binary codes compare against
+    the query's packed sign bits, bound as the query_bits parameter.
+    """
+    if kind == 'float16':
+        return f'1 - dotProduct(embedding_f16, {query})'
+    if kind == 'int8':
+        return f'1 - embedding_scale * dotProduct(embedding_i8, {query})'
+    return 'arraySum(arrayMap((a, b) -> bitCount(bitXor(a, b)), embedding_bits, {query_bits:Array(UInt64)}))'
+
+
+def prefix_distance_sql(dimensions, query='(SELECT embedding FROM query_vector)'):
+    """SQL expression ranking rows by the cosine distance of their embedding_prefix to the query's prefix"""
+    # The query prefix isn't re-normalized; scaling it doesn't change the order
+    return f'1 - dotProduct(embedding_prefix, arraySlice({query}, 1, {int(dimensions)}))'
+
+
+def bfloat16_supported(client):
+    """Whether the server can create BFloat16 columns (the type exists and, if experimental, is enabled)"""
+    if not client.command("SELECT count() FROM system.data_type_families WHERE name = 'BFloat16'"):
+        return False
+    enabled = client.command("SELECT groupArray(value) FROM system.settings "
+                             "WHERE name = 'allow_experimental_bfloat16_type'")
+    # No such setting means the type is no longer experimental
+    return not enabled or enabled[0] in ('1', 'true')
+
+
+def code_columns_ddl(kind, client=None):
+    """
+    Column definitions to add to CREATE TABLE for a quantization
+
+    With a client, float16 codes fall back to Array(Float32) when the server
+    lacks BFloat16: the first pass then scores full-precision copies, so it
+    saves no storage but the search still works.
+    """
+    columns = dict(CODE_COLUMNS[kind])
+    if kind == 'float16' and client is not None and not bfloat16_supported(client):
+        columns['embedding_f16'] = 'Array(Float32)'
+    return ''.join(f',\n    {name} {type_}' for name, type_ in columns.items())
+
+
+def code_column_values(embeddings, kind):
+    """Insert values for the code columns of a (n, dim) float32 block"""
+    if kind == 'float16':
+        # Sent as float32 and converted to BFloat16 (if supported) by the server
+        return {'embedding_f16': embeddings}
+    if kind == 'int8':
+        codes = quantize(embeddings, kind)
+        return {'embedding_i8': codes['codes'], 'embedding_scale': codes['scales']}
+    return {'embedding_bits': quantize(embeddings, kind)['codes']}
+
+
+def quantization_report(vectors, queries, k=10, rerank_factors=(0, 1, RERANK_FACTOR, 10), kinds=QUANTIZATIONS,
+                        prefix_dimensions=()):
+    """
+    Recall against exact L2 search and memory per vector for each quantization
+
+    bytes_per_vector is the code size (what a table column stores);
+    resident_bytes_per_vector is what the index held while scanning, code
+    norms included. The full vectors used to re-rank are read from the
+    caller's matrix, which may be memory-mapped, and are not counted.
+
+    Args:
+        prefix_dimensions: Also report two-stage prefix search at these prefix sizes
+
+    Returns:
+        List of dicts with kind, bytes_per_vector, resident_bytes_per_vector, compression, rerank,
+        recall and mean_ms
+    """
+    vectors = as_search_matrix(vectors)
+    dimensions = vectors.shape[1]
+    indexes = [(kind, bytes_per_vector(kind, dimensions), QuantizedIndex.build(vectors, kind)) for kind in kinds]
+    indexes += [(f'prefix{size}', 4 * size, PrefixIndex.build(vectors, size))
+                for size in prefix_dimensions if size < dimensions]
+    start = time.perf_counter()
+    for query in queries:
+        exact_search(vectors, query, k)
+    rows = [{'kind': 'exact', 'bytes_per_vector': 4 * dimensions, 'resident_bytes_per_vector': 4 * dimensions,
+             'compression': 1.0, 'rerank': 0, 'recall': 1.0,
+             'mean_ms': 1000 * (time.perf_counter() - start) / len(queries)}]
+    for kind, code_bytes, index in indexes:
+        for factor in rerank_factors:
+            start = time.perf_counter()
+            for query in queries:
+                index.search(query, k, rerank=factor * k)
+            elapsed = time.perf_counter() - start
+            rows.append({
+                'kind': kind,
+                'bytes_per_vector': code_bytes,
+                'resident_bytes_per_vector': index.resident_bytes / max(len(index), 1),
+                'compression': 4 * dimensions / code_bytes,
+                'rerank': factor * k,
+                'recall': recall_at_k(index, vectors, queries, k, rerank=factor * k),
+                'mean_ms': 1000 * elapsed / len(queries)
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs. memory of quantized embeddings")
+    parser.add_argument('products', help="Product file, manifest or .npy embedding matrix")
+    parser.add_argument('--queries', type=int, default=100, help="Catalog vectors (plus noise) used as queries")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefix-dimensions', type=int, nargs='*', default=[PREFIX_DIMENSIONS],
+                        help="Prefix sizes to report for two-stage search")
+    args = parser.parse_args()
+
+    if args.products.endswith('.npy'):
+        vectors = np.load(args.products, mmap_mode='r')
+    else:
+        from product_io import read_embeddings
+        vectors = read_embeddings(args.products)
+    vectors = as_search_matrix(vectors)
+    rng = np.random.default_rng(args.seed)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + rng.normal(0, queries.std() / 4, queries.shape).astype(np.float32)
+
+    print(f"{'kind':<10} {'bytes':>6} {'held':>6} {'x':>5} {'rerank':>6} {'recall@' + str(args.k):>9} {'ms':>7}")
+    for row in quantization_report(vectors, queries, args.k, prefix_dimensions=args.prefix_dimensions):
+        print(f"{row['kind']:<10} {row['bytes_per_vector']:>6} {row['resident_bytes_per_vector']:>6.0f} "
+              f"{row['compression']:>5.1f} {row['rerank']:>6} {row['recall']:>9.3f} {row['mean_ms']:>7.2f}")
+
+
+if __name__ == '__main__':
+    main()
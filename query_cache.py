@@ -0,0 +1,183 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import metrics
+
+MAX_ENTRIES = 10_000
+TTL_SECONDS = 24 * 3600
+
+
+def normalize_query(text):
+    """Cache key text: case- and whitespace-insensitive"""
+    return " ".join(text.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU/TTL cache of query embeddings with single-flight coalescing
+
+    Concurrent lookups of the same uncached query share one in-flight call to
+    embed_fn instead of each paying for its own round trip.
+
+    Args:
+        embed_fn: Called with the query text, returns its embedding
+        model: Embedding model name, part of the cache key
+        max_entries: Maximum cached queries; least recently used are evicted first
+        ttl: Seconds before a cached embedding expires
+        embed_many_fn: Optional batch version of embed_fn, used by get_many
+    """
+
+    def __init__(self, embed_fn, model, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS, clock=time.monotonic,
+                 embed_many_fn=None):
+        self.embed_fn = embed_fn
+        self.embed_many_fn = embed_many_fn
+        self.model = model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.embed_calls = 0
+        self.embed_seconds = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __call__(self, text):
+        return self.get(text)
+
+    def get(self, text):
+        key = (self.model, normalize_query(text))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.increment('query_cache_hits')
+                return entry[1]
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                self.misses += 1
+                metrics.increment('query_cache_misses')
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+                metrics.increment('query_cache_coalesced')
+        if not leader:
+            # Another thread is already embedding this query; wait for its result
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            embedding = self.embed_fn(text)
+        except BaseException as e:
+            self._fail({key: future}, e)
+            raise
+        self._store({key: (embedding, future)}, time.perf_counter() - start)
+        return embedding
+
+    def get_many(self, texts):
+        """Like get for a list of queries; the uncached ones are embedded in a single embed_many_fn call"""
+        if self.embed_many_fn is None:
+            return [self.get(text) for text in texts]
+        keys = [(self.model, normalize_query(text)) for text in texts]
+        results, waiting, leading = {}, {}, {}
+        with self._lock:
+            now = self.clock()
+            for key, text in zip(keys, texts):
+                if key in results or key in waiting or key in leading:
+                    continue
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    metrics.increment('query_cache_hits')
+                    results[key] = entry[1]
+                elif key in self._in_flight:
+                    self.coalesced += 1
+                    metrics.increment('query_cache_coalesced')
+                    waiting[key] = self._in_flight[key]
+                else:
+                    self.misses += 1
+                    metrics.increment('query_cache_misses')
+                    leading[key] = (text, Future())
+                    self._in_flight[key] = leading[key][1]
+
+        if leading:
+            start = time.perf_counter()
+            try:
+                embeddings = self.embed_many_fn([text for text, _ in leading.values()])
+            except BaseException as e:
+                self._fail({key: future for key, (_, future) in leading.items()}, e)
+                raise
+            self._store({key: (embedding, future) for (key, (_, future)), embedding
+                         in zip(leading.items(), embeddings)}, time.perf_counter() - start)
+            results.update((key, embedding) for key, embedding in zip(leading, embeddings))
+        for key, future in waiting.items():
+            results[key] = future.result()
+        return [results[key] for key in keys]
+
+    def cached(self, text):
+        """Cached, unexpired embedding for text or None, without embedding it (for callers that embed themselves)"""
+        key = (self.model, normalize_query(text))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.increment('query_cache_hits')
+                return entry[1]
+            self.misses += 1
+            metrics.increment('query_cache_misses')
+            return None
+
+    def put(self, text, embedding):
+        """Cache an embedding computed outside the cache, e.g. by an async embedding call"""
+        key = (self.model, normalize_query(text))
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _store(self, embedded, elapsed):
+        # embedded maps key -> (embedding, in-flight future) for one embedding call
+        with self._lock:
+            self.embed_calls += 1
+            self.embed_seconds += elapsed
+            expires = self.clock() + self.ttl
+            for key, (embedding, _) in embedded.items():
+                self._entries[key] = (expires, embedding)
+                self._entries.move_to_end(key)
+                del self._in_flight[key]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        for embedding, future in embedded.values():
+            future.set_result(embedding)
+
+    def _fail(self, futures, error):
+        with self._lock:
+            for key in futures:
+                del self._in_flight[key]
+        for future in futures.values():
+            future.set_exception(error)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'lookups': lookups,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            'embed_calls': self.embed_calls,
+            'mean_embed_ms': 1000 * self.embed_seconds / self.embed_calls if self.embed_calls else 0.0,
+            'entries': len(self._entries)
+        }
@@ -0,0 +1,38 @@
+import numpy as np
+from clickhouse_connect.driver.external import ExternalData
+
+
+def rowbinary_vector(vector):
+    """RowBinary encoding of an Array(Float32): a length varint plus 4 little-endian bytes per value"""
+    vector = np.asarray(vector, dtype='<f4')
+    length, prefix = len(vector), bytearray()
+    while True:
+        byte, length = length & 0x7F, length >> 7
+        prefix.append(byte | (0x80 if length else 0))
+        if not length:
+            break
+    return bytes(prefix) + vector.tobytes()
+
+
+def query_vector_data(query_embedding):
+    """
+    Package a query embedding as a binary external table
+
+    The vector travels as RowBinary float32 next to the query instead of as a
+    ~30 KB SQL array literal.
+    """
+    return ExternalData(file_name='query_vector', data=rowbinary_vector(query_embedding),
+                        fmt='RowBinary', structure='embedding Array(Float32)')
+
+
+def query_vectors_data(query_embeddings):
+    """Package several query embeddings as a binary external table of (qid, embedding) rows"""
+    data = b''.join(np.uint32(qid).tobytes() + rowbinary_vector(vector)
+                    for qid, vector in enumerate(query_embeddings))
+    return ExternalData(file_name='query_vectors', data=data, fmt='RowBinary',
+                        structure='qid UInt32, embedding Array(Float32)')
+
+
+def product_ids_data(product_ids):
+    """RowBinary UInt32 bytes for an external table of product ids"""
+    return np.asarray(product_ids, dtype='<u4').tobytes()
@@ -0,0 +1,476 @@
+import os
+import threading
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from clients import clickhouse_client, openai_client
+from embeddings import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, embed_texts, get_embedding, normalize
+from filters import ARRAY_FILTER_COLUMNS, PREFILTER_SELECTIVITY, SCALAR_FILTER_COLUMNS, FilterIndex, ProductFilter
+from local_embeddings import LOCAL_EMBEDDING_DIMENSIONS, LOCAL_EMBEDDING_MODEL, LOCAL_WORKERS, LocalEmbedder
+from keyword_search import BM25Index, product_text, reciprocal_rank_fusion
+from metrics import metrics
+from product_io import iter_product_batches
+from query_cache import QueryEmbeddingCache
+from query_data import product_ids_data, query_vector_data, query_vectors_data
+
+# Product file (.json, .ndjson, .parquet or a sharded dataset's manifest) the table is loaded from
+PRODUCTS_PATH = os.getenv('PRODUCTS_PATH', 'nostalgia_bin_products.json')
+
+# Optionally store compressed codes next to each embedding ('float16', 'int8' or 'binary');
+# searches then scan the codes and re-rank a shortlist with the full vectors
+QUANTIZATION = os.getenv('QUANTIZATION') or None
+
+# Where embeddings come from: 'openai' (the API) or 'local' (a sentence-transformers model on this machine)
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openai')
+if EMBEDDING_BACKEND not in ('openai', 'local'):
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {EMBEDDING_BACKEND}")
+LOCAL_MODEL = os.getenv('LOCAL_EMBEDDING_MODEL', LOCAL_EMBEDDING_MODEL)
+# Model name stored with cached embeddings; vectors from different models never mix
+MODEL = LOCAL_MODEL if EMBEDDING_BACKEND == 'local' else EMBEDDING_MODEL
+
+# Embedding size requested from OpenAI (text-embedding-3 models support shortened vectors),
+# or the local model's output size
+DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS',
+                           LOCAL_EMBEDDING_DIMENSIONS if EMBEDDING_BACKEND == 'local' else EMBEDDING_DIMENSIONS))
+# Optionally store the leading PREFIX_DIMENSIONS components separately for two-stage search:
+# a cheap first pass over the prefixes, then exact re-ranking of a shortlist at full dimension
+PREFIX_DIMENSIONS = int(os.getenv('PREFIX_DIMENSIONS', 0)) or None
+if QUANTIZATION and PREFIX_DIMENSIONS:
+    raise ValueError("Set either QUANTIZATION or PREFIX_DIMENSIONS, not both")
+
+# Selective ProductFilters are sent as a list of matching product_ids, up to this many (see filter_sql)
+MAX_FILTER_IDS = int(os.getenv('MAX_FILTER_IDS', 10_000))
+
+# Created on first use, see query_embeddings and source_indexes; SourceIndexes builds each index
+# under its own lock
+_lock = threading.Lock()
+_indexes_lock = threading.Lock()
+_query_embeddings = None
+_local_embedder = None
+_source_indexes = None
+_source_path = PRODUCTS_PATH
+
+
+def local_embedder():
+    """Shared LocalEmbedder for EMBEDDING_BACKEND=local, configured from the LOCAL_EMBEDDING_* variables"""
+    global _local_embedder
+    with _lock:
+        if _local_embedder is None:
+            _local_embedder = LocalEmbedder(
+                LOCAL_MODEL, DIMENSIONS,
+                workers=int(os.getenv('LOCAL_EMBEDDING_WORKERS', LOCAL_WORKERS)),
+                processes=os.getenv('LOCAL_EMBEDDING_PROCESSES', '').lower() in ('1', 'true')
+            )
+        return _local_embedder
+
+
+def embed_text(text):
+    """Embedding of one text from the configured EMBEDDING_BACKEND"""
+    if EMBEDDING_BACKEND == 'local':
+        return local_embedder().embed(text)
+    return get_embedding(openai_client(), text, dimensions=DIMENSIONS)
+
+
+def embed_many(texts, show_progress=False):
+    """Embeddings of texts, in order, from the configured EMBEDDING_BACKEND"""
+    if EMBEDDING_BACKEND == 'local':
+        return local_embedder().embed_many(texts)
+    return embed_texts(openai_client(), texts, show_progress=show_progress, dimensions=DIMENSIONS)
+
+
+def query_embeddings():
+    """Shared query embedding cache: repeated queries skip the embedding call"""
+    global _query_embeddings
+    with _lock:
+        if _query_embeddings is None:
+            _query_embeddings = QueryEmbeddingCache(embed_text, f'{MODEL}-{DIMENSIONS}', embed_many_fn=embed_many)
+        return _query_embeddings
+
+
+class SourceIndexes:
+    """
+    Local indexes over the source file, each built on first use
+
+    BM25 over names and descriptions for the keyword side of hybrid_search,
+    and per-value row lists over the structured columns for ProductFilter.
+    Each reads only the columns it needs, so a filtered vector search never
+    pays for the BM25 build.
+
+    Args:
+        path: Product file, manifest, or directory with a manifest
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._product_ids = None
+        self._keyword_index = None
+        self._filter_index = None
+
+    def _read(self, columns):
+        chunks = {column: [] for column in ['product_id'] + columns}
+        for batch in iter_product_batches(self.path, embeddings=False):
+            for column, values in chunks.items():
+                values.append(batch[column])
+        if self._product_ids is None:
+            self._product_ids = np.concatenate(chunks['product_id'])
+        return chunks
+
+    @property
+    def product_ids(self):
+        """product_id per source row"""
+        with self._lock:
+            if self._product_ids is None:
+                self._read([])
+            return self._product_ids
+
+    @property
+    def keyword_index(self):
+        """BM25Index over the rows"""
+        with self._lock:
+            if self._keyword_index is None:
+                chunks = self._read(['name', 'description'])
+                keyword_texts = [product_text(name, description) for name, description
+                                 in zip(chain(*chunks['name']), chain(*chunks['description']))]
+                with metrics.stage('keyword_index_build'):
+                    self._keyword_index = BM25Index.build(keyword_texts, ids=self._product_ids)
+            return self._keyword_index
+
+    @property
+    def filter_index(self):
+        """FilterIndex over the rows"""
+        with self._lock:
+            if self._filter_index is None:
+                chunks = self._read(SCALAR_FILTER_COLUMNS + ARRAY_FILTER_COLUMNS)
+                with metrics.stage('filter_index_build'):
+                    self._filter_index = FilterIndex({
+                        column: list(chain(*chunks[column])) if column in ARRAY_FILTER_COLUMNS
+                        else np.concatenate(chunks[column]) for column in SCALAR_FILTER_COLUMNS + ARRAY_FILTER_COLUMNS
+                    })
+            return self._filter_index
+
+
+def source_indexes():
+    """Shared SourceIndexes over the source file; each index is built on first use"""
+    global _source_indexes
+    with _indexes_lock:
+        if _source_indexes is None:
+            _source_indexes = SourceIndexes(_source_path)
+        return _source_indexes
+
+
+def reset_source_indexes(path=None):
+    """Drop the local indexes so the next search rebuilds them, e.g. after a load from a new source file"""
+    global _source_indexes, _source_path
+    with _indexes_lock:
+        _source_indexes = None
+        _source_path = path or _source_path
+
+
+def warm_up(indexes=True):
+    """
+    Open the connections and build the lazy state a first search would otherwise pay for
+
+    Meant to run on a background thread right after a search worker starts.
+    """
+    import pandas  # noqa: F401, result.to_pandas() imports it on the first query otherwise
+
+    if EMBEDDING_BACKEND == 'local':
+        # Loading the model (and importing PyTorch) takes seconds
+        local_embedder().embed('warm up')
+    else:
+        openai_client()
+    with clickhouse_client() as client:
+        client.command('SELECT 1')
+    query_embeddings()
+    if indexes and os.path.exists(_source_path):
+        source_indexes().filter_index
+        source_indexes().keyword_index
+
+
+# Columns vector_search can return; pass a subset to skip large ones like description
+SEARCH_COLUMNS = [
+    'product_id', 'name', 'category', 'subcategory', 'era', 'decade', 'materials', 'colors',
+    'condition_rating', 'price_dollars', 'description'
+]
+
+
+def filter_sql(filter_conditions, external_data):
+    """
+    WHERE clause (without the 'WHERE') for a raw SQL string or a ProductFilter
+
+    A selective ProductFilter is resolved against the local filter index and
+    sent as an external table of matching product_ids, so ClickHouse reads only
+    the granules holding them (a primary key lookup) instead of evaluating the
+    filter over the whole table. Broad filters, and all filters when the
+    source file isn't available, are sent as plain SQL. So are filters matching
+    more than MAX_FILTER_IDS products, whose id list would cost more to send
+    and hash than the scan it saves.
+
+    The id list only narrows the scan: the filter's SQL is still applied, so
+    rows whose attributes changed in the table since the source file was read
+    don't slip through. Products added to the table but missing from the file
+    are not found, though; call reset_source_indexes after a load.
+    """
+    if not isinstance(filter_conditions, ProductFilter):
+        return filter_conditions
+    if not os.path.exists(_source_path):
+        return filter_conditions.to_sql()
+    indexes = source_indexes()
+    selectivity = indexes.filter_index.selectivity(filter_conditions.conditions)
+    if selectivity > PREFILTER_SELECTIVITY or selectivity * indexes.filter_index.size > MAX_FILTER_IDS:
+        return filter_conditions.to_sql()
+    rows = indexes.filter_index.select(filter_conditions.conditions)
+    if len(rows) > MAX_FILTER_IDS:
+        # The estimate assumes independent columns; correlated conditions can match more
+        return filter_conditions.to_sql()
+    external_data.add_file(file_name='filter_ids', data=product_ids_data(indexes.product_ids[rows]), fmt='RowBinary',
+                           structure='product_id UInt32')
+    return f'product_id IN filter_ids AND ({filter_conditions.to_sql()})'
+
+
+@metrics.timed('vector_search')
+def vector_search(query_text, top_n=5, filter_conditions=None, columns=SEARCH_COLUMNS, rerank=None):
+    """
+    Search for products by semantic similarity with optional filtering
+    
+    Embeddings are stored unit-length, so ranking uses the cosine distance
+    1 - dotProduct(embedding, query) rather than a full L2Distance.
+
+    Args:
+        query_text: Text to search for
+        top_n: Number of results to return
+        filter_conditions: ProductFilter, or SQL WHERE clause for filtering (without the 'WHERE')
+        columns: Columns to return, a subset of SEARCH_COLUMNS
+        rerank: With QUANTIZATION or PREFIX_DIMENSIONS set, shortlist size picked by the
+            codes or prefixes and re-ranked with the full embeddings (defaults to RERANK_FACTOR * top_n)
+    
+    Returns:
+        DataFrame with search results
+    """
+    # Get the query embedding (cached, concurrent identical queries share one request)
+    with metrics.stage('query_embed'):
+        query_embedding = normalize(query_embeddings().get(query_text))
+    return search_embedding(query_embedding, top_n, filter_conditions, columns, rerank)
+
+
+def search_embedding(query_embedding, top_n=5, filter_conditions=None, columns=SEARCH_COLUMNS, rerank=None,
+                     table='nostalgia_bin', quantization=QUANTIZATION, prefix_dimensions=PREFIX_DIMENSIONS):
+    """
+    vector_search for an already embedded, unit-length query
+
+    Args:
+        query_embedding: Query vector
+        top_n, filter_conditions, columns, rerank: See vector_search
+        table: Products table to search
+        quantization: Code columns the table carries for a first pass (defaults to QUANTIZATION)
+        prefix_dimensions: Size of the table's embedding_prefix column for a first pass (defaults to
+            PREFIX_DIMENSIONS)
+
+    Returns:
+        DataFrame with search results
+    """
+    unknown = set(columns) - set(SEARCH_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown search columns: {sorted(unknown)}")
+
+    external_data = query_vector_data(query_embedding)
+    with metrics.stage('query_filter'):
+        filter_conditions = filter_sql(filter_conditions, external_data)
+    
+    # Construct the SQL query; the query vector is read from the external table
+    base_query = f'''
+    SELECT 
+        {', '.join(columns)},
+        1 - dotProduct(embedding, (SELECT embedding FROM query_vector)) AS distance
+    FROM {table}
+    '''
+    parameters = None
+    
+    if quantization or prefix_dimensions:
+        # Imported here: quantize pulls in the local search stack, which a plain search worker doesn't need
+        from quantize import RERANK_FACTOR, code_distance_sql, pack_bits, prefix_distance_sql
+
+        # Rank by the compact codes or prefixes first; only the shortlisted rows' full embeddings are read
+        first_pass = code_distance_sql(quantization) if quantization else prefix_distance_sql(prefix_dimensions)
+        shortlist = f'SELECT product_id FROM {table}'
+        if filter_conditions:
+            shortlist += f' WHERE {filter_conditions}'
+        shortlist += f'''
+        ORDER BY {first_pass} ASC
+        LIMIT {int(rerank or RERANK_FACTOR * top_n)}'''
+        base_query += f' WHERE product_id IN ({shortlist})'
+        if quantization == 'binary':
+            parameters = {'query_bits': pack_bits(query_embedding)[0].tolist()}
+    elif filter_conditions:
+        # Add filter conditions if provided
+        base_query += f' WHERE {filter_conditions}'
+    
+    # Add ordering and limit
+    base_query += f'''
+    ORDER BY distance ASC
+    LIMIT {int(top_n)}
+    '''
+    
+    # Execute the query
+    with metrics.stage('query_execute'), clickhouse_client() as client:
+        result = client.query(base_query, parameters=parameters, external_data=external_data)
+    
+    # Convert to pandas DataFrame
+    with metrics.stage('query_to_pandas'):
+        return result.to_pandas()
+
+
+@metrics.timed('vector_search_batch')
+def vector_search_batch(queries, top_n=5, filter_conditions=None, columns=SEARCH_COLUMNS):
+    """
+    Search for many queries in one round trip, e.g. all the shelves of a recommendation page
+
+    Query texts are embedded in one batched request (cached ones are skipped),
+    all query vectors travel in one external table, and one SQL statement
+    scores them together: nostalgia_bin is cross joined with the query vectors
+    and LIMIT BY keeps the top_n per query. Queries with different filters are
+    grouped and combined with UNION ALL.
+
+    Args:
+        queries: Query texts and/or embedding vectors
+        top_n: Number of results per query
+        filter_conditions: ProductFilter or SQL WHERE clause shared by all queries, or a list with
+            one per query
+        columns: Columns to return, a subset of SEARCH_COLUMNS
+
+    Returns:
+        List of DataFrames, one per query, in order
+    """
+    unknown = set(columns) - set(SEARCH_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown search columns: {sorted(unknown)}")
+
+    texts = [query for query in queries if isinstance(query, str)]
+    embedded = iter(query_embeddings().get_many(texts))
+    vectors = normalize([next(embedded) if isinstance(query, str) else query for query in queries])
+
+    query = batch_search_sql(len(queries), top_n, filter_conditions, columns)
+    with clickhouse_client() as client:
+        result = client.query(query, external_data=query_vectors_data(vectors)).to_pandas()
+    return split_batch_result(result, len(queries))
+
+
+def batch_search_sql(num_queries, top_n=5, filter_conditions=None, columns=SEARCH_COLUMNS):
+    """
+    One SQL statement scoring the num_queries vectors of a query_vectors external table
+
+    Args:
+        num_queries: Number of rows in query_vectors (see query_data.query_vectors_data)
+        top_n: Number of results per query
+        filter_conditions: ProductFilter or SQL WHERE clause shared by all queries, or a list with
+            one per query
+        columns: Columns to return, a subset of SEARCH_COLUMNS
+
+    Returns:
+        SQL returning a qid column plus columns and distance, top_n rows per qid
+    """
+    # Group queries by filter so each distinct filter is one scan
+    if not isinstance(filter_conditions, list):
+        filter_conditions = [filter_conditions] * num_queries
+    groups = {}
+    for qid, conditions in enumerate(filter_conditions):
+        if isinstance(conditions, ProductFilter):
+            conditions = conditions.to_sql()
+        groups.setdefault(conditions, []).append(qid)
+
+    projection = ', '.join(f'p.{column} AS {column}' for column in columns)
+    subqueries = []
+    for conditions, qids in groups.items():
+        subquery = f'''
+        SELECT q.qid AS qid, {projection},
+            1 - dotProduct(p.embedding, q.embedding) AS distance
+        FROM nostalgia_bin AS p
+        CROSS JOIN (SELECT * FROM query_vectors WHERE qid IN ({', '.join(map(str, qids))})) AS q
+        '''
+        if conditions:
+            subquery += f' WHERE {conditions}'
+        subquery += f' ORDER BY qid, distance ASC LIMIT {int(top_n)} BY qid'
+        subqueries.append(f'({subquery})')
+    return ' UNION ALL '.join(subqueries)
+
+
+def split_batch_result(result, num_queries):
+    """Split the DataFrame of a batch_search_sql query into one DataFrame per query, nearest first"""
+    return [result[result['qid'] == qid].drop(columns='qid').sort_values('distance').reset_index(drop=True)
+            for qid in range(num_queries)]
+
+
+@metrics.timed('hybrid_search')
+def hybrid_search(query_text, top_n=5, filter_conditions=None, columns=SEARCH_COLUMNS, keyword_filter=None,
+                  depth=50):
+    """
+    Keyword (BM25) and vector retrieval fused with reciprocal rank fusion
+
+    Catches exact-term queries (a material, a subcategory, a designer's surname)
+    that the embedding alone ranks low. The keyword side runs locally while the
+    query is being embedded; one SQL statement then returns the filtered vector
+    top-depth together with the keyword candidates, and both rankings are fused.
+
+    Args:
+        query_text: Text to search for
+        top_n: Number of results to return
+        filter_conditions: ProductFilter or SQL WHERE clause, applied to both sides
+        columns: Columns to return, a subset of SEARCH_COLUMNS
+        keyword_filter: None to fuse the two rankings; "any" or "all" to only vector-score
+            products containing any / all of the query's terms
+        depth: Candidates taken from each ranking before fusion
+
+    Returns:
+        DataFrame with search results, best first, with the fused score and the cosine distance
+    """
+    unknown = set(columns) - set(SEARCH_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown search columns: {sorted(unknown)}")
+
+    keyword_index = source_indexes().keyword_index
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        embedding = pool.submit(query_embeddings().get, query_text)
+        allowed = None
+        if keyword_filter:
+            allowed = np.zeros(len(keyword_index), dtype=bool)
+            allowed[keyword_index.matches(query_text, require_all=keyword_filter == 'all')] = True
+        # Extra keyword candidates make up for ones the SQL filter drops
+        keyword_rows, _ = keyword_index.search_rows(query_text, depth * (4 if filter_conditions else 1), allowed)
+        keyword_ids = keyword_index.ids[keyword_rows]
+        external_data = query_vector_data(normalize(embedding.result()))
+
+    external_data.add_file(file_name='keyword_ids', data=product_ids_data(keyword_ids), fmt='RowBinary',
+                           structure='product_id UInt32')
+    filter_conditions = filter_sql(filter_conditions, external_data)
+    conditions = [f'({filter_conditions})'] if filter_conditions else []
+    if keyword_filter:
+        # Pre-filter: the vector side only scores products containing the query's terms
+        external_data.add_file(file_name='keyword_matches', data=product_ids_data(keyword_index.ids[allowed]),
+                               fmt='RowBinary', structure='product_id UInt32')
+        vector_conditions = conditions + ['product_id IN keyword_matches']
+    else:
+        vector_conditions = conditions
+    distance = '1 - dotProduct(embedding, (SELECT embedding FROM query_vector))'
+    vector_top = f'''
+        SELECT product_id FROM nostalgia_bin
+        {'WHERE ' + ' AND '.join(vector_conditions) if vector_conditions else ''}
+        ORDER BY {distance} ASC
+        LIMIT {int(depth)}'''
+    query = f'''
+    SELECT {', '.join(dict.fromkeys(['product_id'] + list(columns)))}, {distance} AS distance
+    FROM nostalgia_bin
+    WHERE {' AND '.join(conditions + [f'(product_id IN keyword_ids OR product_id IN ({vector_top}))'])}
+    '''
+    with clickhouse_client() as client:
+        result = client.query(query, external_data=external_data).to_pandas()
+
+    # Every returned row passes the filter; the vector top-depth are the nearest of them
+    vector_ids = result.sort_values('distance')['product_id'].to_numpy()[:depth]
+    keyword_ids = keyword_ids[np.isin(keyword_ids, result['product_id'].to_numpy())][:depth]
+    fused, scores = reciprocal_rank_fusion([keyword_ids, vector_ids])
+    result = result.set_index('product_id', drop=False).loc[fused[:top_n]].reset_index(drop=True)
+    result['score'] = scores[:top_n]
+    return result[list(columns) + ['score', 'distance']]
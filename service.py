@@ -0,0 +1,428 @@
+import json
+import asyncio
+import argparse
+
+import numpy as np
+
+from embeddings import EMBEDDING_MODEL, embed_texts_async, normalize
+from filters import ProductFilter
+from metrics import metrics
+from query_cache import QueryEmbeddingCache, normalize_query
+from query_data import query_vectors_data
+from search import (DIMENSIONS, EMBEDDING_BACKEND, MODEL, SEARCH_COLUMNS, batch_search_sql, local_embedder,
+                    split_batch_result)
+
+# Requests arriving within BATCH_WINDOW seconds of the first one share an embedding call and a scoring pass
+BATCH_WINDOW = 0.005
+MAX_BATCH_SIZE = 64
+# Batches being embedded or scored at once; while all are busy, requests queue up
+MAX_CONCURRENT_BATCHES = 4
+# Queued requests beyond this are rejected with ServiceOverloaded instead of piling up latency
+MAX_PENDING = 1024
+REQUEST_TIMEOUT = 5.0
+
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+
+class ServiceOverloaded(Exception):
+    """Raised when the request queue is full; callers should shed load or retry later"""
+
+
+class SearchRequest:
+    def __init__(self, query_text, top_n, filter_conditions, columns, future):
+        self.query_text = query_text
+        self.top_n = top_n
+        self.filter_conditions = filter_conditions
+        self.columns = columns
+        self.future = future
+
+
+def openai_embedder(client, model=EMBEDDING_MODEL, dimensions=DIMENSIONS):
+    """embed_many for QueryService from an AsyncOpenAI client (or one pointed at a local stand-in endpoint)"""
+    async def embed_many(texts):
+        return await embed_texts_async(client, texts, model, dimensions)
+    return embed_many
+
+
+def local_embedder_async(embedder):
+    """embed_many for QueryService from a LocalEmbedder, run off the event loop"""
+    async def embed_many(texts):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, embedder.embed_many, texts)
+    return embed_many
+
+
+def clickhouse_scorer(client):
+    """score_many for QueryService from an async clickhouse_connect client: one SQL statement per batch"""
+    async def score_many(vectors, top_n, filter_conditions, columns):
+        query = batch_search_sql(len(vectors), top_n, filter_conditions, columns)
+        result = await client.query_df(query, external_data=query_vectors_data(vectors))
+        return split_batch_result(result, len(vectors))
+    return score_many
+
+
+def local_scorer(backend):
+    """score_many for QueryService from a LocalSearchBackend, the in-process stand-in for ClickHouse"""
+    async def score_many(vectors, top_n, filter_conditions, columns):
+        loop = asyncio.get_running_loop()
+        # NumPy releases the GIL for the scoring, so a worker thread keeps the event loop responsive
+        return await loop.run_in_executor(None, backend.search_vectors, vectors, top_n, filter_conditions, columns)
+    return score_many
+
+
+class QueryService:
+    """
+    Asyncio search service that micro-batches concurrent requests
+
+    Requests are queued; a batcher collects whatever arrives within
+    batch_window of the first request (up to max_batch_size), embeds the
+    batch's distinct uncached texts in one call and scores all of its vectors
+    in one pass, e.g. a single ClickHouse statement. Under load batches fill
+    up, so throughput grows with concurrency instead of each request paying
+    for its own round trips.
+
+    Backpressure: at most max_concurrent_batches are in flight; further
+    requests wait in a queue of max_pending, and requests beyond that fail
+    fast with ServiceOverloaded. Each request has a timeout; a request that
+    times out while queued is dropped from its batch.
+
+    Args:
+        embed_many: Coroutine function, list of texts -> list of embeddings (see openai_embedder)
+        score_many: Coroutine function (vectors, top_n, filter_conditions list, columns) -> list of
+            DataFrames (see clickhouse_scorer and local_scorer)
+        query_cache: Optional QueryEmbeddingCache shared across batches
+        batch_window: Seconds to wait for more requests after the first one of a batch
+        max_batch_size: Maximum requests per batch
+        max_concurrent_batches: Batches embedded or scored at once
+        max_pending: Maximum queued requests
+        timeout: Default per-request timeout in seconds
+    """
+
+    def __init__(self, embed_many, score_many, query_cache=None, batch_window=BATCH_WINDOW,
+                 max_batch_size=MAX_BATCH_SIZE, max_concurrent_batches=MAX_CONCURRENT_BATCHES,
+                 max_pending=MAX_PENDING, timeout=REQUEST_TIMEOUT):
+        self.embed_many = embed_many
+        self.score_many = score_many
+        self.query_cache = query_cache
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._queue = None
+        self._batcher = None
+        self._slots = None
+        self._batches = set()
+
+    async def start(self):
+        self._queue = asyncio.Queue(self.max_pending)
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._batcher = asyncio.create_task(self._run())
+        return self
+
+    async def close(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, *self._batches, return_exceptions=True)
+            self._batcher = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def overloaded(self, requests=1):
+        """Whether queuing this many more requests would exceed max_pending"""
+        return self._queue.qsize() + requests > self.max_pending
+
+    async def search(self, query_text, top_n=5, filter_conditions=None, columns=SEARCH_COLUMNS, timeout=None):
+        """
+        Search for one query; concurrent calls are batched together
+
+        Args:
+            query_text: Text to search for
+            top_n: Number of results to return
+            filter_conditions: ProductFilter or SQL WHERE clause (or a filter dict for the local scorer)
+            columns: Columns to return, a subset of SEARCH_COLUMNS
+            timeout: Seconds before asyncio.TimeoutError; defaults to the service timeout
+
+        Returns:
+            DataFrame with search results, like search.vector_search
+        """
+        unknown = set(columns) - set(SEARCH_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown search columns: {sorted(unknown)}")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(SearchRequest(query_text, top_n, filter_conditions, list(columns), future))
+        except asyncio.QueueFull:
+            metrics.increment('service_rejected')
+            raise ServiceOverloaded(f"{self._queue.qsize()} requests pending") from None
+        try:
+            # wait_for cancels the future on timeout, which the batcher checks before doing any work
+            return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            metrics.increment('service_timeouts')
+            raise
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Requests keep queuing (and eventually get rejected) while every batch slot is busy
+            await self._slots.acquire()
+            task = asyncio.create_task(self._process(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task):
+        self._batches.discard(task)
+        self._slots.release()
+
+    async def _process(self, batch):
+        batch = [request for request in batch if not request.future.done()]
+        if not batch:
+            return
+        metrics.increment('service_batches')
+        metrics.increment('service_batched_requests', len(batch))
+        try:
+            with metrics.stage('service_batch'):
+                vectors = await self._embed([request.query_text for request in batch])
+                # One pass for the whole batch: the largest top_n and the union of the requested columns
+                columns = [column for column in SEARCH_COLUMNS
+                           if any(column in request.columns for request in batch)]
+                top_n = max(request.top_n for request in batch)
+                with metrics.stage('service_score'):
+                    results = await self.score_many(vectors, top_n, [request.filter_conditions for request in batch],
+                                                    columns)
+            for request, result in zip(batch, results):
+                if not request.future.done():
+                    request.future.set_result(result.head(request.top_n)[request.columns + ['distance']])
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+    async def _embed(self, texts):
+        """Normalized embeddings for texts; distinct uncached texts are embedded in one call"""
+        keys = [normalize_query(text) for text in texts]
+        embeddings = {}
+        for key, text in zip(keys, texts):
+            if key not in embeddings:
+                embeddings[key] = self.query_cache.cached(text) if self.query_cache is not None else None
+        missing = {key: text for key, text in zip(keys, texts) if embeddings[key] is None}
+        if missing:
+            with metrics.stage('service_embed'):
+                embedded = await self.embed_many(list(missing.values()))
+            for (key, text), embedding in zip(missing.items(), embedded):
+                embeddings[key] = embedding
+                if self.query_cache is not None:
+                    self.query_cache.put(text, embedding)
+        return normalize(np.asarray([embeddings[key] for key in keys], dtype=np.float32))
+
+
+def request_filter(spec):
+    """ProductFilter from a JSON request's filter object; range arguments are [low, high] lists"""
+    if not spec:
+        return None
+    return ProductFilter(**{key: tuple(value) if key in ('decade', 'price', 'condition') else value
+                            for key, value in spec.items()})
+
+
+def arrow_schema(columns):
+    """Arrow schema of a streamed result with these SEARCH_COLUMNS, plus distance and the query's qid"""
+    import pyarrow as pa
+
+    types = {'product_id': pa.uint32(), 'decade': pa.uint16(), 'materials': pa.list_(pa.string()),
+             'colors': pa.list_(pa.string()), 'condition_rating': pa.float32(), 'price_dollars': pa.float32()}
+    return pa.schema([(column, types.get(column, pa.string())) for column in columns]
+                     + [('distance', pa.float64()), ('qid', pa.int64())])
+
+
+class ChunkSink:
+    """Write-only file object collecting Arrow IPC bytes until they are sent as one HTTP chunk"""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+async def _send_chunk(writer, data):
+    """Send data as one HTTP chunk; an empty chunk ends the response, so only pass b"" for that"""
+    writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+    await writer.drain()
+
+
+async def _respond(writer, status, body, content_type='application/json'):
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                 + body)
+    await writer.drain()
+
+
+async def _stream_results(service, writer, queries, options, arrow):
+    """Write each query's results as soon as it completes: NDJSON lines or Arrow IPC record batches"""
+    import pyarrow as pa
+
+    async def run(qid, query):
+        try:
+            return qid, await service.search(query, **options), None
+        except ServiceOverloaded as e:
+            return qid, None, f"overloaded: {e}"
+        except asyncio.TimeoutError:
+            return qid, None, "timeout"
+        except Exception as e:
+            return qid, None, str(e)
+
+    content_type = ARROW_STREAM if arrow else 'application/x-ndjson'
+    writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nTransfer-Encoding: chunked\r\n\r\n".encode())
+    sink = ChunkSink()
+    stream = None
+    if arrow:
+        # Fixed up front: a schema inferred from an empty first result would type its list columns as null
+        schema = arrow_schema(options['columns'])
+        stream = pa.ipc.new_stream(sink, schema)
+    for completed in asyncio.as_completed([run(qid, query) for qid, query in enumerate(queries)]):
+        qid, result, error = await completed
+        if not arrow:
+            line = {'qid': qid, 'query': queries[qid]}
+            line.update({'error': error} if error else {'results': json.loads(result.to_json(orient='records'))})
+            await _send_chunk(writer, json.dumps(line).encode() + b"\n")
+            continue
+        if error:
+            # An Arrow stream has no place for errors; failed queries are simply missing from it
+            continue
+        stream.write_table(pa.Table.from_pandas(result.assign(qid=qid)[schema.names], schema=schema,
+                                                preserve_index=False))
+        # An empty result writes no record batch; its empty payload must not go out as the final chunk
+        payload = sink.take()
+        if payload:
+            await _send_chunk(writer, payload)
+    if stream is not None:
+        stream.close()
+        await _send_chunk(writer, sink.take())
+    await _send_chunk(writer, b"")
+
+
+async def handle_connection(service, reader, writer):
+    """
+    Minimal HTTP/1.1 front end: POST /search with a JSON body
+
+    The body holds "query" (or "queries", a list) and optionally "top_n",
+    "filter" (ProductFilter arguments), "columns" and "timeout". Results are
+    streamed back per query as NDJSON, or as an Arrow IPC stream when the
+    Accept header asks for application/vnd.apache.arrow.stream.
+    """
+    try:
+        request_line = (await reader.readline()).decode().split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if len(request_line) < 2 or request_line[0] != 'POST' or request_line[1] != '/search':
+            await _respond(writer, '404 Not Found', b'{"error": "POST /search"}')
+            return
+        try:
+            body = json.loads(await reader.readexactly(int(headers.get('content-length', 0))))
+            queries = body['queries'] if 'queries' in body else [body['query']]
+            options = {'top_n': int(body.get('top_n', 5)), 'filter_conditions': request_filter(body.get('filter')),
+                       'columns': body.get('columns', SEARCH_COLUMNS), 'timeout': body.get('timeout')}
+            unknown = set(options['columns']) - set(SEARCH_COLUMNS)
+            if unknown:
+                raise ValueError(f"Unknown search columns: {sorted(unknown)}")
+        except (ValueError, KeyError, TypeError) as e:
+            await _respond(writer, '400 Bad Request', json.dumps({'error': str(e)}).encode())
+            return
+        if service.overloaded(len(queries)):
+            metrics.increment('service_rejected')
+            await _respond(writer, '503 Service Unavailable', b'{"error": "overloaded"}')
+            return
+        await _stream_results(service, writer, queries, options, ARROW_STREAM in headers.get('accept', ''))
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service, host='0.0.0.0', port=8080):
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(service, reader, writer), host, port)
+    async with server:
+        print(f"Serving POST /search on {host}:{port}")
+        await server.serve_forever()
+
+
+async def _main(args):
+    from clients import async_clickhouse_client, async_openai_client
+
+    query_cache = QueryEmbeddingCache(None, f'{MODEL}-{DIMENSIONS}')
+    if EMBEDDING_BACKEND == 'local':
+        embed_many = local_embedder_async(local_embedder())
+    else:
+        # Set OPENAI_BASE_URL to use a local stand-in embedding endpoint
+        embed_many = openai_embedder(async_openai_client())
+    if args.local:
+        # In-process stand-in for ClickHouse over a generated product file
+        from local_search import LocalSearchBackend
+
+        score_many = local_scorer(LocalSearchBackend.from_file(args.local, embed_fn=None, metric='cosine'))
+    else:
+        score_many = clickhouse_scorer(await async_clickhouse_client(args.max_connections))
+    service = QueryService(embed_many, score_many, query_cache,
+                           batch_window=args.window_ms / 1000, max_batch_size=args.max_batch_size,
+                           max_concurrent_batches=args.max_concurrent_batches, max_pending=args.max_pending,
+                           timeout=args.timeout)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    async with service:
+        await serve(service, args.host, args.port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching async vector search service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--window-ms", type=float, default=BATCH_WINDOW * 1000, help="Batching window")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-concurrent-batches", type=int, default=MAX_CONCURRENT_BATCHES)
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING)
+    parser.add_argument("--max-connections", type=int, default=MAX_CONCURRENT_BATCHES,
+                        help="Pooled ClickHouse connections")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="Per-request timeout in seconds")
+    parser.add_argument("--local", metavar="PRODUCTS_PATH",
+                        help="Score with an in-process LocalSearchBackend over this product file instead of ClickHouse")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import json
+import time
+import hashlib
+
+import numpy as np
+
+from metrics import metrics
+from product_io import take_rows
+
+# Fields that make up a product's content; a change to any of them re-inserts the row
+CONTENT_COLUMNS = [
+    'name', 'category', 'subcategory', 'era', 'decade', 'materials', 'colors',
+    'condition_rating', 'price_dollars', 'description', 'date_added'
+]
+
+
+def content_hashes(batch):
+    """64-bit content hash per product of a columnar block"""
+    dates = np.datetime_as_string(np.asarray(batch['date_added'], dtype='datetime64[s]')).tolist()
+    columns = [dates if key == 'date_added' else batch[key].tolist() if isinstance(batch[key], np.ndarray)
+               else batch[key] for key in CONTENT_COLUMNS]
+    hashes = np.empty(len(dates), dtype=np.uint64)
+    for i, row in enumerate(zip(*columns)):
+        # float32 values are rounded so the hash doesn't depend on how the file stored them
+        row = [round(value, 2) if isinstance(value, float) else value for value in row]
+        digest = hashlib.blake2b(json.dumps(row).encode(), digest_size=8).digest()
+        hashes[i] = int.from_bytes(digest, 'little')
+    return hashes
+
+
+class LoadedProducts:
+    """
+    product_id -> content_hash of the rows already in the table, as sorted arrays
+
+    Args:
+        product_ids: Sorted product ids
+        hashes: Content hashes aligned with product_ids
+    """
+
+    def __init__(self, product_ids, hashes):
+        self.product_ids = product_ids
+        self.hashes = hashes
+        self.seen = np.zeros(len(product_ids), dtype=bool)
+
+    @classmethod
+    def from_table(cls, client, table='nostalgia_bin'):
+        """Read the latest hash per product; only two fixed-width columns are scanned"""
+        product_ids, hashes = [], []
+        with client.query_arrow_stream(f'''
+        SELECT product_id, argMax(content_hash, version) AS content_hash
+        FROM {table}
+        GROUP BY product_id
+        ORDER BY product_id
+        ''') as stream:
+            for batch in stream:
+                product_ids.append(batch.column('product_id').to_numpy())
+                hashes.append(batch.column('content_hash').to_numpy())
+        if not product_ids:
+            return cls(np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint64))
+        return cls(np.concatenate(product_ids), np.concatenate(hashes))
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def classify(self, product_ids, hashes):
+        """(new, changed) boolean masks for a block of products"""
+        if not len(self):
+            return np.ones(len(product_ids), dtype=bool), np.zeros(len(product_ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.product_ids, product_ids), len(self) - 1)
+        known = self.product_ids[pos] == product_ids
+        self.seen[pos[known]] = True
+        return ~known, known & (self.hashes[pos] != hashes)
+
+    def missing(self):
+        """Loaded product_ids that no source batch contained so far"""
+        return self.product_ids[~self.seen]
+
+
+def diff_batches(batches, loaded, version=None, stats=None):
+    """
+    Keep only new or changed products, tagged with content_hash and version columns
+
+    Args:
+        batches: Iterable of columnar product blocks
+        loaded: LoadedProducts for the destination table
+        version: ReplacingMergeTree version for this sync; defaults to the current time in ms
+        stats: Optional dict updated with 'scanned', 'new', 'changed' and 'unchanged' counts
+    """
+    version = int(time.time() * 1000) if version is None else version
+    stats = stats if stats is not None else {}
+    for key in ('scanned', 'new', 'changed', 'unchanged'):
+        stats.setdefault(key, 0)
+    for batch in batches:
+        with metrics.stage('content_hash'):
+            hashes = content_hashes(batch)
+            new, changed = loaded.classify(np.asarray(batch['product_id']), hashes)
+        keep = new | changed
+        stats['scanned'] += len(hashes)
+        stats['new'] += int(new.sum())
+        stats['changed'] += int(changed.sum())
+        stats['unchanged'] += len(hashes) - int(keep.sum())
+        if not keep.any():
+            continue
+        batch = take_rows(batch, keep)
+        batch['content_hash'] = hashes[keep]
+        batch['version'] = np.full(len(batch['product_id']), version, dtype=np.uint64)
+        yield batch
+
+
+def vector_index_exists(client, table='nostalgia_bin', name='embedding_index'):
+    return bool(client.command(f'''
+    SELECT count() FROM system.vector_indices
+    WHERE database = currentDatabase() AND table = '{table}' AND name = '{name}'
+    '''))
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generator import generate_products_batch  # noqa: E402
+from local_search import RESULT_COLUMNS, LocalSearchBackend  # noqa: E402
+
+NUM_PRODUCTS = 3000
+DIMENSIONS = 32
+
+
+@pytest.fixture(scope="session")
+def catalog():
+    """Columnar block of generated products with their mock embeddings"""
+    return generate_products_batch(NUM_PRODUCTS, seed=7, dimensions=DIMENSIONS)
+
+
+@pytest.fixture(scope="session")
+def products(catalog):
+    return pd.DataFrame({column: catalog[column] for column in RESULT_COLUMNS})
+
+
+@pytest.fixture(scope="session")
+def embeddings(catalog):
+    return np.asarray(catalog['embedding'], dtype=np.float32)
+
+
+@pytest.fixture
+def backend(products, embeddings):
+    return LocalSearchBackend(products, embeddings, embed_fn=None)
+
+
+@pytest.fixture(scope="session")
+def queries(embeddings):
+    """Query vectors near random catalog rows"""
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(embeddings), 20, replace=False)
+    return embeddings[rows] + rng.normal(0, 0.05, (20, embeddings.shape[1])).astype(np.float32)
@@ -0,0 +1,60 @@
+import numpy as np
+
+import ann
+from ann import HNSWIndex, IVFFlatIndex, assign, exact_search, kmeans, recall_at_k
+
+
+def test_ivf_probing_every_list_is_exact(embeddings, queries):
+    index = IVFFlatIndex.train(embeddings, nlist=16)
+    index.add(embeddings)
+    assert recall_at_k(index, embeddings, queries, k=10, nprobe=16) == 1.0
+    assert recall_at_k(index, embeddings, queries, k=10, nprobe=4) > 0.5
+
+
+def test_ivf_search_returns_exact_distances(embeddings, queries):
+    index = IVFFlatIndex.train(embeddings, nlist=8)
+    index.add(embeddings)
+    ids, distances = index.search(queries[0], k=5, nprobe=8)
+    expected_ids, expected_distances = exact_search(embeddings, queries[0], 5)
+    np.testing.assert_array_equal(ids, expected_ids[np.argsort(expected_distances)])
+    np.testing.assert_allclose(distances, np.sort(expected_distances), rtol=1e-4)
+
+
+def test_nlist_is_capped_at_the_number_of_vectors(embeddings):
+    assert len(kmeans(embeddings[:5], 50)) == 5
+    index = IVFFlatIndex.train(embeddings[:5], nlist=50)
+    index.add(embeddings[:5])
+    ids, _ = index.search(embeddings[0], k=3, nprobe=5)
+    assert ids[0] == 0
+
+
+def test_assign_in_blocks_matches_one_pass(monkeypatch, embeddings):
+    centroids = kmeans(embeddings, 16)
+    expected = np.argmin(((embeddings[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2), axis=1)
+    # A budget of 100 rows per block
+    monkeypatch.setattr(ann, 'ASSIGN_BLOCK_BYTES', 100 * 4 * len(centroids))
+    np.testing.assert_array_equal(assign(embeddings, centroids), expected)
+
+
+def test_hnsw_recall(embeddings, queries):
+    index = HNSWIndex(embeddings.shape[1])
+    index.add(embeddings[:1000])
+    assert recall_at_k(index, embeddings[:1000], queries, k=10, ef=64) > 0.9
+
+
+def test_empty_hnsw_returns_nothing(embeddings):
+    ids, distances = HNSWIndex(embeddings.shape[1]).search(embeddings[0], k=5)
+    assert len(ids) == 0 and len(distances) == 0
+
+
+def test_saved_indexes_return_the_same_results(tmp_path, embeddings, queries):
+    ivf = IVFFlatIndex.train(embeddings, nlist=8)
+    ivf.add(embeddings)
+    ivf.save(tmp_path / "ivf")
+    hnsw = HNSWIndex(embeddings.shape[1])
+    hnsw.add(embeddings[:500])
+    hnsw.save(tmp_path / "hnsw")
+    for index, loaded, params in ((ivf, IVFFlatIndex.load(tmp_path / "ivf"), {'nprobe': 2}),
+                                  (hnsw, HNSWIndex.load(tmp_path / "hnsw"), {'ef': 32})):
+        for query in queries[:5]:
+            np.testing.assert_array_equal(loaded.search(query, 10, **params)[0], index.search(query, 10, **params)[0])
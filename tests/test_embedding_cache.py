@@ -0,0 +1,67 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+DIMENSIONS = 4
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts.extend(texts)
+        return np.array([[len(text), i, 1, 0] for i, text in enumerate(texts)], dtype=np.float32)
+
+
+def test_only_uncached_texts_are_embedded(tmp_path):
+    cache = EmbeddingCache(tmp_path, 'model', DIMENSIONS)
+    embed = CountingEmbedder()
+    first = cache.get_or_embed(['a', 'bb', 'a'], embed)
+    assert embed.texts == ['a', 'bb']
+    assert cache.duplicates == 1
+    second = cache.get_or_embed(['bb', 'ccc', 'a'], embed)
+    assert embed.texts == ['a', 'bb', 'ccc']
+    np.testing.assert_array_equal(second[0], first[1])
+    np.testing.assert_array_equal(second[2], first[0])
+
+
+def test_cache_persists_across_instances(tmp_path):
+    texts = [f'text {i}' for i in range(500)]
+    embed = CountingEmbedder()
+    cache = EmbeddingCache(tmp_path, 'model', DIMENSIONS)
+    for start in range(0, 500, 100):
+        cache.get_or_embed(texts[start:start + 100], embed)
+    expected = cache.get_or_embed(texts, embed)
+
+    reopened = EmbeddingCache(tmp_path, 'model', DIMENSIONS)
+    assert len(reopened) == 500
+    embed.texts.clear()
+    np.testing.assert_array_equal(reopened.get_or_embed(texts, embed), expected)
+    assert embed.texts == []
+    # The index merged in memory on add matches the one built from the files
+    np.testing.assert_array_equal(reopened._sorted_keys, cache._sorted_keys)
+    np.testing.assert_array_equal(reopened._order, cache._order)
+
+
+def test_model_and_dimensions_are_separate_caches(tmp_path):
+    EmbeddingCache(tmp_path, 'model', DIMENSIONS).get_or_embed(['a'], CountingEmbedder())
+    assert len(EmbeddingCache(tmp_path, 'other-model', DIMENSIONS)) == 0
+
+
+def test_compact_evicts_stale_rows(tmp_path):
+    texts = [f'text {i}' for i in range(100)]
+    cache = EmbeddingCache(tmp_path, 'model', DIMENSIONS)
+    embed = CountingEmbedder()
+    expected = cache.get_or_embed(texts, embed)
+
+    # A few stale rows aren't worth a rewrite
+    assert cache.compact({cache.key(text) for text in texts[:90]}) == 0
+    assert len(cache) == 100
+
+    assert cache.compact({cache.key(text) for text in texts[:50]}) == 50
+    assert len(cache) == 50
+    embed.texts.clear()
+    np.testing.assert_array_equal(cache.get_or_embed(texts[:50], embed), expected[:50])
+    assert embed.texts == []
+    assert len(EmbeddingCache(tmp_path, 'model', DIMENSIONS)) == 50
@@ -0,0 +1,78 @@
+import threading
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
+import openai
+import pytest
+
+import embeddings
+from embeddings import embed_texts, truncate
+
+
+def rate_limit_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    return openai.RateLimitError("rate limited", response=httpx.Response(429, request=request), body=None)
+
+
+class StubClient:
+    """Stands in for the OpenAI client; embeds a text as [len(text), position], answers out of order"""
+
+    def __init__(self, rate_limited=0):
+        self.rate_limited = rate_limited
+        self.requests = []
+        self.options = []
+        self._lock = threading.Lock()
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def create(self, model, input, **kwargs):
+        with self._lock:
+            self.requests.append(list(input))
+            self.options.append(kwargs)
+            if self.rate_limited:
+                self.rate_limited -= 1
+                raise rate_limit_error()
+        data = [SimpleNamespace(index=i, embedding=[float(len(text)), float(text.split()[-1])])
+                for i, text in enumerate(input)]
+        return SimpleNamespace(data=data[::-1])
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(embeddings.time, 'sleep', lambda seconds: None)
+
+
+def test_order_is_kept_across_batches():
+    texts = [f"product {i}" for i in range(1000)]
+    client = StubClient()
+    vectors = embed_texts(client, texts, batch_size=64, max_concurrent=4, show_progress=False)
+    assert len(client.requests) == 16
+    assert max(len(batch) for batch in client.requests) == 64
+    assert vectors == [[float(len(text)), float(i)] for i, text in enumerate(texts)]
+
+
+def test_rate_limited_batches_are_retried():
+    texts = [f"product {i}" for i in range(10)]
+    client = StubClient(rate_limited=2)
+    vectors = embed_texts(client, texts, batch_size=5, max_concurrent=1, show_progress=False)
+    assert len(client.requests) == 4
+    assert [vector[1] for vector in vectors] == list(range(10))
+
+
+def test_gives_up_after_max_retries():
+    client = StubClient(rate_limited=10)
+    with pytest.raises(openai.RateLimitError):
+        embed_texts(client, ["product 1"], max_retries=2, show_progress=False)
+    assert len(client.requests) == 3
+
+
+def test_dimensions_are_only_requested_when_set():
+    client = StubClient()
+    embed_texts(client, ["product 1"], show_progress=False)
+    embed_texts(client, ["product 2"], show_progress=False, dimensions=256)
+    assert client.options == [{}, {'dimensions': 256}]
+
+
+def test_truncate_renormalizes_the_prefix():
+    vectors = np.array([[3.0, 4.0, 12.0], [1.0, 0.0, 5.0]], dtype=np.float32)
+    np.testing.assert_allclose(truncate(vectors, 2), [[0.6, 0.8], [1.0, 0.0]], rtol=1e-6)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from filters import FilterIndex, ProductFilter
+
+COLUMNS = {
+    'category': np.array(['Toys', 'Furniture', 'Toys', 'Electronics', 'Toys']),
+    'decade': np.array([1950, 1960, 1970, 1980, 1990]),
+    'price_dollars': np.array([10.0, 250.0, 40.5, 99.0, 5.0]),
+    'materials': [['Wood'], ['Wood', 'Glass'], ['Plastic'], ['Plastic', 'Metal'], ['Wood', 'Wood']],
+}
+
+
+def test_to_sql_escapes_literals():
+    product_filter = ProductFilter(category=["Toys", "Kid's"], decade=(1960, None), materials='Wood')
+    assert product_filter.to_sql() == ("category IN ('Toys', 'Kid\\'s') AND decade >= 1960 "
+                                       "AND hasAny(materials, ['Wood'])")
+
+
+def test_ranges_must_be_tuples():
+    with pytest.raises(ValueError):
+        ProductFilter(price=100)
+    assert not ProductFilter()
+
+
+@pytest.mark.parametrize("conditions,expected", [
+    ({'category': 'Toys'}, [0, 2, 4]),
+    ({'category': ['Toys', 'Furniture'], 'decade': (1960, 1990)}, [1, 2]),
+    ({'materials': 'Wood'}, [0, 1, 4]),
+    ({'materials': ['Glass', 'Metal'], 'price_dollars': (None, 100)}, [3]),
+    ({'category': 'Garden'}, []),
+    ({}, [0, 1, 2, 3, 4]),
+])
+def test_select(conditions, expected):
+    assert FilterIndex(COLUMNS).select(conditions).tolist() == expected
+
+
+def test_counts_come_from_the_index():
+    index = FilterIndex(COLUMNS)
+    assert index.count('category', 'Toys') == 3
+    assert index.count('price_dollars', (10.0, 100)) == 3
+    assert index.selectivity({'category': 'Toys', 'decade': (None, 1960)}) == pytest.approx(3 / 5 * 1 / 5)
@@ -0,0 +1,88 @@
+import os
+import sys
+
+import numpy as np
+
+import generator
+from generator import child_seed, generate_products_batch, generate_sharded
+from product_io import file_sha256, read_embeddings
+
+DIMENSIONS = 8
+
+
+def assert_blocks_equal(a, b):
+    assert a.keys() == b.keys()
+    for key in a:
+        if isinstance(a[key], list):
+            assert a[key] == b[key], key
+        else:
+            np.testing.assert_array_equal(a[key], b[key])
+
+
+def test_same_seed_gives_identical_blocks():
+    first = generate_products_batch(300, seed=3, dimensions=DIMENSIONS)
+    assert_blocks_equal(first, generate_products_batch(300, seed=3, dimensions=DIMENSIONS))
+    other = generate_products_batch(300, seed=4, dimensions=DIMENSIONS)
+    assert first['description'] != other['description']
+    assert not np.array_equal(first['embedding'], other['embedding'])
+
+
+def test_block_columns():
+    batch = generate_products_batch(300, seed=3, start_id=101, dimensions=DIMENSIONS)
+    assert batch['product_id'].tolist() == list(range(101, 401))
+    assert all(1 <= len(materials) <= 3 and len(set(materials)) == len(materials) for materials in batch['materials'])
+    assert all(1 <= len(colors) <= 3 and len(set(colors)) == len(colors) for colors in batch['colors'])
+    np.testing.assert_allclose(np.linalg.norm(batch['embedding'], axis=1), 1, rtol=1e-5)
+    for category, subcategory in zip(batch['category'], batch['subcategory']):
+        assert subcategory in generator.CATEGORIES[category]
+
+
+def test_dates_cover_the_last_three_years_at_any_time_of_day():
+    dates = generate_products_batch(300, seed=3, dimensions=DIMENSIONS)['date_added']
+    assert dates.dtype == np.dtype('datetime64[s]')
+    assert (dates <= generator.REFERENCE_DATE).all()
+    assert (dates > generator.REFERENCE_DATE - np.timedelta64(3 * 365 + 1, 'D')).all()
+    seconds_of_day = (dates - dates.astype('datetime64[D]')).astype(int)
+    assert len(np.unique(seconds_of_day)) > 250
+
+
+def shard_hashes(output_dir, workers):
+    manifest = generate_sharded(250, output_dir, shard_size=100, workers=workers, seed=5, dimensions=DIMENSIONS)
+    return [shard['sha256'] for shard in manifest['shards']]
+
+
+def test_shards_are_identical_for_any_worker_count(tmp_path):
+    hashes = shard_hashes(tmp_path / 'one', workers=1)
+    assert len(hashes) == 3
+    assert shard_hashes(tmp_path / 'three', workers=3) == hashes
+
+
+def test_batch_output_equals_concatenated_shards(tmp_path, monkeypatch):
+    generate_sharded(250, tmp_path / 'shards', shard_size=100, workers=2, seed=5, dimensions=DIMENSIONS)
+    output = os.path.join(tmp_path, 'products.ndjson')
+    monkeypatch.setattr(sys, 'argv', ['generator.py', '--batch', '--num-products', '250', '--block-size', '100',
+                                      '--seed', '5', '--dimensions', str(DIMENSIONS), '--output', output])
+    generator.main()
+
+    shards = os.path.join(tmp_path, 'shards')
+    with open(output, 'rb') as f:
+        batch_text = f.read()
+    shard_text = b''
+    for i in range(3):
+        with open(os.path.join(shards, f'shard-{i:05d}.ndjson'), 'rb') as f:
+            shard_text += f.read()
+    assert batch_text == shard_text
+    np.testing.assert_array_equal(read_embeddings(output), read_embeddings(shards))
+
+
+def test_child_seed_matches_spawn():
+    spawned = np.random.SeedSequence(9).spawn(4)
+    for index, expected in enumerate(spawned):
+        assert child_seed(9, index).generate_state(2).tolist() == expected.generate_state(2).tolist()
+
+
+def test_shard_files_are_hashed(tmp_path):
+    manifest = generate_sharded(50, tmp_path, shard_size=100, workers=1, seed=5, dimensions=DIMENSIONS)
+    shard = manifest['shards'][0]
+    paths = [os.path.join(tmp_path, shard['path']), os.path.join(tmp_path, 'shard-00000.embeddings.npy')]
+    assert shard['sha256'] == file_sha256(*paths)
@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import ingest
+from ingest import ChunkInsertError, _insert_with_retry, create_products_table, stream_insert, to_arrow
+
+
+class StubClient:
+    """Records insert_arrow calls; the first `failures` calls raise"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.inserts = []
+
+    def insert_arrow(self, table, arrow_table, settings=None):
+        self.inserts.append((table, arrow_table.num_rows, settings['insert_deduplication_token']))
+        if len(self.inserts) <= self.failures:
+            raise ConnectionError("connection reset")
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ingest.time, 'sleep', lambda seconds: None)
+
+
+def rows(catalog, start, stop):
+    return {key: value[start:stop] for key, value in catalog.items()}
+
+
+@pytest.fixture
+def arrow_block(catalog):
+    return to_arrow(rows(catalog, 100, 200))
+
+
+def test_retries_reuse_the_deduplication_token(arrow_block):
+    client = StubClient(failures=2)
+    _insert_with_retry(client, 'products', arrow_block, max_retries=3)
+    assert len(client.inserts) == 3
+    assert {token for _, _, token in client.inserts} == {'products-101-200'}
+
+
+def test_gives_up_with_the_resume_point(arrow_block):
+    client = StubClient(failures=10)
+    with pytest.raises(ChunkInsertError) as error:
+        _insert_with_retry(client, 'products', arrow_block, max_retries=2)
+    assert len(client.inserts) == 3
+    assert error.value.first_product_id == 101
+    assert error.value.last_product_id == 200
+
+
+def test_token_includes_the_sync_version(catalog):
+    batch = rows(catalog, 0, 10)
+    batch['content_hash'] = np.zeros(10, dtype=np.uint64)
+    batch['version'] = np.full(10, 42, dtype=np.uint64)
+    client = StubClient()
+    _insert_with_retry(client, 'products', to_arrow(batch), max_retries=0)
+    assert client.inserts[0][2] == 'products-1-10-42'
+
+
+def test_stream_insert_embeds_and_resumes(catalog):
+    blocks = [rows(catalog, start, start + 500) for start in range(0, 3000, 500)]
+    embedded = []
+
+    def embed(descriptions):
+        embedded.append(len(descriptions))
+        return np.ones((len(descriptions), catalog['embedding'].shape[1]), dtype=np.float32)
+
+    client = StubClient()
+    stats = stream_insert(client, blocks, embed, table='products', resume_after=1200)
+    assert stats['rows'] == 1800
+    assert sum(embedded) == 1800
+    assert [rows for _, rows, _ in client.inserts] == [300, 500, 500, 500]
+    assert client.inserts[0][2] == 'products-1201-1500'
+
+
+class SchemaClient:
+    """Answers system.columns queries from a dict of table -> columns and records the DDL it is sent"""
+
+    BASE_COLUMNS = ['product_id', 'name', 'category', 'subcategory', 'era', 'decade', 'materials', 'colors',
+                    'condition_rating', 'price_dollars', 'description', 'embedding', 'date_added']
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.commands = []
+
+    def command(self, sql):
+        self.commands.append(' '.join(sql.split()))
+        if sql.strip().startswith('CREATE TABLE'):
+            name = sql.split()[5]
+            self.tables.setdefault(name, self.BASE_COLUMNS + ['content_hash', 'version'])
+
+    def query(self, sql):
+        table = sql.split("table = '")[1].split("'")[0]
+        return SimpleNamespace(result_rows=[(column,) for column in self.tables.get(table, [])])
+
+
+def test_current_table_is_left_alone():
+    client = SchemaClient({})
+    create_products_table(client, 'products', dimensions=8)
+    assert len(client.commands) == 1
+    assert 'ReplacingMergeTree(version)' in client.commands[0]
+
+
+def test_table_without_sync_columns_is_migrated():
+    client = SchemaClient({'products': list(SchemaClient.BASE_COLUMNS)})
+    create_products_table(client, 'products', dimensions=8)
+    columns = ', '.join(SchemaClient.BASE_COLUMNS)
+    assert client.commands[1] == 'DROP TABLE IF EXISTS products_migrated'
+    assert client.commands[2].startswith('CREATE TABLE IF NOT EXISTS products_migrated')
+    assert client.commands[3:] == [
+        f'INSERT INTO products_migrated ({columns}) SELECT {columns} FROM products',
+        'EXCHANGE TABLES products AND products_migrated',
+        'DROP TABLE products_migrated',
+    ]
@@ -0,0 +1,40 @@
+import numpy as np
+
+from keyword_search import BM25Index, reciprocal_rank_fusion
+
+TEXTS = [
+    "red lava lamp from the seventies",
+    "walnut record cabinet",
+    "red telephone rotary dial",
+    "lava lamp lava lamp groovy",
+]
+
+
+def test_bm25_ranks_by_term_matches():
+    index = BM25Index.build(TEXTS, ids=[10, 11, 12, 13])
+    ids, scores = index.search("lava lamp", k=3)
+    assert set(ids.tolist()) == {10, 13}
+    assert ids[0] == 13
+    assert np.all(np.diff(scores) <= 0)
+
+
+def test_bm25_matches_any_or_all_terms():
+    index = BM25Index.build(TEXTS)
+    assert index.matches("red lamp").tolist() == [0, 2, 3]
+    assert index.matches("red lamp", require_all=True).tolist() == [0]
+    assert index.matches("unknown").tolist() == []
+
+
+def test_bm25_respects_allowed_rows():
+    index = BM25Index.build(TEXTS)
+    allowed = np.array([False, True, True, True])
+    rows, _ = index.search_rows("red lamp", k=5, allowed=allowed)
+    assert 0 not in rows.tolist()
+
+
+def test_reciprocal_rank_fusion():
+    ids, scores = reciprocal_rank_fusion([np.array([1, 2, 3]), np.array([3, 1, 4])], k=60)
+    # 1 and 3 appear in both rankings; 1 ranks higher on average
+    assert ids.tolist()[:2] == [1, 3]
+    assert scores[0] == 1 / 61 + 1 / 62
+    assert set(ids.tolist()) == {1, 2, 3, 4}
@@ -0,0 +1,119 @@
+import sys
+import threading
+import types
+
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache
+from embeddings import EMBEDDING_MODEL
+from local_embeddings import LOCAL_EMBEDDING_MODEL, LocalEmbedder
+
+DIMENSIONS = 3
+
+
+def raw_vector(text):
+    return [float(len(text)), float(text.split()[-1]), 1.0]
+
+
+class StubModel:
+    """Stands in for SentenceTransformer: unnormalized [len(text), number in text, 1] vectors"""
+
+    instances = []
+
+    def __init__(self, name, device=None):
+        self.name = name
+        self.batches = []
+        self._lock = threading.Lock()
+        StubModel.instances.append(self)
+
+    def get_sentence_embedding_dimension(self):
+        return DIMENSIONS
+
+    def eval(self):
+        pass
+
+    def encode(self, texts, batch_size=None, convert_to_numpy=True, show_progress_bar=False):
+        with self._lock:
+            self.batches.append(list(texts))
+        return np.array([raw_vector(text) for text in texts], dtype=np.float32)
+
+    def start_multi_process_pool(self, devices):
+        return {'devices': devices}
+
+    def encode_multi_process(self, texts, pool, batch_size=None, chunk_size=None):
+        return self.encode(texts)
+
+    def stop_multi_process_pool(self, pool):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def stub_model(monkeypatch):
+    StubModel.instances.clear()
+    monkeypatch.setitem(sys.modules, 'torch', types.SimpleNamespace(set_num_threads=lambda threads: None))
+    monkeypatch.setitem(sys.modules, 'sentence_transformers', types.SimpleNamespace(SentenceTransformer=StubModel))
+
+
+def texts(n):
+    # Varying lengths so the length sort actually reorders them
+    return [("vintage " * (i % 7)) + f"lamp {i}" for i in range(n)]
+
+
+def test_batches_are_length_sorted_and_output_is_in_input_order():
+    embedder = LocalEmbedder(batch_size=16, workers=3)
+    inputs = texts(100)
+    vectors = embedder.embed_many(inputs)
+    batches = StubModel.instances[0].batches
+    assert len(batches) == 7
+    assert max(len(batch) for batch in batches) == 16
+    assert sorted(text for batch in batches for text in batch) == sorted(inputs)
+    # Each batch holds texts of similar length
+    lengths = [len(text) for batch in sorted(batches, key=lambda batch: -len(batch[0])) for text in batch]
+    assert lengths == sorted(lengths, reverse=True)
+
+    expected = np.array([raw_vector(text) for text in inputs], dtype=np.float32)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    assert vectors.dtype == np.float32
+    np.testing.assert_allclose(vectors, expected, rtol=1e-6)
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1, rtol=1e-6)
+    embedder.close()
+
+
+def test_process_pool_keeps_order():
+    embedder = LocalEmbedder(workers=2, processes=True)
+    inputs = texts(20)
+    vectors = embedder.embed_many(inputs)
+    assert StubModel.instances[0].batches == [sorted(inputs, key=len, reverse=True)]
+    expected = np.array([raw_vector(text) for text in inputs], dtype=np.float32)
+    np.testing.assert_allclose(vectors, expected / np.linalg.norm(expected, axis=1, keepdims=True), rtol=1e-6)
+    embedder.close()
+
+
+def test_model_is_loaded_once_on_first_use():
+    embedder = LocalEmbedder()
+    assert StubModel.instances == []
+    embedder.embed("lamp 1")
+    embedder.embed_many(["lamp 2", "lamp 3"])
+    assert len(StubModel.instances) == 1
+    assert StubModel.instances[0].name == LOCAL_EMBEDDING_MODEL
+    assert embedder.embed_many([]).shape == (0, DIMENSIONS)
+
+
+def test_dimension_mismatch_is_rejected():
+    with pytest.raises(ValueError, match="EMBEDDING_DIMENSIONS=3"):
+        LocalEmbedder(dimensions=384).embed("lamp 1")
+
+
+def test_cache_keys_include_the_model_name(tmp_path):
+    embedder = LocalEmbedder()
+    local_cache = EmbeddingCache(tmp_path, embedder.model, DIMENSIONS)
+    inputs = texts(10)
+    vectors = local_cache.get_or_embed(inputs, embedder.embed_many)
+    np.testing.assert_allclose(vectors, embedder.embed_many(inputs))
+
+    # The same texts under another model are separate entries, never served from the local model's vectors
+    other_cache = EmbeddingCache(tmp_path, EMBEDDING_MODEL, DIMENSIONS)
+    assert local_cache.key(inputs[0]) != other_cache.key(inputs[0])
+    assert len(other_cache) == 0
+    assert (other_cache.lookup([other_cache.key(text) for text in inputs]) == -1).all()
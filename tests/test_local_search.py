@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+
+from filters import ProductFilter
+from local_search import LocalSearchBackend
+from product_io import ProductWriter
+
+FILTERS = [
+    {'category': 'Electronics'},
+    {'era': ['Mid-Century Modern', 'Space Age'], 'price_dollars': (None, 500)},
+    {'decade': (1970, 1990), 'condition_rating': (3.0, None)},
+]
+SELECTIVE = ProductFilter(category='Electronics', decade=(1980, 1990))
+BROAD = ProductFilter(condition=(3.0, None))
+ARRAY = ProductFilter(materials=['Wood', 'Glass'], price=(None, 500))
+
+
+def brute_force(embeddings, query, top_n, mask):
+    """Reference L2 top-n over the rows in mask"""
+    distances = np.linalg.norm(embeddings - query, axis=1)
+    rows = np.flatnonzero(mask)
+    return rows[np.argsort(distances[rows], kind="stable")[:top_n]], distances
+
+
+def reference_mask(products, filter_conditions):
+    mask = np.ones(len(products), dtype=bool)
+    for column, condition in filter_conditions.items():
+        values = products[column]
+        if isinstance(condition, tuple):
+            low, high = condition
+            if low is not None:
+                mask &= (values >= low).to_numpy()
+            if high is not None:
+                mask &= (values < high).to_numpy()
+        elif column in ('materials', 'colors'):
+            accepted = set(condition if isinstance(condition, list) else [condition])
+            mask &= np.array([bool(accepted & set(value)) for value in values])
+        else:
+            mask &= values.isin(condition if isinstance(condition, list) else [condition]).to_numpy()
+    return mask
+
+
+def test_search_matches_brute_force(backend, products, embeddings, queries):
+    for query in queries:
+        rows, distances = brute_force(embeddings, query, 10, np.ones(len(products), dtype=bool))
+        result = backend.search_vector(query, top_n=10)
+        assert result['product_id'].tolist() == products['product_id'][rows].tolist()
+        np.testing.assert_allclose(result['distance'], distances[rows], rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("filter_conditions", FILTERS, ids=["scalar", "list", "ranges"])
+def test_filtered_search_matches_brute_force(backend, products, embeddings, queries, filter_conditions):
+    mask = reference_mask(products, filter_conditions)
+    assert mask.any()
+    np.testing.assert_array_equal(backend.filter_mask(filter_conditions), mask)
+    for query in queries:
+        rows, _ = brute_force(embeddings, query, 10, mask)
+        result = backend.search_vector(query, top_n=10, filter_conditions=filter_conditions)
+        assert result['product_id'].tolist() == products['product_id'][rows].tolist()
+
+
+def test_top_n_larger_than_the_matches(backend, queries):
+    result = backend.search_vector(queries[0], top_n=10, filter_conditions={'category': 'Electronics',
+                                                                            'price_dollars': (0, 1)})
+    assert len(result) < 10
+    assert (result['price_dollars'] < 1).all()
+
+
+def test_from_file_matches_in_memory_backend(tmp_path, catalog, backend, queries):
+    path = str(tmp_path / "products.ndjson")
+    with ProductWriter(path, len(catalog['product_id']), catalog['embedding'].shape[1]) as writer:
+        writer.write(catalog)
+    loaded = LocalSearchBackend.from_file(path, embed_fn=lambda text: queries[0])
+    expected = backend.search_vector(queries[0], top_n=10)
+    result = loaded.vector_search("anything", top_n=10)
+    assert result['product_id'].tolist() == expected['product_id'].tolist()
+    assert list(result.columns) == list(expected.columns)
+
+
+def test_batched_search_matches_single_queries(backend, queries):
+    batched = backend.search_vectors(queries, top_n=10)
+    for query, result in zip(queries, batched):
+        single = backend.search_vector(query, top_n=10)
+        assert result['product_id'].tolist() == single['product_id'].tolist()
+        np.testing.assert_allclose(result['distance'], single['distance'], rtol=1e-4, atol=1e-5)
+
+
+def test_batched_search_with_per_query_filters(backend, queries):
+    filters = (FILTERS + [None]) * 5
+    batched = backend.search_vectors(queries, top_n=5, filter_conditions=filters)
+    for query, filter_conditions, result in zip(queries, filters, batched):
+        single = backend.search_vector(query, top_n=5, filter_conditions=filter_conditions)
+        assert result['product_id'].tolist() == single['product_id'].tolist()
+
+
+def test_batch_embeds_texts_in_one_call(products, embeddings, queries):
+    calls = []
+    backend = LocalSearchBackend(products, embeddings, embed_fn=None, metric="cosine",
+                                 embed_many_fn=lambda texts: calls.append(texts) or [queries[1], queries[2]])
+    results = backend.vector_search_batch(["lamp", queries[0], "radio"], top_n=3, columns=['product_id'])
+    assert calls == [["lamp", "radio"]]
+    for query, result in zip(queries[[1, 0, 2]], results):
+        assert list(result.columns) == ['product_id', 'distance']
+        assert result['product_id'].tolist() == backend.search_vector(query, top_n=3)['product_id'].tolist()
+
+
+def test_hybrid_search_finds_exact_terms(products, embeddings, queries):
+    backend = LocalSearchBackend(products, embeddings, embed_fn=lambda text: queries[0], metric="cosine")
+    description = products['description'][123]
+    keyword_top = backend.build_keyword_index().search_rows(description, 1)[0][0]
+    vector_top = backend.search_vector(queries[0], top_n=1)['product_id'][0]
+    result = backend.hybrid_search(description, top_n=10)
+    assert np.all(np.diff(result['score']) <= 0)
+    # Both rankings' best match survive the fusion
+    assert {products['product_id'][keyword_top], vector_top} <= set(result['product_id'].tolist())
+
+    filtered = backend.hybrid_search("walnut", top_n=5, filter_conditions={'category': 'Furniture'},
+                                     keyword_filter="all")
+    assert (filtered['category'] == 'Furniture').all()
+    assert all('walnut' in (name + " " + description).lower()
+               for name, description in zip(filtered['name'], filtered['description']))
+
+
+@pytest.mark.parametrize("product_filter", [SELECTIVE, BROAD, ARRAY], ids=["selective", "broad", "array"])
+def test_product_filter_search_matches_brute_force(backend, products, embeddings, queries, product_filter):
+    mask = reference_mask(products, product_filter.conditions)
+    assert mask.any()
+    for query in queries:
+        rows, _ = brute_force(embeddings, query, 10, mask)
+        result = backend.search_vector(query, top_n=10, filter_conditions=product_filter)
+        assert result['product_id'].tolist() == products['product_id'][rows].tolist()
+
+
+def test_filter_index_matches_mask(backend, products):
+    for product_filter in (SELECTIVE, BROAD, ARRAY):
+        expected = np.flatnonzero(reference_mask(products, product_filter.conditions))
+        np.testing.assert_array_equal(backend.filter_rows(product_filter), expected)
+        np.testing.assert_array_equal(np.flatnonzero(backend.filter_mask(product_filter)), expected)
+
+
+def test_batched_search_with_product_filters(backend, queries):
+    filters = [SELECTIVE, None, BROAD, ARRAY] * 5
+    batched = backend.search_vectors(queries, top_n=5, filter_conditions=filters)
+    for query, product_filter, result in zip(queries, filters, batched):
+        single = backend.search_vector(query, top_n=5, filter_conditions=product_filter)
+        assert result['product_id'].tolist() == single['product_id'].tolist()
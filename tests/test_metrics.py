@@ -0,0 +1,85 @@
+import tracemalloc
+
+import pytest
+
+import metrics
+from metrics import Histogram, Metrics
+
+
+def test_stages_and_counters_are_recorded():
+    registry = Metrics()
+    for _ in range(3):
+        with registry.stage('insert'):
+            pass
+    with pytest.raises(KeyError):
+        with registry.stage('lookup'):
+            raise KeyError('missing')
+    registry.increment('rows', 10)
+    registry.increment('rows', 5)
+
+    summary = registry.summary()
+    assert summary['stages']['insert']['count'] == 3
+    assert summary['stages']['lookup']['count'] == 1
+    assert summary['counters'] == {'rows': 15}
+
+
+def test_timed_decorator():
+    registry = Metrics()
+
+    @registry.timed('work')
+    def work(x):
+        return x * 2
+
+    assert work(4) == 8
+    assert registry.histograms['work'].count == 1
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(0.01, 0.1, 1.0, float('inf')))
+    for value in [0.005] * 50 + [0.05] * 45 + [0.5] * 5:
+        histogram.observe(value)
+    assert histogram.quantile(0.5) <= 0.01
+    assert 0.01 < histogram.quantile(0.95) <= 0.1
+    assert histogram.quantile(1.0) == 0.5
+
+
+def test_traced_memory_is_per_stage():
+    registry = Metrics()
+    registry.trace_memory()
+    try:
+        with registry.stage('outer'):
+            with registry.stage('allocate'):
+                data = bytearray(8 << 20)
+            del data
+    finally:
+        tracemalloc.stop()
+    assert registry.peak_memory['allocate'] >= 8 << 20
+    assert registry.peak_memory['outer'] >= registry.peak_memory['allocate']
+
+
+def test_memory_is_only_sampled_when_enabled(monkeypatch):
+    reads = []
+    monkeypatch.setattr(metrics, '_rss_bytes', lambda: reads.append(1) or 1000 * len(reads))
+    registry = Metrics()
+    with registry.stage('plain'):
+        pass
+    assert reads == []
+    assert registry.summary()['stages']['plain']['peak_memory_bytes'] is None
+
+    registry.trace_rss()
+    with registry.stage('outer'):
+        with registry.stage('inner'):
+            pass
+    # Only the top-level stage reads /proc, once on entry and once on exit
+    assert len(reads) == 2
+    assert registry.peak_memory == {'outer': 1000}
+
+
+def test_prometheus_exposition():
+    registry = Metrics()
+    with registry.stage('search'):
+        pass
+    registry.increment('queries')
+    text = registry.to_prometheus()
+    assert 'nostalgia_stage_seconds_count{stage="search"} 1' in text
+    assert 'nostalgia_queries_total 1' in text
@@ -0,0 +1,73 @@
+import sys
+
+import numpy as np
+import pytest
+
+import neighbors
+from embeddings import normalize
+from neighbors import NeighborTable
+from product_io import ProductWriter
+
+K = 5
+
+
+def brute_force(embeddings, k):
+    """Top-k neighbor rows by cosine distance, self excluded"""
+    vectors = normalize(embeddings)
+    distances = 1 - vectors @ vectors.T
+    np.fill_diagonal(distances, np.inf)
+    return np.argsort(distances, axis=1, kind='stable')[:, :k]
+
+
+@pytest.fixture
+def vectors(embeddings):
+    return embeddings[:600]
+
+
+def test_build_matches_brute_force(tmp_path, vectors):
+    product_ids = np.arange(1001, 1001 + len(vectors), dtype=np.uint32)
+    table = NeighborTable.build(product_ids, vectors, str(tmp_path), k=K, tile_size=128, workers=2)
+    expected = product_ids[brute_force(vectors, K)]
+    np.testing.assert_array_equal(table.neighbor_ids, expected)
+
+    loaded = NeighborTable.load(str(tmp_path))
+    ids, distances = loaded.neighbors(1005)
+    np.testing.assert_array_equal(ids, expected[4])
+    assert np.all(np.diff(distances) >= 0)
+    with pytest.raises(KeyError):
+        loaded.neighbors(1)
+
+
+def test_refresh_matches_a_rebuild(tmp_path, vectors):
+    product_ids = np.arange(1, len(vectors) + 1, dtype=np.uint32)
+    table = NeighborTable.build(product_ids[:500], vectors[:500], str(tmp_path), k=K, tile_size=128, workers=2)
+    before = np.array(table.neighbor_ids)
+    changed = table.refresh(product_ids[500:], vectors[500:], tile_size=128, workers=2)
+
+    expected = product_ids[brute_force(vectors, K)]
+    np.testing.assert_array_equal(table.neighbor_ids, expected)
+    np.testing.assert_allclose(np.asarray(table.embeddings), normalize(vectors), rtol=1e-6)
+    edited = product_ids[:500][(before != expected[:500]).any(axis=1)]
+    assert sorted(changed.tolist()) == sorted(edited.tolist() + product_ids[500:].tolist())
+    np.testing.assert_array_equal(NeighborTable.load(str(tmp_path)).neighbor_ids, expected)
+
+
+def test_small_tables_are_padded(tmp_path, vectors):
+    table = NeighborTable.build(np.arange(1, 4, dtype=np.uint32), vectors[:3], str(tmp_path), k=K, workers=1)
+    assert table.neighbor_ids.shape == (3, K)
+    ids, distances = table.neighbors(1)
+    assert sorted(ids.tolist()) == [2, 3]
+    assert np.isinf(table.distances[0, 2:]).all()
+
+
+def test_main_without_clickhouse_only_writes_local_arrays(tmp_path, catalog, monkeypatch, capsys):
+    block = {key: value[:300] for key, value in catalog.items()}
+    path = str(tmp_path / "products.ndjson")
+    with ProductWriter(path, 300, block['embedding'].shape[1]) as writer:
+        writer.write(block)
+    output = str(tmp_path / "neighbors")
+    monkeypatch.setattr(sys, 'argv', ['neighbors.py', '--products', path, '--output', output, '--k', str(K),
+                                      '--workers', '1', '--no-clickhouse'])
+    neighbors.main()
+    assert neighbors.NEIGHBORS_TABLE not in capsys.readouterr().out
+    assert NeighborTable.load(output).neighbor_ids.shape == (300, K)
@@ -0,0 +1,88 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from generator import generate_products_batch
+from product_io import (MANIFEST_NAME, ProductWriter, batch_to_products, iter_product_batches, iter_products,
+                        read_embeddings)
+
+DIMENSIONS = 8
+
+
+@pytest.fixture(scope="module")
+def blocks():
+    return [generate_products_batch(n, seed=11 + i, start_id=100 * i + 1, dimensions=DIMENSIONS)
+            for i, n in enumerate([100, 100, 50])]
+
+
+def all_embeddings(blocks):
+    return np.concatenate([block['embedding'] for block in blocks])
+
+
+def write(path, blocks):
+    with ProductWriter(str(path), sum(len(block['product_id']) for block in blocks), DIMENSIONS) as writer:
+        for block in blocks:
+            writer.write(block)
+
+
+def expected_products(blocks):
+    return [product for block in blocks for product in batch_to_products(block)]
+
+
+def assert_round_trip(path, blocks):
+    products = list(iter_products(path, batch_size=64))
+    expected = expected_products(blocks)
+    assert len(products) == len(expected) == 250
+    for product, reference in zip(products, expected):
+        embedding = product.pop('embedding')
+        np.testing.assert_allclose(embedding, reference.pop('embedding'), rtol=1e-6)
+        assert product == reference
+
+
+@pytest.mark.parametrize("extension", [".json", ".ndjson", ".parquet"])
+def test_round_trip(tmp_path, blocks, extension):
+    path = tmp_path / f"products{extension}"
+    write(path, blocks)
+    assert_round_trip(str(path), blocks)
+
+
+@pytest.mark.parametrize("extension", [".ndjson", ".parquet"])
+def test_embeddings_go_to_a_sidecar(tmp_path, blocks, extension):
+    path = tmp_path / f"products{extension}"
+    write(path, blocks)
+    assert os.path.exists(tmp_path / "products.embeddings.npy")
+    np.testing.assert_array_equal(read_embeddings(str(path)), all_embeddings(blocks))
+    assert all('embedding' not in json.dumps(product) for product in iter_products(str(path), embeddings=False))
+
+
+def test_json_embeddings_are_read_inline(tmp_path, blocks):
+    path = tmp_path / "products.json"
+    write(path, blocks)
+    np.testing.assert_allclose(read_embeddings(str(path)), all_embeddings(blocks), rtol=1e-6)
+
+
+def test_batches_keep_column_types(tmp_path, blocks):
+    path = tmp_path / "products.parquet"
+    write(path, blocks)
+    batches = list(iter_product_batches(str(path), batch_size=100))
+    assert [len(batch['product_id']) for batch in batches] == [100, 100, 50]
+    batch = batches[0]
+    assert batch['product_id'].dtype == np.uint32
+    assert batch['date_added'].dtype == np.dtype('datetime64[s]')
+    assert batch['materials'] == blocks[0]['materials']
+    np.testing.assert_array_equal(batch['price_dollars'], blocks[0]['price_dollars'])
+
+
+def test_manifest_reads_shards_in_order(tmp_path, blocks):
+    shards = []
+    for i, block in enumerate(blocks):
+        name = f"shard-{i:05d}.ndjson"
+        write(tmp_path / name, [block])
+        shards.append({"path": name, "num_products": len(block['product_id'])})
+    with open(tmp_path / MANIFEST_NAME, "w") as f:
+        json.dump({"shards": shards}, f)
+    assert_round_trip(str(tmp_path), blocks)
+    assert_round_trip(str(tmp_path / MANIFEST_NAME), blocks)
+    np.testing.assert_array_equal(read_embeddings(str(tmp_path)), all_embeddings(blocks))
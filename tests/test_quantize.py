@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from ann import recall_at_k
+from quantize import PrefixIndex, QuantizedIndex, code_columns_ddl, pack_bits, quantize
+
+
+def test_int8_round_trip(embeddings):
+    codes = quantize(embeddings, 'int8')
+    decoded = codes['codes'].astype(np.float32) * codes['scales'][:, None]
+    np.testing.assert_allclose(decoded, embeddings, atol=np.abs(embeddings).max() / 127)
+
+
+def test_pack_bits_counts_differing_signs():
+    a = np.array([[1, -1, 1, -1] * 20], dtype=np.float32)
+    b = a.copy()
+    b[0, :5] *= -1
+    assert int(np.bitwise_count(pack_bits(a) ^ pack_bits(b)).sum()) == 5
+
+
+@pytest.mark.parametrize("kind", ['float16', 'int8'])
+def test_decoded_scan_matches_block_scan(embeddings, queries, kind):
+    decoded = QuantizedIndex.build(embeddings, kind, decode=True)
+    blocks = QuantizedIndex.build(embeddings, kind)
+    for query in queries:
+        np.testing.assert_array_equal(decoded.search(query, 10)[0], blocks.search(query, 10)[0])
+
+
+@pytest.mark.parametrize("kind", ['float16', 'int8', 'binary'])
+def test_code_scan_holds_less_than_the_vectors(embeddings, queries, kind):
+    index = QuantizedIndex.build(embeddings, kind)
+    index.search(queries[0], 10)
+    assert index.resident_bytes < embeddings.nbytes
+    decoded = QuantizedIndex.build(embeddings, kind, decode=True)
+    decoded.search(queries[0], 10)
+    if kind != 'binary':
+        assert decoded.resident_bytes > embeddings.nbytes
+
+
+@pytest.mark.parametrize("kind,minimum", [('float16', 0.99), ('int8', 0.95), ('binary', 0.5)])
+def test_reranked_recall(embeddings, queries, kind, minimum):
+    index = QuantizedIndex.build(embeddings, kind)
+    assert recall_at_k(index, embeddings, queries, k=10, rerank=100) >= minimum
+
+
+def test_prefix_index_recall(embeddings, queries):
+    index = PrefixIndex.build(embeddings, 16)
+    assert index.dimensions == 16
+    assert recall_at_k(index, embeddings, queries, k=10, rerank=200) > 0.5
+
+
+def test_save_and_load(tmp_path, embeddings, queries):
+    index = QuantizedIndex.build(embeddings, 'int8')
+    index.save(tmp_path)
+    loaded = QuantizedIndex.load(tmp_path, embeddings)
+    np.testing.assert_array_equal(loaded.search(queries[0], 10)[0], index.search(queries[0], 10)[0])
+
+
+class SettingsClient:
+    """Answers the two system-table queries bfloat16_supported makes"""
+
+    def __init__(self, has_type, setting):
+        self.has_type = has_type
+        self.setting = setting
+
+    def command(self, sql):
+        if 'data_type_families' in sql:
+            return int(self.has_type)
+        return [] if self.setting is None else [self.setting]
+
+
+@pytest.mark.parametrize("has_type,setting,column_type", [
+    (True, None, 'Array(BFloat16)'),
+    (True, '1', 'Array(BFloat16)'),
+    (True, '0', 'Array(Float32)'),
+    (False, None, 'Array(Float32)'),
+])
+def test_float16_codes_fall_back_without_bfloat16(has_type, setting, column_type):
+    assert f'embedding_f16 {column_type}' in code_columns_ddl('float16', SettingsClient(has_type, setting))
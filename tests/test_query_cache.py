@@ -0,0 +1,100 @@
+import time
+import threading
+
+import pytest
+
+from query_cache import QueryEmbeddingCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hits_are_normalized_and_expire():
+    calls = []
+    clock = Clock()
+    cache = QueryEmbeddingCache(lambda text: calls.append(text) or [len(text)], 'model', ttl=10, clock=clock)
+    assert cache.get('Red Lamp') == [8]
+    assert cache.get('  red   lamp ') == [8]
+    assert calls == ['Red Lamp']
+    clock.now = 11
+    cache.get('red lamp')
+    assert len(calls) == 2
+
+
+def test_lru_eviction():
+    calls = []
+    cache = QueryEmbeddingCache(lambda text: calls.append(text) or [text], 'model', max_entries=2)
+    for text in ['a', 'b', 'a', 'c', 'a', 'b']:
+        cache.get(text)
+    # c evicts b (a was used more recently), then b evicts c
+    assert calls == ['a', 'b', 'c', 'b']
+    assert len(cache) == 2
+    assert cache.stats()['hits'] == 2
+
+
+def test_failed_embedding_is_not_cached():
+    calls = []
+
+    def flaky_embed(text):
+        calls.append(text)
+        if len(calls) == 1:
+            raise ConnectionError("embedding endpoint down")
+        return [1.0]
+
+    cache = QueryEmbeddingCache(flaky_embed, 'model')
+    with pytest.raises(ConnectionError):
+        cache.get('lamp')
+    assert cache.get('lamp') == [1.0]
+    assert calls == ['lamp', 'lamp']
+
+
+def test_get_many_embeds_misses_in_one_call():
+    batches = []
+    cache = QueryEmbeddingCache(None, 'model',
+                                embed_many_fn=lambda texts: batches.append(texts) or [text.upper() for text in texts])
+    cache.get_many(['a'])
+    assert cache.get_many(['a', 'b', 'c', 'B ']) == ['A', 'B', 'C', 'B']
+    assert batches == [['a'], ['b', 'c']]
+
+
+def test_concurrent_lookups_share_one_call():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_embed(text):
+        calls.append(text)
+        started.set()
+        release.wait()
+        return [1.0]
+
+    cache = QueryEmbeddingCache(slow_embed, 'model')
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('lamp'))) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while cache.coalesced < 4 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == ['lamp']
+    assert results == [[1.0]] * 5
+
+
+def test_put_and_cached_skip_the_embedding_call():
+    cache = QueryEmbeddingCache(None, 'model', max_entries=2)
+    assert cache.cached('lamp') is None
+    cache.put('Lamp', [1.0])
+    cache.put('radio', [2.0])
+    assert cache.cached(' LAMP ') == [1.0]
+    cache.put('clock', [3.0])
+    assert cache.cached('radio') is None
+    assert cache.stats()['entries'] == 2
@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import search
+from filters import ProductFilter
+from product_io import ProductWriter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_after(statement):
+    """Heavy modules loaded by running statement in a fresh interpreter"""
+    code = (f"import sys; {statement}; "
+            "print(' '.join(m for m in ('openai', 'pandas', 'torch', 'sentence_transformers') if m in sys.modules))")
+    return subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                          check=True).stdout.split()
+
+
+def test_search_imports_without_clients_or_pandas():
+    assert imported_after("import search") == []
+    assert imported_after("import cli") == []
+
+
+class StubExternalData:
+    def __init__(self):
+        self.files = {}
+
+    def add_file(self, file_name, data, fmt, structure):
+        self.files[file_name] = data
+
+
+@pytest.fixture
+def source_file(tmp_path, catalog):
+    path = str(tmp_path / "products.ndjson")
+    with ProductWriter(path, len(catalog['product_id']), catalog['embedding'].shape[1]) as writer:
+        writer.write(catalog)
+    search.reset_source_indexes(path)
+    yield path
+    search.reset_source_indexes(search.PRODUCTS_PATH)
+
+
+def test_selective_filters_become_an_id_list(source_file, products):
+    product_filter = ProductFilter(category='Electronics', decade=(1980, 1990))
+    external_data = StubExternalData()
+    sql = search.filter_sql(product_filter, external_data)
+    assert sql == f'product_id IN filter_ids AND ({product_filter.to_sql()})'
+    ids = np.frombuffer(external_data.files['filter_ids'], dtype='<u4')
+    expected = products[(products['category'] == 'Electronics') & products['decade'].between(1980, 1989)]
+    np.testing.assert_array_equal(ids, expected['product_id'])
+    # Only the filter index was built
+    assert search.source_indexes()._keyword_index is None
+
+
+def test_broad_filters_and_raw_sql_go_out_as_sql(source_file):
+    product_filter = ProductFilter(condition=(2.0, None))
+    external_data = StubExternalData()
+    assert search.filter_sql(product_filter, external_data) == product_filter.to_sql()
+    assert search.filter_sql("price_dollars < 100", external_data) == "price_dollars < 100"
+    assert external_data.files == {}
+
+
+def test_filters_matching_too_many_ids_go_out_as_sql(source_file, monkeypatch):
+    product_filter = ProductFilter(category='Electronics', decade=(1980, 1990))
+    monkeypatch.setattr(search, 'MAX_FILTER_IDS', 5)
+    external_data = StubExternalData()
+    assert search.filter_sql(product_filter, external_data) == product_filter.to_sql()
+    assert external_data.files == {}
+
+
+def test_filters_fall_back_to_sql_without_the_source_file(tmp_path):
+    search.reset_source_indexes(str(tmp_path / "missing.ndjson"))
+    try:
+        product_filter = ProductFilter(category='Electronics', decade=(1980, 1990))
+        assert search.filter_sql(product_filter, StubExternalData()) == product_filter.to_sql()
+    finally:
+        search.reset_source_indexes(search.PRODUCTS_PATH)
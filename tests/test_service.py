@@ -0,0 +1,201 @@
+import json
+import asyncio
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from query_cache import QueryEmbeddingCache, normalize_query
+from service import ARROW_STREAM, QueryService, ServiceOverloaded, handle_connection, local_scorer
+
+
+class FakeEmbedder:
+    """Async stand-in for the embedding endpoint: a fixed vector per text, one call per batch recorded"""
+
+    def __init__(self, embeddings, delay=0.01):
+        self.embeddings = embeddings
+        self.delay = delay
+        self.calls = []
+
+    def vector(self, text):
+        return self.embeddings[sum(map(ord, text)) % len(self.embeddings)]
+
+    async def __call__(self, texts):
+        self.calls.append(list(texts))
+        await asyncio.sleep(self.delay)
+        return [self.vector(text) for text in texts]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def post_search(service_args, body, accept='application/json'):
+    """POST /search to a handle_connection server on a free port; returns the status line, headers and
+    the de-chunked body"""
+    async def main():
+        async with QueryService(*service_args, batch_window=0.02) as service:
+            server = await asyncio.start_server(lambda r, w: handle_connection(service, r, w), '127.0.0.1', 0)
+            async with server:
+                reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+                data = json.dumps(body).encode()
+                writer.write(f"POST /search HTTP/1.1\r\nAccept: {accept}\r\nContent-Length: {len(data)}\r\n\r\n"
+                             .encode() + data)
+                await writer.drain()
+                response = await reader.read()
+                writer.close()
+                return response
+
+    head, _, rest = run(main()).partition(b"\r\n\r\n")
+    status, *header_lines = head.decode().split("\r\n")
+    headers = dict(line.split(': ', 1) for line in header_lines)
+    if headers.get('Transfer-Encoding') != 'chunked':
+        return status, headers, rest
+    chunks = []
+    while True:
+        size, _, rest = rest.partition(b"\r\n")
+        size = int(size, 16)
+        if not size:
+            assert rest == b"\r\n", "data after the terminating chunk"
+            return status, headers, b''.join(chunks)
+        chunks.append(rest[:size])
+        assert rest[size:size + 2] == b"\r\n"
+        rest = rest[size + 2:]
+
+
+def test_concurrent_requests_share_embedding_calls_and_match_direct_search(backend, embeddings):
+    embedder = FakeEmbedder(embeddings)
+    texts = [f'query {i}' for i in range(40)]
+
+    async def main():
+        async with QueryService(embedder, local_scorer(backend), batch_window=0.05) as service:
+            return await asyncio.gather(*[service.search(text, top_n=3, columns=['product_id', 'name'])
+                                          for text in texts])
+
+    results = run(main())
+    assert len(embedder.calls) < len(texts)
+    assert sorted(text for call in embedder.calls for text in call) == sorted(texts)
+    for text, result in zip(texts, results):
+        assert list(result.columns) == ['product_id', 'name', 'distance']
+        expected = backend.search_vector(embedder.vector(text), top_n=3)
+        assert result['product_id'].tolist() == expected['product_id'].tolist()
+
+
+def test_batch_size_is_bounded(backend, embeddings):
+    embedder = FakeEmbedder(embeddings)
+
+    async def main():
+        async with QueryService(embedder, local_scorer(backend), batch_window=0.05, max_batch_size=8) as service:
+            await asyncio.gather(*[service.search(f'query {i}') for i in range(30)])
+
+    run(main())
+    assert max(len(call) for call in embedder.calls) <= 8
+
+
+def test_duplicate_and_cached_texts_are_embedded_once(backend, embeddings):
+    embedder = FakeEmbedder(embeddings)
+    cache = QueryEmbeddingCache(None, 'model')
+
+    async def main():
+        async with QueryService(embedder, local_scorer(backend), cache, batch_window=0.05) as service:
+            await asyncio.gather(*[service.search(text) for text in ['lamp', 'Lamp ', 'radio']])
+            await service.search('radio')
+
+    run(main())
+    assert [sorted(map(normalize_query, call)) for call in embedder.calls] == [['lamp', 'radio']]
+    assert cache.cached('LAMP') is not None
+
+
+def test_per_request_timeout(backend, embeddings):
+    async def main():
+        async with QueryService(FakeEmbedder(embeddings, delay=1.0), local_scorer(backend)) as service:
+            with pytest.raises(asyncio.TimeoutError):
+                await service.search('slow', timeout=0.05)
+
+    run(main())
+
+
+def test_overload_rejects_beyond_max_pending(backend, embeddings):
+    async def main():
+        async with QueryService(FakeEmbedder(embeddings, delay=0.5), local_scorer(backend), max_batch_size=1,
+                                max_concurrent_batches=1, max_pending=4, timeout=0.2) as service:
+            return await asyncio.gather(*[service.search(f'query {i}') for i in range(20)],
+                                        return_exceptions=True)
+
+    results = run(main())
+    rejected = [result for result in results if isinstance(result, ServiceOverloaded)]
+    assert rejected
+    assert len(rejected) < len(results)
+
+
+def test_scoring_errors_reach_every_request(embeddings):
+    async def failing_scorer(vectors, top_n, filter_conditions, columns):
+        raise RuntimeError("scorer down")
+
+    async def main():
+        async with QueryService(FakeEmbedder(embeddings), failing_scorer, batch_window=0.02) as service:
+            return await asyncio.gather(*[service.search(f'query {i}') for i in range(5)], return_exceptions=True)
+
+    results = run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_embeddings_are_normalized_before_scoring(embeddings):
+    seen = []
+
+    async def scorer(vectors, top_n, filter_conditions, columns):
+        seen.append(vectors)
+        raise RuntimeError("stop")
+
+    async def main():
+        async with QueryService(FakeEmbedder(embeddings * 3), scorer) as service:
+            with pytest.raises(RuntimeError):
+                await service.search('lamp')
+
+    run(main())
+    np.testing.assert_allclose(np.linalg.norm(seen[0], axis=1), 1, rtol=1e-5)
+
+
+def test_http_ndjson_streams_one_line_per_query(backend, embeddings):
+    embedder = FakeEmbedder(embeddings)
+    texts = ['lamp', 'radio', 'chair']
+    status, headers, body = post_search((embedder, local_scorer(backend)),
+                                        {'queries': texts, 'top_n': 3, 'columns': ['product_id', 'name']})
+    assert status == 'HTTP/1.1 200 OK'
+    lines = sorted((json.loads(line) for line in body.splitlines()), key=lambda line: line['qid'])
+    assert [line['query'] for line in lines] == texts
+    for line in lines:
+        expected = backend.search_vector(embedder.vector(line['query']), top_n=3)
+        assert [row['product_id'] for row in line['results']] == expected['product_id'].tolist()
+
+
+def test_http_arrow_stream_matches_direct_search(backend, embeddings):
+    embedder = FakeEmbedder(embeddings)
+    texts = ['lamp', 'radio', 'chair']
+    status, headers, body = post_search((embedder, local_scorer(backend)), {'queries': texts, 'top_n': 3},
+                                        accept=ARROW_STREAM)
+    assert headers['Content-Type'] == ARROW_STREAM
+    table = pa.ipc.open_stream(body).read_all()
+    assert table.schema.field('materials').type == pa.list_(pa.string())
+    for qid, text in enumerate(texts):
+        rows = table.filter(pa.compute.equal(table['qid'], qid))
+        expected = backend.search_vector(embedder.vector(text), top_n=3)
+        assert rows['product_id'].to_pylist() == expected['product_id'].tolist()
+
+
+def test_http_arrow_stream_with_empty_results(backend, embeddings):
+    status, headers, body = post_search((FakeEmbedder(embeddings), local_scorer(backend)),
+                                        {'queries': ['lamp', 'radio'],
+                                         'filter': {'category': 'Electronics', 'price': [0, 1]}},
+                                        accept=ARROW_STREAM)
+    assert status == 'HTTP/1.1 200 OK'
+    table = pa.ipc.open_stream(body).read_all()
+    assert table.num_rows == 0
+    assert table.schema.field('colors').type == pa.list_(pa.string())
+
+
+def test_http_rejects_unknown_columns(backend, embeddings):
+    status, headers, body = post_search((FakeEmbedder(embeddings), local_scorer(backend)),
+                                        {'query': 'lamp', 'columns': ['product_id', 'embedding']})
+    assert status == 'HTTP/1.1 400 Bad Request'
+    assert 'embedding' in json.loads(body)['error']
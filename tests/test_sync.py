@@ -0,0 +1,52 @@
+import numpy as np
+
+from product_io import take_rows
+from sync import LoadedProducts, content_hashes, diff_batches
+
+
+def blocks(catalog, size=1000):
+    n = len(catalog['product_id'])
+    return [take_rows(catalog, np.arange(start, min(start + size, n))) for start in range(0, n, size)]
+
+
+def loaded_from(catalog, rows):
+    batch = take_rows(catalog, rows)
+    order = np.argsort(batch['product_id'])
+    return LoadedProducts(np.asarray(batch['product_id'])[order], content_hashes(batch)[order])
+
+
+def test_first_sync_inserts_everything(catalog):
+    stats = {}
+    batches = list(diff_batches(blocks(catalog), LoadedProducts(np.empty(0, np.uint32), np.empty(0, np.uint64)),
+                                version=1, stats=stats))
+    assert stats == {'scanned': 3000, 'new': 3000, 'changed': 0, 'unchanged': 0}
+    assert sum(len(batch['product_id']) for batch in batches) == 3000
+    assert all((batch['version'] == 1).all() for batch in batches)
+
+
+def test_counts_new_changed_and_unchanged(catalog):
+    # The table holds the first 2500 products; 10 of them were edited in the source since
+    loaded = loaded_from(catalog, np.arange(2500))
+    source = take_rows(catalog, np.arange(3000))
+    source['description'] = list(source['description'])
+    for i in range(0, 100, 10):
+        source['description'][i] += " Restored."
+    stats = {}
+    batches = list(diff_batches(blocks(source), loaded, version=2, stats=stats))
+    assert stats == {'scanned': 3000, 'new': 500, 'changed': 10, 'unchanged': 2490}
+    kept = np.concatenate([batch['product_id'] for batch in batches])
+    assert len(kept) == 510
+    assert len(loaded.missing()) == 0
+
+
+def test_unchanged_source_yields_nothing(catalog):
+    loaded = loaded_from(catalog, np.arange(3000))
+    stats = {}
+    assert list(diff_batches(blocks(catalog), loaded, stats=stats)) == []
+    assert stats['unchanged'] == 3000
+
+
+def test_missing_lists_products_absent_from_the_source(catalog):
+    loaded = loaded_from(catalog, np.arange(3000))
+    list(diff_batches(blocks(take_rows(catalog, np.arange(2900))), loaded))
+    assert loaded.missing().tolist() == catalog['product_id'][2900:].tolist()